@@ -0,0 +1,13 @@
+# asgi.py - Serve the API routes from an ASGI server, e.g.
+#   uvicorn asgi:app --app-dir api --host 0.0.0.0 --port 5000
+#   gunicorn -k uvicorn.workers.UvicornWorker --chdir api asgi:app
+from index import app as flask_app
+from models.asgi_server import AsgiServer
+
+app = AsgiServer(flask_app)
+
+if __name__ == '__main__':
+    import os
+    import uvicorn
+
+    uvicorn.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
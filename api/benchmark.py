@@ -0,0 +1,276 @@
+# benchmark.py - Time the key API and model paths against a generated farm
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+# Measure the work itself: no cached responses, no background training, and
+# model artifacts kept out of api/trained_models
+os.environ.setdefault('RESPONSE_CACHE', 'off')
+os.environ.setdefault('MODEL_SCHEDULER', 'off')
+os.environ.setdefault('PREDICTION_CACHE', 'off')
+
+DEFAULT_BREEDS = ('Rhode Island Red', 'Leghorn', 'Sussex', 'Plymouth Rock', 'Orpington')
+FEED_TYPES = ('Layer feed', 'Grower feed', 'Scratch grains', 'Oyster shell')
+SYMPTOMS = ('Lethargy', 'Reduced appetite', 'Ruffled feathers', 'Diarrhea', 'Sneezing')
+
+# Median slowdown, relative to a baseline, reported as a regression
+REGRESSION_THRESHOLD = 0.2
+
+
+def generate_farm(chickens, days, breeds=DEFAULT_BREEDS, sick_rate=0.05, seed=42):
+    """
+    Fill the current database with a flock of the given size and `days` of
+    history up to today: daily egg records, a feed schedule per chicken and
+    weekly health checks, with extra records while a chicken is sick.
+    Returns row counts per table.
+    """
+    from models.database import get_connection
+    from models.farm_model import FarmModel
+
+    rng = random.Random(seed)
+    farm_model = FarmModel()
+    conn = get_connection()
+    today = date.today()
+    first_day = today - timedelta(days=days - 1)
+
+    # Chickens arrive over the period; inserted directly so date_added can
+    # lie in the past, then the feature store is rebuilt below
+    flock = []
+    for number in range(chickens):
+        added = first_day + timedelta(days=rng.randrange(max(days // 2, 1)))
+        status = 'sick' if rng.random() < sick_rate else ('recovery' if rng.random() < sick_rate else 'healthy')
+        flock.append((f'Hen {number + 1}', rng.choice(breeds), rng.randint(10, 120), status,
+                      datetime.combine(added, datetime.min.time()).isoformat(), 'Twice daily', ''))
+    with conn:
+        conn.executemany('''
+            INSERT INTO chickens (name, breed, age, health_status, date_added, feeding_schedule, notes)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', flock)
+    rows = conn.execute('SELECT id, date_added FROM chickens ORDER BY id').fetchall()
+    added_days = {chicken_id: date.fromisoformat(date_added[:10]) for chicken_id, date_added in rows}
+
+    farm_model.record_feed_schedule_bulk([
+        {'chicken_id': chicken_id, 'feed_type': rng.choice(FEED_TYPES), 'scheduled_time': scheduled_time,
+         'amount': round(rng.uniform(40, 70), 1)}
+        for chicken_id in added_days for scheduled_time in ('07:00', '17:00')
+    ])
+
+    # One bulk write per day, as a daily import would do
+    sick = {chicken_id for chicken_id in added_days if rng.random() < sick_rate}
+    for offset in range(days):
+        day = first_day + timedelta(days=offset)
+        eggs, checks = [], []
+        for chicken_id, added in added_days.items():
+            if added > day:
+                continue
+            if chicken_id in sick:
+                if rng.random() < 0.2:
+                    sick.discard(chicken_id)
+            elif rng.random() < sick_rate / 7:
+                sick.add(chicken_id)
+
+            if rng.random() < (0.3 if chicken_id in sick else 0.8):
+                eggs.append({'chicken_id': chicken_id, 'date': f'{day}T{rng.randint(6, 11):02d}:00:00',
+                             'quantity': 2 if rng.random() < 0.05 else 1})
+            if chicken_id in sick and rng.random() < 0.5:
+                checks.append({'chicken_id': chicken_id, 'date': f'{day}T15:00:00', 'health_status': 'sick',
+                               'symptoms': rng.choice(SYMPTOMS), 'treatment': 'Isolated and observed'})
+            elif (day - added).days % 7 == 0:
+                checks.append({'chicken_id': chicken_id, 'date': f'{day}T15:00:00', 'health_status': 'healthy'})
+        farm_model.record_egg_production_bulk(eggs)
+        farm_model.record_health_check_bulk(checks)
+
+    farm_model.rebuild_chicken_features()
+    return {
+        table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+        for table in ('chickens', 'egg_production', 'feed_schedule', 'health_records')
+    }
+
+
+def measure(fn, repeat):
+    """Seconds taken by each of `repeat` calls of fn, after one untimed warm-up call"""
+    fn()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(timings):
+    """Milliseconds statistics of one benchmark"""
+    ordered = sorted(timings)
+    ms = lambda seconds: round(seconds * 1000, 3)
+    return {
+        'runs': len(ordered),
+        'min_ms': ms(ordered[0]),
+        'median_ms': ms(statistics.median(ordered)),
+        'mean_ms': ms(statistics.fmean(ordered)),
+        'p95_ms': ms(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]),
+        'max_ms': ms(ordered[-1]),
+    }
+
+
+def benchmarks(sample_size, seed=42):
+    """(name, callable) pairs for the HTTP routes and model paths being measured"""
+    from index import app
+    from models.ai_model import health_model, production_model
+    from models.chicken_model import ChickenModel
+    from models.farm_model import FarmModel
+
+    client = app.test_client()
+    chicken_model = ChickenModel()
+    farm_model = FarmModel()
+    chickens = chicken_model.get_all_chickens()
+    sample = random.Random(seed).sample(chickens, min(sample_size, len(chickens)))
+
+    # Requests never fit a model, so without this the routes and predictions
+    # would time the heuristics served until one is trained
+    health_model.train_model()
+    production_model.train_model()
+
+    def get(path):
+        def request():
+            response = client.get(path)
+            if response.status_code != 200:
+                raise RuntimeError(f'GET {path} returned {response.status_code}')
+            response.get_data()
+        return request
+
+    def per_chicken(predict):
+        # One single-chicken call after another, as the detail routes make them
+        return lambda: [predict(chicken_model.get_chicken(chicken['id'])) for chicken in sample]
+
+    return [
+        ('http.dashboard', get('/api/dashboard')),
+        ('http.chickens', get('/api/chickens')),
+        ('http.chickens_with_predictions', get('/api/chickens?include=predictions')),
+        ('http.chicken_detail', get(f'/api/chickens/{sample[0]["id"]}')),
+        ('http.egg_summary_week', get('/api/eggs/summary?period=week')),
+        ('http.health_records', get('/api/health/records')),
+        ('model.get_health_records', farm_model.get_health_records),
+        ('model.get_chicken_features', farm_model.get_chicken_features),
+        ('model.health.prepare_data', health_model.prepare_data),
+        ('model.production.prepare_data', production_model.prepare_data),
+        ('model.health.train_model', lambda: health_model.train_model(save=False)),
+        ('model.production.train_model', lambda: production_model.train_model(save=False)),
+        (f'model.health.predict_x{len(sample)}', per_chicken(health_model.predict_health_risk)),
+        (f'model.production.predict_x{len(sample)}', per_chicken(production_model.predict_production)),
+        ('model.health.predict_batch_all', lambda: health_model.predict_health_risk_batch(chickens)),
+        ('model.production.predict_batch_all', lambda: production_model.predict_production_batch(chickens)),
+    ]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Print median changes against a baseline run; returns the names that regressed"""
+    if baseline['farm'] != results['farm']:
+        print("Warning: the baseline was measured on a different farm size")
+    regressions = []
+    print(f"\nAgainst {baseline.get('commit') or 'baseline'} (median, regression above +{threshold:.0%}):")
+    for name, stats in results['benchmarks'].items():
+        before = baseline['benchmarks'].get(name)
+        if not before:
+            print(f"  {name:<40} {stats['median_ms']:>10.3f} ms  (new)")
+            continue
+        change = stats['median_ms'] / before['median_ms'] - 1 if before['median_ms'] else 0.0
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"  {name:<40} {before['median_ms']:>10.3f} -> {stats['median_ms']:>10.3f} ms  {change:+7.1%}{flag}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the API and AI models on a generated farm')
+    parser.add_argument('--chickens', type=int, default=500, help='flock size (default 500)')
+    parser.add_argument('--days', type=int, default=90, help='days of history (default 90)')
+    parser.add_argument('--breeds', default=','.join(DEFAULT_BREEDS), help='comma-separated breeds to draw from')
+    parser.add_argument('--sick-rate', type=float, default=0.05,
+                        help='share of chickens sick at the start, and weekly chance of falling sick (default 0.05)')
+    parser.add_argument('--seed', type=int, default=42, help='random seed of the generated farm')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per benchmark (default 5)')
+    parser.add_argument('--sample', type=int, default=50,
+                        help='chickens predicted one at a time by the per-chicken benchmarks (default 50)')
+    parser.add_argument('--database', help='generate into this file and keep it (default: a temporary file)')
+    parser.add_argument('--existing', action='store_true', help='benchmark --database as it is, without generating')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', metavar='BASELINE', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help='median slowdown reported as a regression (default 0.2 = 20%%)')
+    args = parser.parse_args()
+
+    if args.existing and not (args.database and os.path.exists(args.database)):
+        parser.error('--existing needs the path of a database with --database')
+
+    workdir = tempfile.mkdtemp(prefix='farm-benchmark-')
+    os.environ.setdefault('MODEL_PATH', os.path.join(workdir, 'trained_models'))
+    database = os.path.abspath(args.database or os.path.join(workdir, 'chicken_farm.db'))
+    if not args.existing:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(database + suffix):
+                os.remove(database + suffix)
+
+    # Point the shared connection manager at the benchmark database before
+    # any model touches it
+    from models.database import db
+    db.database = database
+
+    try:
+        if args.existing:
+            farm = {'database': database}
+        else:
+            print(f"Generating {args.chickens} chickens with {args.days} days of history...")
+            start = time.perf_counter()
+            farm = generate_farm(args.chickens, args.days, tuple(args.breeds.split(',')), args.sick_rate, args.seed)
+            print(f"Generated {farm} in {time.perf_counter() - start:.1f}s")
+            farm.update(days=args.days, sick_rate=args.sick_rate, seed=args.seed)
+
+        results = {
+            'commit': git_commit(),
+            'created_at': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'farm': farm,
+            'repeat': args.repeat,
+            'benchmarks': {}
+        }
+        for name, fn in benchmarks(args.sample, args.seed):
+            stats = summarize(measure(fn, args.repeat))
+            results['benchmarks'][name] = stats
+            print(f"  {name:<40} median {stats['median_ms']:>10.3f} ms  p95 {stats['p95_ms']:>10.3f} ms")
+    finally:
+        db.close_all()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) regressed")
+            sys.exit(1)
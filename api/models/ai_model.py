@@ -1,34 +1,64 @@
-from sklearn.linear_model import LinearRegression
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.preprocessing import StandardScaler
-import numpy as np
-import pandas as pd
-import joblib
-import sqlite3
-import os
-from datetime import datetime, timedelta
-import json
+from models.startup import timed
+
+with timed('import scikit-learn'):
+    from sklearn.linear_model import LinearRegression
+    from sklearn.ensemble import RandomForestClassifier
+    import numpy as np
 from models.chicken_model import ChickenModel
 from models.farm_model import FarmModel
-
-class HealthPredictionModel:
+# flock_snapshot is used through this module by api/index.py, which
+# imports it lazily
+from models.flock_snapshot import FlockColumns, flock_snapshot
+from models.model_registry import RegisteredModel
+from models.profiling import phase
+from models.training_scheduler import TrainingScheduler
+
+def breed_factor(breed):
+    """Production factor of a breed (simplified)"""
+    breed = (breed or '').lower()
+    if 'rhode' in breed:
+        return 1.2
+    if 'sussex' in breed:
+        return 1.1
+    return 1.0
+
+class HealthPredictionModel(RegisteredModel):
     """
     AI model for predicting health issues in chickens
     """
+    name = 'health'
+    training_tables = ('chickens', 'health_records')
+    # 2: recent_health_issues counts non-healthy records of the last 14 days
+    # from the feature store instead of every record
+    feature_version = 2
+    classification = True
+    scoring = {'accuracy': 'accuracy'}
+    selection_metric = 'accuracy'
+
     def __init__(self):
-        self.model = RandomForestClassifier(n_estimators=100, random_state=42)
-        self.scaler = StandardScaler()
-        self.is_trained = False
+        super().__init__()
         self.chicken_model = ChickenModel()
         self.farm_model = FarmModel()
 
+    def build_estimator(self):
+        return RandomForestClassifier(n_estimators=100, random_state=42)
+
+    def search_space(self):
+        """
+        Candidate forests for model selection: tree count and depth
+        """
+        return [{
+            'model': [RandomForestClassifier(random_state=42)],
+            'model__n_estimators': [50, 100, 200, 400],
+            'model__max_depth': [None, 4, 8, 16]
+        }]
+
     def prepare_data(self):
         """
         Prepare training data from the database
         """
-        # Get chickens and health records from the database
-        chickens = self.chicken_model.get_all_chickens()
-        health_records = self.farm_model.get_health_records()
+        # Get chickens and their precomputed features
+        chickens = self.farm_model.attach_features(self.chicken_model.get_all_chickens())
 
         if len(chickens) == 0:
             # If no data exists, create synthetic data for initial training
@@ -45,15 +75,11 @@ class HealthPredictionModel:
 
         for chicken in chickens:
             age = chicken.get('age', 0)
-            # Calculate if the chicken has had health issues recently
-            recent_issues = len([hr for hr in health_records if hr['chicken_id'] == chicken['id'] and
-                                (datetime.now() - datetime.fromisoformat(hr['date'].split('.')[0])).days <= 14])
+            # Health issues recorded recently
+            recent_issues = chicken.get('recent_health_issues', 0)
 
             # Features: [age, recent_health_issues, days_since_added]
-            try:
-                days_since_added = (datetime.now() - datetime.fromisoformat(chicken['date_added'].split('.')[0])).days
-            except:
-                days_since_added = 0
+            days_since_added = chicken.get('days_since_added', 0)
 
             # Health status is a target: 0=healthy, 1=unhealthy
             status = 0 if chicken['health_status'] == 'healthy' else 1
@@ -70,72 +96,131 @@ class HealthPredictionModel:
             y = (X[:, 0]*0.1 + X[:, 1]*0.2 + X[:, 2]*0.3 + X[:, 3]*0.4 + np.random.rand(50)*20 > 50).astype(int)
             return X, y
 
-    def train_model(self):
+    def _feature_matrix(self, flock):
         """
-        Train the health prediction model
+        Build the [age, recent_health_issues, days_since_added, unhealthy]
+        feature matrix of FlockColumns
         """
-        X, y = self.prepare_data()
-
-        # Scale features
-        X_scaled = self.scaler.fit_transform(X)
-
-        self.model.fit(X_scaled, y)
-        self.is_trained = True
+        return np.column_stack([
+            flock.age,
+            flock.recent_health_issues,
+            flock.days_since_added,
+            ~flock.status_is('healthy')
+        ]).astype(float).reshape(-1, 4)
+
+    def score_flock(self, flock):
+        """
+        Needs-attention flags and their probabilities for every row of
+        FlockColumns, with a single scaler and model call for the rows the
+        prediction cache does not hold
+        """
+        if not self.ensure_trained():
+            return self.heuristic_scores(flock)
+        # One read, so a model swapped in meanwhile is not mixed with the old scaler
+        fitted = self.fitted
+
+        if not len(flock):
+            return np.zeros(0, dtype=bool), np.zeros(0)
+
+        with phase('inference'):
+            # predict() is the argmax of predict_proba(), so one call gives both
+            probabilities = self.infer_cached(fitted, flock.ids, self._feature_matrix(flock), 'predict_proba')
+            predictions = fitted[0].classes_[probabilities.argmax(axis=1)]
+            confidences = probabilities.max(axis=1)
+        return predictions == 1, confidences
+
+    def heuristic_scores(self, flock):
+        """
+        Needs-attention flags and weighted scores in [0, 1] for every row of
+        FlockColumns, served while no fitted model is available
+        """
+        with phase('inference'):
+            recent_issues = flock.recent_health_issues.astype(float)
+            unhealthy = (~flock.status_is('healthy')).astype(float)
+            scores = np.clip(
+                0.4 * (recent_issues / (1 + recent_issues)) + 0.3 * unhealthy
+                + 0.3 * np.minimum(flock.age / 100.0, 1.0), 0.0, 1.0
+            )
+        return scores >= 0.5, scores
+
+    def predict_flock_health_risk(self, flock):
+        """
+        Health risk of every row of FlockColumns
+        """
+        needs_attention, confidences = self.score_flock(flock)
+        return [
+            {
+                "risk_level": "high" if needs else "low",
+                "probability": float(confidence),
+                "needs_attention": bool(needs),
+                "recommendation": "Monitor closely" if needs else "Continue regular care"
+            } for needs, confidence in zip(needs_attention, confidences)
+        ]
+
+    def predict_health_risk_batch(self, chickens):
+        """
+        Predict health risk for many chickens with a single scaler and model call
+        """
+        # Fill in features the caller did not supply from the feature store
+        chickens = self.farm_model.attach_features(chickens) if chickens else chickens
+        return self.predict_flock_health_risk(FlockColumns.from_chickens(chickens))
 
     def predict_health_risk(self, chicken_data):
         """
         Predict health risk for a chicken based on its data
         """
-        if not self.is_trained:
-            self.train_model()
-
-        # Prepare features from chicken data
-        age = chicken_data.get('age', 0)
-
-        # Calculate features based on what we know about the chicken
-        features = np.array([[
-            age,
-            chicken_data.get('recent_health_issues', 0),
-            chicken_data.get('days_since_added', 0),
-            1 if chicken_data.get('health_status') != 'healthy' else 0
-        ]])
-
-        # Scale features
-        features_scaled = self.scaler.transform(features)
-
-        prediction = self.model.predict(features_scaled)[0]
-        probability = self.model.predict_proba(features_scaled)[0]
-
-        risk_level = "high" if prediction == 1 else "low"
-        probability_value = float(probability[1]) if prediction == 1 else float(probability[0])
+        return self.predict_health_risk_batch([chicken_data])[0]
 
-        return {
-            "risk_level": risk_level,
-            "probability": probability_value,
-            "needs_attention": bool(prediction),
-            "recommendation": "Monitor closely" if prediction == 1 else "Continue regular care"
-        }
-
-class ProductionPredictionModel:
+class ProductionPredictionModel(RegisteredModel):
     """
     AI model for predicting egg production
     """
+    name = 'production'
+    training_tables = ('chickens', 'egg_production')
+    scoring = {'r2': 'r2', 'mae': 'neg_mean_absolute_error'}
+    selection_metric = 'r2'
+
     def __init__(self):
-        self.model = LinearRegression()
-        self.scaler = StandardScaler()
-        self.is_trained = False
+        super().__init__()
         self.chicken_model = ChickenModel()
         self.farm_model = FarmModel()
 
+    def build_estimator(self):
+        return LinearRegression()
+
+    def search_space(self):
+        """
+        Candidate regressors for model selection
+        """
+        # Only needed when searching, so kept out of the startup imports
+        from sklearn.ensemble import GradientBoostingRegressor, RandomForestRegressor
+        from sklearn.linear_model import Ridge
+
+        return [
+            {'model': [LinearRegression()]},
+            {'model': [Ridge()], 'model__alpha': [0.1, 1.0, 10.0]},
+            {
+                'model': [RandomForestRegressor(random_state=42)],
+                'model__n_estimators': [100, 300],
+                'model__max_depth': [None, 8]
+            },
+            {
+                'model': [GradientBoostingRegressor(random_state=42)],
+                'model__n_estimators': [100, 300],
+                'model__max_depth': [2, 3]
+            },
+        ]
+
     def prepare_data(self):
         """
         Prepare training data for production prediction
         """
-        # Get chickens and egg production records from the database
-        chickens = self.chicken_model.get_all_chickens()
-        egg_records = self.farm_model.get_egg_production()
+        # Get chickens with their precomputed features, and per-chicken egg
+        # record counts in one grouped query
+        chickens = self.farm_model.attach_features(self.chicken_model.get_all_chickens())
+        egg_counts = self.farm_model.get_egg_record_counts()
 
-        if len(chickens) == 0 or len(egg_records) == 0:
+        if len(chickens) == 0 or len(egg_counts) == 0:
             # If no data exists, create synthetic data for initial training
             np.random.seed(42)
             # Features: age, season, health_status, feeding_amount
@@ -152,13 +237,10 @@ class ProductionPredictionModel:
             age = chicken.get('age', 0)
 
             # Calculate weekly egg production for this chicken
-            weekly_production = len([er for er in egg_records if er['chicken_id'] == chicken['id']])
+            weekly_production = egg_counts.get(chicken['id'], 0)
 
             # Features: [age, health_status_score, days_since_added, breed_factor]
-            try:
-                days_since_added = (datetime.now() - datetime.fromisoformat(chicken['date_added'].split('.')[0])).days
-            except:
-                days_since_added = 0
+            days_since_added = chicken.get('days_since_added', 0)
 
             # Health status score (0=healthy, 1=sick, 0.5=recovery)
             health_score = 0
@@ -167,14 +249,7 @@ class ProductionPredictionModel:
             elif chicken['health_status'] == 'recovery':
                 health_score = 0.5
 
-            # Breed factor (simplified)
-            breed_factor = 1.0  # Default
-            if 'rhode' in (chicken.get('breed', '') or '').lower():
-                breed_factor = 1.2
-            elif 'sussex' in (chicken.get('breed', '') or '').lower():
-                breed_factor = 1.1
-
-            X.append([age, health_score, days_since_added, breed_factor])
+            X.append([age, health_score, days_since_added, breed_factor(chicken.get('breed'))])
             y.append(weekly_production)
 
         if len(X) > 0:
@@ -186,57 +261,93 @@ class ProductionPredictionModel:
             y = X[:, 0] * 0.5 + X[:, 2] * 0.3 + X[:, 3] * 0.4 + np.random.rand(50) * 10
             return X, y
 
-    def train_model(self):
+    def _feature_matrix(self, flock):
+        """
+        Build the [age, health_score, days_since_added, breed_factor] feature
+        matrix of FlockColumns
+        """
+        # Health status score (0=healthy, 1=sick, 0.5=recovery)
+        health_score = np.select([flock.status_is('sick'), flock.status_is('recovery')], [1.0, 0.5], 0.0)
+        return np.column_stack([
+            flock.age,
+            health_score,
+            flock.days_since_added,
+            flock.map_breeds(breed_factor)
+        ]).astype(float).reshape(-1, 4)
+
+    def score_flock(self, flock):
         """
-        Train the production prediction model
+        Predicted eggs per week for every row of FlockColumns, with a single
+        scaler and model call for the rows the prediction cache does not hold
         """
-        X, y = self.prepare_data()
+        if not self.ensure_trained():
+            return self.heuristic_scores(flock)
+        # One read, so a model swapped in meanwhile is not mixed with the old scaler
+        fitted = self.fitted
 
-        # Scale features
-        X_scaled = self.scaler.fit_transform(X)
+        if not len(flock):
+            return np.zeros(0)
 
-        self.model.fit(X_scaled, y)
-        self.is_trained = True
+        with phase('inference'):
+            return np.maximum(self.infer_cached(fitted, flock.ids, self._feature_matrix(flock)), 0)
+
+    def heuristic_scores(self, flock):
+        """
+        Eggs per week for every row of FlockColumns from age, health and
+        breed, served while no fitted model is available
+        """
+        with phase('inference'):
+            # Peak production between 18 and 72 weeks
+            base = np.select([flock.age < 18, flock.age <= 72], [1.0, 4.0], default=2.5)
+            health = np.select([flock.status_is('sick'), flock.status_is('recovery')], [0.6, 0.9], 1.0)
+            # Newly added chickens are still adapting
+            settling = 1.0 - np.minimum(flock.days_since_added / 365.0, 0.25)
+            return np.maximum(0.0, base * health * flock.map_breeds(breed_factor) * settling)
+
+    def predict_flock_production(self, flock):
+        """
+        Egg production of every row of FlockColumns
+        """
+        return [
+            {
+                "predicted_eggs_per_week": float(prediction),
+                "confidence": 0.8 if self.is_trained else 0.5  # Higher confidence if trained on real data
+            } for prediction in self.score_flock(flock)
+        ]
+
+    def predict_production_batch(self, chickens):
+        """
+        Predict egg production for many chickens with a single scaler and model call
+        """
+        # Fill in features the caller did not supply from the feature store
+        chickens = self.farm_model.attach_features(chickens) if chickens else chickens
+        return self.predict_flock_production(FlockColumns.from_chickens(chickens))
 
     def predict_production(self, chicken_data):
         """
         Predict egg production for a chicken
         """
-        if not self.is_trained:
-            self.train_model()
+        return self.predict_production_batch([chicken_data])[0]
 
-        age = chicken_data.get('age', 0)
+# Feed times of the recommended schedule and each one's share of the daily feed
+FEED_TIMES = ('07:00', '13:00', '18:00')
+PORTION_SHARES = (0.4, 0.35, 0.25)
 
-        # Health status score
-        health_score = 0
-        if chicken_data.get('health_status') == 'sick':
-            health_score = 1
-        elif chicken_data.get('health_status') == 'recovery':
-            health_score = 0.5
+# Feed types by whether a chicken is old enough for layer feed
+FEED_TYPES = ('Grower feed', 'Layer feed')
 
-        # Days since added
-        days_since_added = chicken_data.get('days_since_added', 0)
+# Notes of the feed_schedule rows a recorded plan writes, which the next
+# recorded plan for the same chickens replaces
+PLANNED_FEED_NOTES = 'Planned by feed optimization'
 
-        # Breed factor
-        breed_factor = 1.0
-        breed = chicken_data.get('breed', '')
-        if 'rhode' in breed.lower():
-            breed_factor = 1.2
-        elif 'sussex' in breed.lower():
-            breed_factor = 1.1
+FEED_NOTES = "Adjust portions based on actual consumption and health. Increase if egg production is low."
 
-        # Prepare features
-        features = np.array([[age, health_score, days_since_added, breed_factor]])
 
-        # Scale features
-        features_scaled = self.scaler.transform(features)
+def feed_breed_factor(breed):
+    """Feed factor of a breed"""
+    breed = (breed or '').lower()
+    return 1.05 if 'rhode' in breed or 'penn' in breed else 1.0
 
-        prediction = self.model.predict(features_scaled)[0]
-
-        return {
-            "predicted_eggs_per_week": max(0, float(prediction)),
-            "confidence": 0.8 if self.is_trained else 0.5  # Higher confidence if trained on real data
-        }
 
 class FeedOptimizationModel:
     """
@@ -246,6 +357,20 @@ class FeedOptimizationModel:
         self.chicken_model = ChickenModel()
         self.farm_model = FarmModel()
 
+    def score_flock(self, flock):
+        """
+        Recommended daily feed in grams, and whether layer feed is due, for
+        every row of FlockColumns
+        """
+        age = flock.age
+        # Base feed amount based on age: chicks, growers, adults, older hens
+        daily = np.select([age < 6, age < 18, age > 72], [30.0, 80.0, 110.0], 120.0)
+        # Rhode Island Red and Plymouth Rock (Penn) eat a little more
+        daily = daily * flock.map_breeds(feed_breed_factor)
+        # Reduce slightly if not healthy
+        daily = np.where(flock.status_is('healthy'), daily, daily * 0.9)
+        return daily, age > 18
+
     def optimize_feed_schedule(self, chicken_id):
         """
         Provide feed optimization recommendations for a specific chicken
@@ -254,42 +379,88 @@ class FeedOptimizationModel:
         if not chicken:
             return {"error": "Chicken not found"}
 
-        age = chicken.get('age', 0)
-        breed = chicken.get('breed', '').lower()
-        health_status = chicken.get('health_status', 'healthy')
-
-        # Base feed amount based on age and breed
-        base_feed = 120  # grams per day for adult chickens
-        if age < 6:  # Young chick
-            base_feed = 30
-        elif age < 18:  # Growing chick
-            base_feed = 80
-        elif age > 72:  # Older hen
-            base_feed = 110
-
-        # Adjust based on breed
-        if 'rhode' in breed or 'penn' in breed:  # Rhode Island Red, Plymouth Rock
-            base_feed *= 1.05
-
-        # Adjust based on health
-        if health_status != 'healthy':
-            base_feed *= 0.9  # Reduce slightly if not healthy
-
-        # Feed schedule recommendation (2-3 times a day)
-        feed_times = ["07:00", "13:00", "18:00"]
-
-        # Calculate portion sizes
-        portions = [base_feed * 0.4, base_feed * 0.35, base_feed * 0.25]
-
+        daily, layer = self.score_flock(FlockColumns.from_chickens([chicken]))
+        daily = float(daily[0])
         return {
-            "recommended_daily_feed": round(base_feed, 2),
-            "feed_times": feed_times,
-            "portion_sizes": [round(p, 2) for p in portions],
-            "feed_type": "Layer feed" if age > 18 else "Grower feed",
-            "notes": f"Adjust portions based on actual consumption and health. Increase if egg production is low."
+            "recommended_daily_feed": round(daily, 2),
+            "feed_times": list(FEED_TIMES),
+            "portion_sizes": [round(daily * share, 2) for share in PORTION_SHARES],
+            "feed_type": FEED_TYPES[int(layer[0])],
+            "notes": FEED_NOTES
         }
 
+    def optimize_flock_feed(self, flock, days=1, include_chickens=True):
+        """
+        Feed plan of every row of FlockColumns in one pass, with the feed
+        needed per feed type and time slot over `days` days for procurement
+        """
+        with phase('inference'):
+            daily, layer = self.score_flock(flock)
+            feed_type = layer.astype(np.int64)
+            portions = np.outer(daily, PORTION_SHARES)
+            chickens = np.bincount(feed_type, minlength=len(FEED_TYPES))
+            grams = np.column_stack([
+                np.bincount(feed_type, weights=portions[:, slot], minlength=len(FEED_TYPES))
+                for slot in range(len(FEED_TIMES))
+            ]).reshape(len(FEED_TYPES), len(FEED_TIMES)) * days
+
+        plan = {
+            "chickens_planned": len(flock),
+            "days": days,
+            "feed_times": list(FEED_TIMES),
+            "total_grams": round(float(grams.sum()), 2),
+            "by_feed_type": {
+                name: {
+                    "chickens": int(chickens[code]),
+                    "grams": round(float(grams[code].sum()), 2),
+                    "by_time_slot": {time: round(float(grams[code, slot]), 2) for slot, time in enumerate(FEED_TIMES)}
+                } for code, name in enumerate(FEED_TYPES) if chickens[code]
+            },
+            "by_time_slot": {
+                time: {name: round(float(grams[code, slot]), 2) for code, name in enumerate(FEED_TYPES) if chickens[code]}
+                for slot, time in enumerate(FEED_TIMES)
+            },
+            "notes": FEED_NOTES
+        }
+        if include_chickens:
+            plan["chickens"] = [
+                {
+                    "chicken_id": chicken_id,
+                    "recommended_daily_feed": round(grams_per_day, 2),
+                    "feed_type": FEED_TYPES[code],
+                    "portion_sizes": [round(portion, 2) for portion in chicken_portions]
+                } for chicken_id, grams_per_day, code, chicken_portions
+                in zip(flock.ids.tolist(), daily.tolist(), feed_type.tolist(), portions.tolist())
+            ]
+        return plan
+
+    def schedule_rows(self, flock):
+        """feed_schedule rows, one per chicken and feed time, carrying out the plan of FlockColumns"""
+        daily, layer = self.score_flock(flock)
+        portions = np.outer(daily, PORTION_SHARES).tolist()
+        return [
+            {
+                "chicken_id": chicken_id,
+                "feed_type": FEED_TYPES[int(is_layer)],
+                "scheduled_time": time,
+                "amount": round(portion, 2),
+                "notes": PLANNED_FEED_NOTES
+            }
+            for chicken_id, is_layer, chicken_portions in zip(flock.ids.tolist(), layer.tolist(), portions)
+            for time, portion in zip(FEED_TIMES, chicken_portions)
+        ]
+
 # Singleton instances for the models
 health_model = HealthPredictionModel()
 production_model = ProductionPredictionModel()
-feed_model = FeedOptimizationModel()
\ No newline at end of file
+feed_model = FeedOptimizationModel()
+
+# Load saved artifacts at startup; until there are usable ones, predictions
+# come from the heuristics and the scheduler's first pass trains them
+with timed('load model artifacts'):
+    health_model.load()
+    production_model.load()
+
+# Retrain (or pick up artifacts trained elsewhere) in the background
+scheduler = TrainingScheduler((health_model, production_model))
+scheduler.start()
\ No newline at end of file
@@ -0,0 +1,287 @@
+import asyncio
+import io
+import logging
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from models.database import db
+from models.inference_pool import inference_pool
+
+logger = logging.getLogger(__name__)
+
+# Threads per lane. Requests wait on the event loop, not in a worker, until
+# a thread of their lane is free; routes and their SQLite access run there
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 32))
+ASGI_ANALYTICS_THREADS = int(os.environ.get('ASGI_ANALYTICS_THREADS', 4))
+# Every open event stream holds a thread
+ASGI_STREAM_THREADS = int(os.environ.get('ASGI_STREAM_THREADS', 100))
+
+# Largest request body buffered for the WSGI app; larger ones get a 413.
+# An upload of BULK_MAX_ROWS records fits well inside the default
+ASGI_MAX_BODY_BYTES = int(os.environ.get('ASGI_MAX_BODY_BYTES', 32 * 1024 * 1024))
+
+# Worker processes scoring model batches off the serving process (0 scores in-process)
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', min(os.cpu_count() or 1, 4)))
+
+# Path prefixes served by their own lane, so slow analytics and long-lived
+# streams never take the threads that uploads and CRUD calls run on
+STREAM_PATHS = ('/api/events',)
+ANALYTICS_PATHS = ('/api/dashboard', '/api/ai/', '/api/feed/optimize', '/api/export/')
+
+
+class Lane:
+    """Thread pool serving one class of requests, with its load"""
+    def __init__(self, name, threads):
+        self.name = name
+        self.threads = threads
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix=f'asgi-{name}')
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.served = 0
+
+    async def run(self, fn, *args):
+        with self._lock:
+            self.queued += 1
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._call, fn, args)
+
+    def _call(self, fn, args):
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.served += 1
+
+    def get_stats(self):
+        return {'threads': self.threads, 'active': self.active, 'queued': self.queued, 'served': self.served}
+
+
+def wsgi_environ(scope, body):
+    """WSGI environ of an ASGI HTTP request scope and its whole body"""
+    script_name = scope.get('root_path', '')
+    path = scope['path']
+    if script_name and path.startswith(script_name):
+        path = path[len(script_name):]
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': script_name.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    server = scope.get('server') or ('localhost', 80)
+    environ['SERVER_NAME'] = server[0]
+    environ['SERVER_PORT'] = str(server[1] or 80)
+    if scope.get('client'):
+        environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = scope['client'][0], str(scope['client'][1])
+
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else f'HTTP_{name}'
+        if key == 'CONTENT_LENGTH':
+            continue
+        value = value.decode('latin-1')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+def _content_length(scope):
+    """Content-Length the client declared, or None"""
+    for name, value in scope.get('headers', ()):
+        if name.lower() == b'content-length':
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+async def _read_body(receive, limit):
+    """
+    Whole request body, or None if the client went away first; raises
+    _BodyTooLarge as soon as it grows past limit bytes
+    """
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > limit:
+            raise _BodyTooLarge
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def _watch_disconnect(receive, disconnected):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+    disconnected.set()
+
+
+async def _send_all(send, messages):
+    for message in messages:
+        await send(message)
+
+
+class AsgiServer:
+    """
+    ASGI application serving a Flask app's routes. The event loop only
+    accepts connections and moves bytes; each request runs the WSGI app on
+    a thread of its lane, so its SQLite queries never block the loop, and
+    model batches are scored in the inference pool's processes. Slow
+    dashboard or training requests then queue behind each other only, while
+    uploads and CRUD calls keep their own threads.
+    """
+    def __init__(self, wsgi_app, threads=ASGI_THREADS, analytics_threads=ASGI_ANALYTICS_THREADS,
+                 stream_threads=ASGI_STREAM_THREADS, inference_workers=INFERENCE_WORKERS,
+                 max_body_bytes=ASGI_MAX_BODY_BYTES):
+        self.wsgi_app = wsgi_app
+        self.max_body_bytes = max_body_bytes
+        self.lanes = {
+            'default': Lane('default', threads),
+            'analytics': Lane('analytics', analytics_threads),
+            'stream': Lane('stream', stream_threads),
+        }
+        self.inference_workers = inference_workers
+        # Flask routes report the server's state from here
+        if hasattr(wsgi_app, 'extensions'):
+            wsgi_app.extensions['asgi_server'] = self
+
+    def lane_for(self, scope):
+        path = scope['path']
+        if path.startswith(STREAM_PATHS):
+            return self.lanes['stream']
+        if path.startswith(ANALYTICS_PATHS) or b'include=predictions' in scope.get('query_string', b''):
+            return self.lanes['analytics']
+        return self.lanes['default']
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                inference_pool.start(self.inference_workers)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await asyncio.get_running_loop().run_in_executor(None, self.shutdown)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def shutdown(self):
+        inference_pool.stop()
+        for lane in self.lanes.values():
+            # Event streams end on their own at the next heartbeat
+            lane.executor.shutdown(wait=lane.name != 'stream', cancel_futures=True)
+        db.close_all()
+
+    async def _http(self, scope, receive, send):
+        try:
+            declared = _content_length(scope)
+            if declared is not None and declared > self.max_body_bytes:
+                raise _BodyTooLarge
+            body = await _read_body(receive, self.max_body_bytes)
+        except _BodyTooLarge:
+            # The rest of the body is never read, so the connection can't be reused
+            await _send_all(send, [
+                {
+                    'type': 'http.response.start',
+                    'status': 413,
+                    'headers': [(b'content-type', b'text/plain'), (b'connection', b'close')]
+                },
+                {'type': 'http.response.body', 'body': b'Request Entity Too Large'}
+            ])
+            return
+        if body is None:
+            return
+        loop = asyncio.get_running_loop()
+        disconnected = threading.Event()
+        watcher = asyncio.ensure_future(_watch_disconnect(receive, disconnected))
+        try:
+            await self.lane_for(scope).run(self._respond, wsgi_environ(scope, body), loop, send, disconnected)
+        finally:
+            watcher.cancel()
+
+    def _respond(self, environ, loop, send, disconnected):
+        """Run the WSGI app on this lane thread, forwarding its response to the loop"""
+        def send_now(*messages):
+            asyncio.run_coroutine_threadsafe(_send_all(send, messages), loop).result()
+
+        response = {}
+        started = False
+
+        def start_message():
+            status, headers = response['status'], response['headers']
+            return {
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+            }
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and started:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['status'], response['headers'] = status, headers
+            return write
+
+        def write(data):
+            nonlocal started
+            messages = [] if started else [start_message()]
+            started = True
+            send_now(*messages, {'type': 'http.response.body', 'body': bytes(data), 'more_body': True})
+
+        try:
+            result = self.wsgi_app(environ, start_response)
+            try:
+                for chunk in result:
+                    if disconnected.is_set():
+                        return
+                    if chunk:
+                        write(chunk)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+        except Exception:
+            if started:
+                # Status and part of the body are out. Raising makes the
+                # server log it and close the connection, so the client sees
+                # a truncated response instead of one that looks complete
+                raise
+            logger.exception('Error serving %s %s', environ['REQUEST_METHOD'], environ['PATH_INFO'])
+            response['status'], response['headers'] = '500 Internal Server Error', [('Content-Type', 'text/plain')]
+            send_now(start_message(), {'type': 'http.response.body', 'body': b'Internal Server Error'})
+            return
+        send_now(*([] if started else [start_message()]), {'type': 'http.response.body', 'body': b''})
+
+    def get_stats(self):
+        return {
+            'mode': 'asgi',
+            'lanes': {name: lane.get_stats() for name, lane in self.lanes.items()},
+            'inference': inference_pool.get_stats()
+        }
@@ -1,8 +1,11 @@
-import sqlite3
-import os
 from datetime import datetime
+from models import feature_store
+from models.database import get_connection
+from models.events import publish
+from models.migrations import EGG_ROLLUP_DETACH_SQL, get_table_version, migrate
+from models.pagination import where
 
-DATABASE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'chicken_farm.db')
+CHICKEN_COLUMNS = 'id, name, breed, age, health_status, date_added, feeding_schedule, notes'
 
 class ChickenModel:
     def __init__(self):
@@ -10,51 +13,55 @@ class ChickenModel:
     
     def init_db(self):
         """Initialize the database with chickens table"""
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS chickens (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                breed TEXT,
-                age INTEGER,
-                health_status TEXT DEFAULT 'healthy',
-                date_added TEXT,
-                feeding_schedule TEXT,
-                notes TEXT
-            )
-        ''')
-        conn.commit()
-        conn.close()
+        migrate()
     
     def add_chicken(self, data):
         """Add a new chicken to the database"""
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO chickens (name, breed, age, health_status, date_added, feeding_schedule, notes)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            data.get('name', ''),
-            data.get('breed', ''),
-            data.get('age', 0),
-            data.get('health_status', 'healthy'),
-            datetime.now().isoformat(),
-            data.get('feeding_schedule', ''),
-            data.get('notes', '')
-        ))
-        chicken_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        conn = get_connection()
+        date_added = datetime.now().isoformat()
+        with conn:
+            cursor = conn.execute('''
+                INSERT INTO chickens (name, breed, age, health_status, date_added, feeding_schedule, notes)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                data.get('name', ''),
+                data.get('breed', ''),
+                data.get('age', 0),
+                data.get('health_status', 'healthy'),
+                date_added,
+                data.get('feeding_schedule', ''),
+                data.get('notes', '')
+            ))
+            chicken_id = cursor.lastrowid
+            feature_store.add_chicken(conn, chicken_id, date_added)
+            version = get_table_version('chickens', conn)
+        publish('chickens', 'created', id=chicken_id, chicken_id=chicken_id, version=version)
         return chicken_id
     
-    def get_all_chickens(self):
-        """Get all chickens from the database"""
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM chickens')
-        chickens = cursor.fetchall()
-        conn.close()
+    def get_all_chickens(self, health_status=None, breed=None, cursor=None, limit=None):
+        """
+        Get chickens ordered by id, optionally filtered by health status or
+        breed. cursor is the id of the last chicken of the previous page.
+        """
+        clauses = []
+        params = []
+        if health_status:
+            clauses.append('health_status = ?')
+            params.append(health_status)
+        if breed:
+            clauses.append('breed = ?')
+            params.append(breed)
+        if cursor is not None:
+            clauses.append('id > ?')
+            params.append(cursor)
+        
+        query = f'SELECT {CHICKEN_COLUMNS} FROM chickens{where(clauses)} ORDER BY id'
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+        
+        conn = get_connection()
+        chickens = conn.execute(query, params).fetchall()
         
         # Convert to list of dictionaries
         return [
@@ -72,11 +79,8 @@ class ChickenModel:
     
     def get_chicken(self, chicken_id):
         """Get a specific chicken by ID"""
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM chickens WHERE id = ?', (chicken_id,))
-        row = cursor.fetchone()
-        conn.close()
+        conn = get_connection()
+        row = conn.execute(f'SELECT {CHICKEN_COLUMNS} FROM chickens WHERE id = ?', (chicken_id,)).fetchone()
         
         if row:
             return {
@@ -93,28 +97,32 @@ class ChickenModel:
     
     def update_chicken(self, chicken_id, data):
         """Update a specific chicken"""
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE chickens
-            SET name=?, breed=?, age=?, health_status=?, feeding_schedule=?, notes=?
-            WHERE id=?
-        ''', (
-            data.get('name', ''),
-            data.get('breed', ''),
-            data.get('age', 0),
-            data.get('health_status', 'healthy'),
-            data.get('feeding_schedule', ''),
-            data.get('notes', ''),
-            chicken_id
-        ))
-        conn.commit()
-        conn.close()
+        conn = get_connection()
+        with conn:
+            cursor = conn.execute('''
+                UPDATE chickens
+                SET name=?, breed=?, age=?, health_status=?, feeding_schedule=?, notes=?
+                WHERE id=?
+            ''', (
+                data.get('name', ''),
+                data.get('breed', ''),
+                data.get('age', 0),
+                data.get('health_status', 'healthy'),
+                data.get('feeding_schedule', ''),
+                data.get('notes', ''),
+                chicken_id
+            ))
+            version = get_table_version('chickens', conn)
+        publish('chickens', 'updated', id=chicken_id, chicken_id=chicken_id, version=version, changes=cursor.rowcount)
     
     def delete_chicken(self, chicken_id):
         """Delete a specific chicken"""
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM chickens WHERE id = ?', (chicken_id,))
-        conn.commit()
-        conn.close()
\ No newline at end of file
+        conn = get_connection()
+        with conn:
+            conn.execute(EGG_ROLLUP_DETACH_SQL, (chicken_id,))
+            cursor = conn.execute('DELETE FROM chickens WHERE id = ?', (chicken_id,))
+            version = get_table_version('chickens', conn)
+        # Records of the chicken are kept, with chicken_id set to NULL by
+        # ON DELETE SET NULL; its features and rollup rows are removed
+        publish('chickens', 'deleted', id=chicken_id, chicken_id=chicken_id, version=version, changes=cursor.rowcount,
+                detached=('egg_production', 'feed_schedule', 'health_records'))
\ No newline at end of file
@@ -0,0 +1,83 @@
+from datetime import date, datetime, timedelta
+
+# Record dates stay ISO 8601 text in the API and the `date`/`date_added`
+# columns. Migration 8 adds generated integer columns next to them:
+# *_day counts days since 1970-01-01 and *_ts seconds since its midnight,
+# both on the wall clock the text was written in (offsets are ignored), so
+# day == ts // 86400. Ranges over them are plain indexed integer scans.
+
+EPOCH = date(1970, 1, 1)
+
+# SQL deriving the integer columns from a text column, also valid in
+# generated columns on SQLite versions without unixepoch()
+EPOCH_DAY_SQL = "CAST(julianday(substr({column}, 1, 10)) - 2440587.5 AS INTEGER)"
+EPOCH_SECONDS_SQL = "CAST(strftime('%s', substr({column}, 1, 19)) AS INTEGER)"
+
+
+def to_date(value):
+    """date of a date, datetime or ISO 8601 string"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def epoch_day(value):
+    """Days since 1970-01-01 of a date, datetime or ISO 8601 string; None if invalid"""
+    if value is None:
+        return None
+    try:
+        return (to_date(value) - EPOCH).days
+    except ValueError:
+        return None
+
+
+def from_epoch_day(day):
+    return EPOCH + timedelta(days=day)
+
+
+def epoch_seconds(value):
+    """Wall-clock seconds since 1970-01-01 of a datetime or ISO 8601 string; None if invalid"""
+    if value is None:
+        return None
+    try:
+        if not isinstance(value, datetime):
+            value = datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+    return int((value.replace(tzinfo=None) - datetime(1970, 1, 1)).total_seconds())
+
+
+def between(column, start=None, end=None):
+    """
+    SQL clauses for an inclusive range of days over an epoch-day column;
+    start and end are dates, datetimes or ISO strings and may be omitted
+    """
+    clauses = []
+    params = []
+    if start is not None:
+        clauses.append(f'{column} >= ?')
+        params.append((to_date(start) - EPOCH).days)
+    if end is not None:
+        clauses.append(f'{column} <= ?')
+        params.append((to_date(end) - EPOCH).days)
+    return clauses, params
+
+
+def today(day=None):
+    """(start, end) of the current day"""
+    day = day or date.today()
+    return day, day
+
+
+def last_days(days, day=None):
+    """(start, end) of the `days` days ending today"""
+    day = day or date.today()
+    return day - timedelta(days=days - 1), day
+
+
+def this_week(day=None):
+    """(start, end) of the Monday-based week up to today"""
+    day = day or date.today()
+    return day - timedelta(days=day.weekday()), day
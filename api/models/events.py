@@ -0,0 +1,34 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_listeners = []
+_lock = threading.Lock()
+
+
+def subscribe(listener):
+    """
+    Register listener(table, action, details) to be called after every
+    committed write made through ChickenModel or FarmModel
+    """
+    with _lock:
+        _listeners.append(listener)
+    return listener
+
+
+def unsubscribe(listener):
+    with _lock:
+        if listener in _listeners:
+            _listeners.remove(listener)
+
+
+def publish(table, action, **details):
+    """Notify listeners that a table changed; listener errors never fail the write"""
+    with _lock:
+        listeners = list(_listeners)
+    for listener in listeners:
+        try:
+            listener(table, action, details)
+        except Exception:
+            logger.exception('Change listener failed for %s %s', table, action)
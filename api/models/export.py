@@ -0,0 +1,42 @@
+import csv
+import io
+import json
+
+# Flush streamed output once this many characters are buffered
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_csv(columns, rows):
+    """Encode rows as CSV, yielding chunks of roughly CHUNK_SIZE characters"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_ndjson(columns, rows):
+    """Encode rows as one JSON object per line, yielding chunks of roughly CHUNK_SIZE characters"""
+    lines = []
+    size = 0
+    for row in rows:
+        line = json.dumps(dict(zip(columns, row)), separators=(',', ':'))
+        lines.append(line)
+        size += len(line) + 1
+        if size >= CHUNK_SIZE:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+            size = 0
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', iter_csv),
+    'ndjson': ('application/x-ndjson', iter_ndjson),
+}
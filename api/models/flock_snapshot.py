@@ -0,0 +1,301 @@
+import threading
+from datetime import date
+
+import numpy as np
+
+from models import feature_store
+from models.database import get_connection
+from models.dates import epoch_day
+from models.events import subscribe
+from models.migrations import get_table_versions
+
+# Tables whose rows the snapshot reflects, by change counter
+SNAPSHOT_TABLES = ('chickens', 'health_records')
+
+_RECENT_ISSUES = f'health_issues_{feature_store.RECENT_ISSUES_WINDOW}d'
+
+# chickens rows with their recent health issue count, as snapshot rows
+SNAPSHOT_QUERY = f'''
+    SELECT c.id, c.age, c.health_status, c.breed, c.added_day, COALESCE(f.{_RECENT_ISSUES}, 0)
+    FROM chickens c LEFT JOIN chicken_features f ON f.chicken_id = c.id
+'''
+
+
+def _encode(values, names):
+    """Integer codes of values, indexing names extended with any unseen value"""
+    lookup = {name: code for code, name in enumerate(names)}
+    codes = np.fromiter((lookup.setdefault(value, len(lookup)) for value in values), dtype=np.int32, count=len(values))
+    return codes, list(lookup)
+
+
+def _days(values):
+    """datetime64[D] of epoch days, NaT where missing"""
+    days = np.array([-1 if value is None else value for value in values], dtype=np.int64)
+    return np.where(days == -1, np.datetime64('NaT', 'D'), days.astype('datetime64[D]'))
+
+
+def _covers(intervals, start, end):
+    """Whether (first, last] counter intervals together span every value in (start, end]"""
+    reached = start
+    for first, last in sorted(intervals):
+        if first > reached:
+            break
+        reached = max(reached, last)
+    return reached >= end
+
+
+def _days_since(added, today):
+    """Whole days from each date to today, 0 where the date is missing"""
+    elapsed = (np.datetime64(today, 'D') - added).astype(np.int64)
+    return np.where(np.isnat(added), 0, elapsed)
+
+
+class FlockColumns:
+    """
+    Column arrays describing a set of chickens, row i being chicken ids[i].
+    Health status and breed are codes into status_names and breed_names.
+    Instances are never modified, so readers need no locking.
+    """
+    def __init__(self, ids, age, status, breed, date_added, days_since_added, recent_health_issues,
+                 status_names, breed_names):
+        self.ids = ids
+        self.age = age
+        self.status = status
+        self.breed = breed
+        self.date_added = date_added
+        self.days_since_added = days_since_added
+        self.recent_health_issues = recent_health_issues
+        self.status_names = status_names
+        self.breed_names = breed_names
+        self._index = None
+
+    @classmethod
+    def from_rows(cls, rows, today, status_names=(), breed_names=()):
+        """Columns of (id, age, health_status, breed, epoch day added, recent_health_issues) rows"""
+        status, status_names = _encode([row[2] for row in rows], status_names)
+        breed, breed_names = _encode([row[3] for row in rows], breed_names)
+        date_added = _days([row[4] for row in rows])
+        return cls(
+            np.array([row[0] for row in rows], dtype=np.int64),
+            np.array([row[1] or 0 for row in rows], dtype=float),
+            status,
+            breed,
+            date_added,
+            _days_since(date_added, today),
+            np.array([row[5] or 0 for row in rows], dtype=np.int64),
+            status_names,
+            breed_names
+        )
+
+    @classmethod
+    def from_chickens(cls, chickens, today=None):
+        """Columns of chicken dicts, keeping the recent_health_issues and days_since_added they carry"""
+        flock = cls.from_rows([
+            (chicken.get('id') or 0, chicken.get('age'), chicken.get('health_status'), chicken.get('breed'),
+             epoch_day(chicken.get('date_added')), chicken.get('recent_health_issues'))
+            for chicken in chickens
+        ], today or date.today())
+        flock.days_since_added = np.array([chicken.get('days_since_added') or 0 for chicken in chickens], dtype=np.int64)
+        return flock
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def index(self):
+        """Row of each chicken id"""
+        if self._index is None:
+            self._index = dict(zip(self.ids.tolist(), range(len(self.ids))))
+        return self._index
+
+    def status_is(self, name):
+        """Boolean array of rows whose health status is name"""
+        if name not in self.status_names:
+            return np.zeros(len(self), dtype=bool)
+        return self.status == self.status_names.index(name)
+
+    def breed_is(self, name):
+        """Boolean array of rows whose breed is name"""
+        if name not in self.breed_names:
+            return np.zeros(len(self), dtype=bool)
+        return self.breed == self.breed_names.index(name)
+
+    def matching(self, breed=None, health_status=None):
+        """Columns of the rows with the given breed and health status, where given"""
+        mask = np.ones(len(self), dtype=bool)
+        if breed is not None:
+            mask &= self.breed_is(breed)
+        if health_status is not None:
+            mask &= self.status_is(health_status)
+        return self.take(np.flatnonzero(mask))
+
+    def map_breeds(self, value_of):
+        """Float array of value_of(breed) per row, computed once per distinct breed"""
+        values = np.array([value_of(name) for name in self.breed_names], dtype=float)
+        return values[self.breed] if len(values) else np.zeros(len(self))
+
+    def status_counts(self):
+        """Number of chickens per health status"""
+        counts = np.bincount(self.status, minlength=len(self.status_names))
+        return {name: int(count) for name, count in zip(self.status_names, counts) if count}
+
+    def take(self, rows):
+        """Columns of the given rows only"""
+        rows = np.asarray(rows, dtype=np.int64)
+        return FlockColumns(
+            self.ids[rows], self.age[rows], self.status[rows], self.breed[rows], self.date_added[rows],
+            self.days_since_added[rows], self.recent_health_issues[rows], self.status_names, self.breed_names
+        )
+
+    def select(self, chicken_ids):
+        """Columns of the given chickens in that order, or None if one is not in the snapshot"""
+        index = self.index
+        rows = [index.get(chicken_id) for chicken_id in chicken_ids]
+        if None in rows:
+            return None
+        return self.take(rows)
+
+
+class FlockSnapshot:
+    """
+    Read-optimized copy of the chickens table as FlockColumns, built once
+    and then refreshed from write notifications: only the chickens touched
+    by a write are re-read. Each write event carries the change counter
+    its transaction left, so the snapshot knows which counter values it
+    has seen writes for; a value it has not seen is a write made by
+    another process (or an ON DELETE action), which falls back to a rebuild. Events
+    for writes the snapshot already reflects are ignored.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._columns = None
+        self._versions = None
+        self._day = None
+        # Since the last refresh: chickens to re-read, chickens removed,
+        # and the (first, last] counter values of the writes seen here
+        self._dirty = set()
+        self._removed = set()
+        self._seen = {table: [] for table in SNAPSHOT_TABLES}
+        self._uncounted = set()
+        self.rebuilds = 0
+        self.refreshes = 0
+
+    def on_change(self, table, action, details):
+        """Listener for models.events"""
+        if table not in SNAPSHOT_TABLES:
+            return
+        with self._lock:
+            version = details.get('version')
+            if version is None or action not in ('created', 'updated', 'deleted', 'bulk_created'):
+                self._uncounted.add(table)
+                return
+            if self._versions is not None and version <= self._versions[table]:
+                # Published after a refresh that already read this write
+                return
+            changes = len(details['ids']) if action == 'bulk_created' else details.get('changes', 1)
+            self._seen[table].append((version - changes, version))
+            if action == 'bulk_created':
+                self._dirty.update(details['chicken_ids'])
+            elif table == 'chickens' and action == 'deleted':
+                self._removed.add(details['id'])
+                # Detaching the chicken's records bumps their counters by unknown amounts
+                self._uncounted.update(t for t in details.get('detached', ()) if t in SNAPSHOT_TABLES)
+            elif details.get('chicken_id') is not None:
+                self._dirty.add(details['chicken_id'])
+
+    def get(self):
+        """Current FlockColumns, refreshed first if anything changed"""
+        conn = get_connection()
+        with self._lock:
+            today = date.today()
+            versions = dict(zip(SNAPSHOT_TABLES, get_table_versions(SNAPSHOT_TABLES, conn)))
+            if self._columns is None or today != self._day:
+                self._rebuild(conn, versions, today)
+            elif versions != self._versions:
+                explained = {
+                    table: table not in self._uncounted
+                    and _covers(self._seen[table], self._versions[table], versions[table])
+                    for table in SNAPSHOT_TABLES
+                }
+                if not explained['chickens']:
+                    self._rebuild(conn, versions, today)
+                else:
+                    self._refresh(conn, versions, today, all_issues=not explained['health_records'])
+            return self._columns
+
+    def _reset_pending(self, versions, today):
+        self._versions = versions
+        self._day = today
+        self._dirty = set()
+        self._removed = set()
+        self._seen = {table: [] for table in SNAPSHOT_TABLES}
+        self._uncounted = set()
+
+    def _rebuild(self, conn, versions, today):
+        feature_store.ensure_current(conn, today)
+        rows = conn.execute(SNAPSHOT_QUERY + ' ORDER BY c.id').fetchall()
+        self._columns = FlockColumns.from_rows(rows, today)
+        self._reset_pending(versions, today)
+        self.rebuilds += 1
+
+    def _refresh(self, conn, versions, today, all_issues=False):
+        """Apply the writes seen since the last refresh to a copy of the columns"""
+        old = self._columns
+        changed = {}
+        dirty = sorted(self._dirty - self._removed)
+        for start in range(0, len(dirty), 500):
+            chunk = dirty[start:start + 500]
+            placeholders = ', '.join('?' * len(chunk))
+            for row in conn.execute(SNAPSHOT_QUERY + f' WHERE c.id IN ({placeholders})', chunk):
+                changed[row[0]] = row
+
+        keep = np.ones(len(old), dtype=bool)
+        index = old.index
+        for chicken_id in self._removed:
+            if chicken_id in index:
+                keep[index[chicken_id]] = False
+        columns = old.take(np.flatnonzero(keep)) if not keep.all() else old.take(np.arange(len(old)))
+
+        # Re-read rows overwrite their old values; new chickens are appended
+        updates = FlockColumns.from_rows(list(changed.values()), today, old.status_names, old.breed_names)
+        index = columns.index
+        existing = [(row, index[chicken_id]) for row, chicken_id in enumerate(updates.ids.tolist()) if chicken_id in index]
+        if existing:
+            source, target = (np.array(rows, dtype=np.int64) for rows in zip(*existing))
+            for name in ('age', 'status', 'breed', 'date_added', 'days_since_added', 'recent_health_issues'):
+                getattr(columns, name)[target] = getattr(updates, name)[source]
+        added = np.array(
+            [row for row, chicken_id in enumerate(updates.ids.tolist()) if chicken_id not in index], dtype=np.int64
+        )
+        if len(added):
+            new = updates.take(added)
+            columns = FlockColumns(*(
+                np.concatenate([getattr(columns, name), getattr(new, name)])
+                for name in ('ids', 'age', 'status', 'breed', 'date_added', 'days_since_added', 'recent_health_issues')
+            ), updates.status_names, updates.breed_names)
+        else:
+            columns.status_names, columns.breed_names = updates.status_names, updates.breed_names
+
+        if all_issues:
+            # Health records changed in ways not seen here; re-read every count
+            feature_store.ensure_current(conn, today)
+            counts = dict(conn.execute(f'SELECT chicken_id, {_RECENT_ISSUES} FROM chicken_features').fetchall())
+            columns.recent_health_issues = np.array(
+                [counts.get(chicken_id, 0) for chicken_id in columns.ids.tolist()], dtype=np.int64
+            )
+
+        self._columns = columns
+        self._reset_pending(versions, today)
+        self.refreshes += 1
+
+    def get_stats(self):
+        return {
+            'chickens': len(self._columns) if self._columns is not None else None,
+            'as_of': self._day.isoformat() if self._day else None,
+            'rebuilds': self.rebuilds,
+            'refreshes': self.refreshes
+        }
+
+
+flock_snapshot = FlockSnapshot()
+subscribe(flock_snapshot.on_change)
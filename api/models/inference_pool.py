@@ -0,0 +1,140 @@
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+# Batches smaller than this are scored in-process; shipping them to a
+# worker and back costs more than the GIL time it frees
+INFERENCE_MIN_ROWS = int(os.environ.get('INFERENCE_MIN_ROWS', 500))
+
+# In a worker process: the registry artifacts are read from, and the
+# (version, model, scaler) last loaded per model name
+_worker_registry = None
+_worker_models = {}
+
+
+def _init_worker(path):
+    global _worker_registry
+    # Ctrl+C reaches the whole process group; the server stops the pool itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from models.model_registry import ModelRegistry
+    _worker_registry = ModelRegistry(path)
+
+
+def _apply(name, version, method, X):
+    """In a worker: method of the saved model version applied to scaled X"""
+    cached = _worker_models.get(name)
+    if cached is None or cached[0] != version:
+        artifact = _worker_registry.load_version(name, version)
+        if artifact is None:
+            raise LookupError(f'{name} model version {version} is not saved')
+        cached = _worker_models[name] = (version, artifact['model'], artifact['scaler'])
+    _, model, scaler = cached
+    return getattr(model, method)(scaler.transform(X))
+
+
+class InferencePool:
+    """
+    Pool of worker processes that run saved estimators on feature matrices,
+    so scoring a large flock does not hold the serving process's GIL while
+    other requests wait. Each worker loads a model version from the registry
+    the first time it is asked for it. The pool is off until start() is
+    called (the ASGI server does); models then predict in-process, as do
+    batches of fewer than min_rows rows.
+    """
+    def __init__(self, min_rows=INFERENCE_MIN_ROWS):
+        self._lock = threading.Lock()
+        self.min_rows = min_rows
+        self._executor = None
+        self.workers = 0
+        # Versions the workers cannot load, e.g. kept in memory only
+        self._unsaved = set()
+        self.batches = 0
+        self.rows = 0
+        self.local = 0
+        self.restarts = 0
+
+    def start(self, workers):
+        """Run inference in `workers` processes, started on first use"""
+        with self._lock:
+            self.workers = max(workers, 0)
+
+    def stop(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self.workers = 0
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None and self.workers:
+                from models.model_registry import registry
+                # Forking a threaded server process is unsafe; workers start clean
+                self._executor = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker, initargs=(registry.path,)
+                )
+            return self._executor
+
+    def _discard(self, executor):
+        """Drop a broken pool; the next batch starts a new one"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+                self.restarts += 1
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _score_locally(self, unsaved=None):
+        with self._lock:
+            if unsaved is not None:
+                self._unsaved.add(unsaved)
+            self.local += 1
+        return None
+
+    def apply(self, name, version, method, X):
+        """
+        method ('predict' or 'predict_proba') of a saved model version on
+        the scaled features of X, computed in a worker. Returns None when
+        the pool is off, cannot run that version or X is too small to be
+        worth the round trip, for the caller to compute in-process.
+        """
+        if version is None or len(X) < self.min_rows:
+            return self._score_locally()
+        executor = self._get_executor()
+        with self._lock:
+            unsaved = (name, version) in self._unsaved
+        if executor is None or unsaved:
+            return self._score_locally()
+        try:
+            result = executor.submit(_apply, name, version, method, X).result()
+        except LookupError:
+            return self._score_locally(unsaved=(name, version))
+        except BrokenProcessPool:
+            logger.exception('Inference worker died; scoring in-process')
+            self._discard(executor)
+            return self._score_locally()
+        with self._lock:
+            self.batches += 1
+            self.rows += len(X)
+        return result
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'min_rows': self.min_rows,
+                'batches': self.batches,
+                'rows': self.rows,
+                'in_process': self.local,
+                'restarts': self.restarts
+            }
+
+
+# Shared pool of the serving process, off unless started
+inference_pool = InferencePool()
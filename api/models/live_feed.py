@@ -0,0 +1,139 @@
+import json
+import os
+import queue
+import threading
+from collections import deque
+
+from models.chicken_model import CHICKEN_COLUMNS
+from models.database import get_connection
+from models.events import subscribe
+from models.farm_model import RECORD_COLUMNS
+
+# Seconds between keep-alive comments on an idle stream
+HEARTBEAT_INTERVAL = 15
+
+# Recent events kept for clients that reconnect with Last-Event-ID
+REPLAY_SIZE = 256
+
+# Events buffered for a slow client before it is told to resync instead
+CLIENT_QUEUE_SIZE = 100
+
+# Milliseconds the browser waits before reconnecting a dropped stream
+RECONNECT_DELAY = 3000
+
+# Event names for records created in each table
+RECORD_EVENTS = {
+    'egg_production': 'egg',
+    'feed_schedule': 'feed',
+    'health_records': 'health',
+}
+
+
+def _message(event_id, name, data):
+    return f'id: {event_id}\nevent: {name}\ndata: {json.dumps(data)}\n\n'
+
+
+class LiveFeed:
+    """
+    Fans write notifications from ChickenModel and FarmModel out to
+    Server-Sent Events clients as small change events. Each process only
+    sees its own writes; clients of other workers get a resync event when
+    they reconnect here and cannot be replayed.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = set()
+        self._recent = deque(maxlen=REPLAY_SIZE)
+        # Event ids carry a per-process prefix so a reconnect to another
+        # process (or after a restart) is detected rather than misread
+        self._prefix = os.urandom(4).hex()
+        self._last_number = 0
+
+    def on_change(self, table, action, details):
+        """Listener for models.events; does nothing while nobody is connected"""
+        if not self._clients:
+            return
+        for name, data in self._events(table, action, details):
+            self._broadcast(name, data)
+
+    def _fetch(self, table, columns, record_id):
+        row = get_connection().execute(
+            f'SELECT {", ".join(columns)} FROM {table} WHERE id = ?', (record_id,)
+        ).fetchone()
+        return dict(zip(columns, row)) if row else None
+
+    def _events(self, table, action, details):
+        """(name, data) pairs describing one write"""
+        if table == 'chickens':
+            if action == 'deleted':
+                yield 'chicken', {'action': action, 'id': details['id']}
+            elif action in ('created', 'updated'):
+                chicken = self._fetch('chickens', CHICKEN_COLUMNS.split(', '), details['id'])
+                if chicken:
+                    yield 'chicken', {'action': action, 'chicken': chicken}
+        elif table in RECORD_EVENTS:
+            if action == 'created':
+                record = self._fetch(table, RECORD_COLUMNS[table], details['id'])
+                if record:
+                    yield RECORD_EVENTS[table], {'action': action, 'record': record}
+                    if table == 'health_records' and record['health_status'] != 'healthy':
+                        yield 'health_alert', {'record': record}
+            elif action == 'bulk_created':
+                # Too many rows to push one by one; clients refetch what they show
+                yield 'bulk', {'table': table, 'count': len(details['ids']), 'chicken_ids': details['chicken_ids']}
+        elif table == 'models' and action == 'trained':
+            yield 'models', {'name': details.get('name')}
+
+    def _broadcast(self, name, data):
+        with self._lock:
+            self._last_number += 1
+            event_id = f'{self._prefix}-{self._last_number}'
+            message = _message(event_id, name, data)
+            self._recent.append((event_id, message))
+            for client in self._clients:
+                try:
+                    client.put_nowait(message)
+                except queue.Full:
+                    # The client fell behind; drop its backlog and have it reload
+                    with client.mutex:
+                        client.queue.clear()
+                    client.put_nowait(_message(event_id, 'resync', {}))
+
+    def _replay(self, last_event_id):
+        """Messages a reconnecting client missed, or a resync if they are gone"""
+        if not last_event_id:
+            return []
+        # The resync carries the current id so the next reconnect resumes from here
+        resync = [_message(f'{self._prefix}-{self._last_number}', 'resync', {})]
+        prefix, _, number = last_event_id.partition('-')
+        if prefix != self._prefix or not number.isdigit() or int(number) > self._last_number:
+            return resync
+
+        last = int(number)
+        oldest = self._last_number - len(self._recent) + 1
+        if last + 1 < oldest:
+            # Older events than the buffer holds were missed
+            return resync
+        return [message for _, message in list(self._recent)[last + 1 - oldest:]]
+
+    def stream(self, last_event_id=None):
+        """Generator of SSE messages for one client, ending when it disconnects"""
+        client = queue.Queue(CLIENT_QUEUE_SIZE)
+        with self._lock:
+            backlog = self._replay(last_event_id)
+            self._clients.add(client)
+        try:
+            yield f'retry: {RECONNECT_DELAY}\n\n'
+            yield from backlog
+            while True:
+                try:
+                    yield client.get(timeout=HEARTBEAT_INTERVAL)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+        finally:
+            with self._lock:
+                self._clients.discard(client)
+
+
+live_feed = LiveFeed()
+subscribe(live_feed.on_change)
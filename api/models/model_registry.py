@@ -0,0 +1,385 @@
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process training lock
+    fcntl = None
+
+import joblib
+import numpy as np
+import sklearn
+from sklearn.base import clone
+from sklearn.preprocessing import StandardScaler
+
+from models.events import publish
+from models.inference_pool import inference_pool
+from models.migrations import get_table_versions
+from models.prediction_cache import prediction_cache
+
+MODEL_PATH = os.environ.get(
+    'MODEL_PATH',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'trained_models')
+)
+
+# Retrain once a training table has grown by this fraction since the saved fit
+RETRAIN_THRESHOLD = float(os.environ.get('MODEL_RETRAIN_THRESHOLD', 0.1))
+
+# Number of artifact versions kept on disk per model
+KEEP_VERSIONS = 3
+
+# What the data fingerprint of an artifact counts; artifacts with another
+# kind of fingerprint are retrained
+FINGERPRINT_SOURCE = 'table_versions'
+
+
+def feature_digests(X):
+    """Hash of each row of feature matrix X, for the prediction cache"""
+    X = np.ascontiguousarray(X, dtype=float)
+    return [hashlib.blake2b(row.tobytes(), digest_size=16).digest() for row in X]
+
+
+class ModelRegistry:
+    """
+    Stores fitted estimators and their scalers on disk with a version number
+    and a fingerprint of the data they were trained on
+    """
+    def __init__(self, path=MODEL_PATH, threshold=RETRAIN_THRESHOLD):
+        self.path = path
+        self.threshold = threshold
+
+    def _manifest_path(self, name):
+        return os.path.join(self.path, f'{name}.json')
+
+    def _artifact_path(self, name, version):
+        return os.path.join(self.path, f'{name}-v{version}.joblib')
+
+    @contextmanager
+    def exclusive(self, name):
+        """
+        Hold the lock on training and saving a model across processes, so
+        two workers never both number an artifact version N+1. Where the
+        lock file cannot be created nothing can be saved either, and the
+        block runs unlocked.
+        """
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            lock = open(os.path.join(self.path, f'{name}.lock'), 'a')
+        except OSError:
+            yield
+            return
+        with lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            # Closing the file releases the lock
+            yield
+
+    def data_fingerprint(self, tables):
+        """
+        Change counter per training table. Inserts, updates and deletes all
+        bump it, so relabelling or removing a chicken marks a model stale
+        as well as new rows do
+        """
+        return dict(zip(tables, get_table_versions(tables)))
+
+    def get_metadata(self, name):
+        """Metadata of the current artifact for a model, or None"""
+        try:
+            with open(self._manifest_path(name)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def load(self, name):
+        """Load the current artifact for a model, or None if there is none"""
+        metadata = self.get_metadata(name)
+        if not metadata or metadata.get('sklearn_version') != sklearn.__version__:
+            return None
+        try:
+            artifact = joblib.load(os.path.join(self.path, metadata['artifact']))
+        except (OSError, EOFError, KeyError, ValueError):
+            return None
+        artifact['metadata'] = metadata
+        return artifact
+
+    def load_version(self, name, version):
+        """Load the estimator and scaler of a given version, or None if it is not on disk"""
+        try:
+            return joblib.load(self._artifact_path(name, version))
+        except (OSError, EOFError, KeyError, ValueError):
+            return None
+
+    def save(self, name, model, scaler, fingerprint, feature_version, extra=None):
+        """
+        Write a new artifact version and point the manifest at it; callers
+        hold exclusive(name). The metadata says whether it reached the disk.
+        """
+        previous = self.get_metadata(name)
+        version = previous['version'] + 1 if previous else 1
+        metadata = {
+            'name': name,
+            'version': version,
+            'artifact': os.path.basename(self._artifact_path(name, version)),
+            'trained_at': datetime.now().isoformat(),
+            'fingerprint': fingerprint,
+            'fingerprint_source': FINGERPRINT_SOURCE,
+            'fingerprint_hash': hashlib.sha1(json.dumps(fingerprint, sort_keys=True).encode()).hexdigest(),
+            'feature_version': feature_version,
+            'sklearn_version': sklearn.__version__
+        }
+        if extra:
+            metadata.update(extra)
+
+        # Temporary names per process, should an unlocked writer ever run concurrently
+        suffix = f'.{os.getpid()}.tmp'
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            artifact_path = self._artifact_path(name, version)
+            joblib.dump({'model': model, 'scaler': scaler}, artifact_path + suffix)
+            os.replace(artifact_path + suffix, artifact_path)
+
+            manifest_path = self._manifest_path(name)
+            with open(manifest_path + suffix, 'w') as f:
+                json.dump(metadata, f, indent=2)
+            os.replace(manifest_path + suffix, manifest_path)
+        except OSError:
+            # Read-only filesystems (e.g. serverless) keep the in-memory model only
+            return dict(metadata, saved=False)
+
+        self._prune(name, version)
+        return metadata
+
+    def _prune(self, name, version):
+        for old in range(version - KEEP_VERSIONS, 0, -1):
+            path = self._artifact_path(name, old)
+            if not os.path.exists(path):
+                break
+            os.remove(path)
+
+    def needs_retrain(self, metadata, fingerprint, feature_version):
+        """Whether the data changed enough since the artifact was trained"""
+        if not metadata or metadata.get('feature_version') != feature_version:
+            return True
+        if metadata.get('fingerprint_source') != FINGERPRINT_SOURCE:
+            # Older artifacts were fingerprinted by highest row id
+            return True
+
+        trained = metadata.get('fingerprint', {})
+        for table, version in fingerprint.items():
+            trained_version = trained.get(table, 0)
+            if trained_version == 0:
+                # Trained before any write, on synthetic data; retrain as soon as real rows exist
+                if version > 0:
+                    return True
+            elif abs(version - trained_version) / trained_version > self.threshold:
+                return True
+        return False
+
+
+registry = ModelRegistry()
+
+
+class RegisteredModel:
+    """
+    Base for predictors whose fitted model and scaler are persisted in the
+    registry. Subclasses set name, training_tables, feature_version and the
+    cross-validation scoring, and implement build_estimator(),
+    search_space() and prepare_data().
+
+    The estimator and scaler in use are held together, with their saved
+    version, in one tuple that is only ever replaced, never fitted in
+    place, so a prediction running while a new version is trained keeps
+    using a consistent pair.
+    """
+    name = None
+    training_tables = ()
+    feature_version = 1
+    classification = False
+    scoring = {}
+    selection_metric = None
+
+    def __init__(self):
+        self.fitted = None
+        self.metadata = None
+        self.training_fingerprint = None
+        self.training_lock = threading.Lock()
+
+    @property
+    def model(self):
+        return self.fitted[0] if self.fitted else None
+
+    @property
+    def scaler(self):
+        return self.fitted[1] if self.fitted else None
+
+    @property
+    def is_trained(self):
+        return self.fitted is not None
+
+    def build_estimator(self):
+        """A new, unfitted estimator with the default hyperparameters"""
+        raise NotImplementedError
+
+    def search_space(self):
+        """GridSearchCV parameter grids over the pipeline's 'model' step"""
+        raise NotImplementedError
+
+    def swap(self, model, scaler, metadata, fingerprint):
+        """Make a fitted estimator and scaler the ones used for predictions"""
+        self.metadata = metadata
+        self.training_fingerprint = fingerprint
+        # The version numbers artifacts on disk; a pair that was not saved
+        # has none, so the inference pool and prediction cache never take
+        # it for the saved artifact of that number
+        version = (metadata or {}).get('version') if (metadata or {}).get('saved', True) else None
+        self.fitted = (model, scaler, version)
+
+    def infer(self, fitted, X, method='predict'):
+        """
+        method ('predict' or 'predict_proba') of a fitted tuple's estimator
+        on feature matrix X after scaling, in the inference pool when it
+        runs and has that version saved
+        """
+        model, scaler, version = fitted
+        result = inference_pool.apply(self.name, version, method, X)
+        if result is None:
+            result = getattr(model, method)(scaler.transform(X))
+        return result
+
+    def infer_cached(self, fitted, chicken_ids, X, method='predict'):
+        """
+        infer() on the feature rows X of chickens chicken_ids, reusing the
+        outputs the prediction cache holds for the same model version and
+        feature row; only the other rows are scored
+        """
+        version = fitted[2]
+        # Fits kept in memory only share version None, so they are not cached
+        if prediction_cache is None or version is None or not len(X):
+            return self.infer(fitted, X, method)
+
+        chicken_ids = chicken_ids.tolist()
+        digests = feature_digests(X)
+        outputs = prediction_cache.get_many(self.name, chicken_ids, version, digests)
+        missing = [row for row, output in enumerate(outputs) if output is None]
+        if missing:
+            # Copies, so entries do not keep the whole batch's result alive
+            computed = [np.array(output) for output in self.infer(fitted, X[missing], method)]
+            for row, output in zip(missing, computed):
+                outputs[row] = output
+            prediction_cache.set_many(
+                self.name, [chicken_ids[row] for row in missing], version,
+                [digests[row] for row in missing], computed
+            )
+        return np.array(outputs)
+
+    def load(self, require_fresh=True):
+        """
+        Load the saved artifact, by default only if the data has not grown
+        past the retrain threshold since; returns True on success
+        """
+        artifact = registry.load(self.name)
+        if artifact is None:
+            return False
+
+        metadata = artifact['metadata']
+        if require_fresh:
+            fingerprint = registry.data_fingerprint(self.training_tables)
+            if registry.needs_retrain(metadata, fingerprint, self.feature_version):
+                return False
+
+        self.swap(artifact['model'], artifact['scaler'], metadata, metadata.get('fingerprint'))
+        return True
+
+    def reload_if_newer(self):
+        """Swap in an artifact another process saved since this one was loaded"""
+        metadata = registry.get_metadata(self.name)
+        if not metadata or metadata.get('feature_version') != self.feature_version:
+            return False
+        if self.metadata and metadata['version'] <= self.metadata.get('version', 0):
+            return False
+        if not self.load(require_fresh=False):
+            return False
+        # Cached responses and predictions of the replaced model are stale
+        publish('models', 'trained', name=self.name)
+        return True
+
+    def ensure_trained(self):
+        """
+        Whether a fitted model is in use, loading the saved artifact of this
+        feature version if there is one, however much the data grew since.
+        Never fits: the training scheduler does, off the request path, and
+        callers serve their heuristics until then.
+        """
+        if self.is_trained:
+            return True
+        metadata = registry.get_metadata(self.name)
+        if not metadata or metadata.get('feature_version') != self.feature_version:
+            return False
+        return self.load(require_fresh=False)
+
+    def new_records(self):
+        """Writes (inserts, updates and deletes) to the training tables since the model in use was fitted"""
+        fingerprint = registry.data_fingerprint(self.training_tables)
+        trained = self.training_fingerprint or {}
+        return sum(abs(version - trained.get(table, 0)) for table, version in fingerprint.items())
+
+    def train_model(self, save=True, if_due=None):
+        """
+        Fit a new estimator and scaler on the current data and swap them in.
+        Predictions keep using the previous pair until the swap. With
+        if_due, a predicate on the model, an artifact saved by another
+        process while this one waited for the lock is picked up first and
+        training only runs if if_due still holds, so workers that decided
+        to retrain at the same time train once. Returns None if skipped.
+        """
+        with self.training_lock, registry.exclusive(self.name) if save else nullcontext():
+            if if_due is not None:
+                self.reload_if_newer()
+                if not if_due(self):
+                    return None
+            return self._fit(save)
+
+    def _fit(self, save):
+        # Fingerprint before reading so rows added meanwhile count as new data
+        fingerprint = registry.data_fingerprint(self.training_tables)
+        X, y = self.prepare_data()
+
+        # Retrains keep the hyperparameters chosen by the last model selection
+        extra = {'training_rows': len(X)}
+        if self.is_trained:
+            model = clone(self.model)
+            if self.metadata and 'selection' in self.metadata:
+                extra['selection'] = self.metadata['selection']
+        else:
+            model = self.build_estimator()
+        scaler = StandardScaler()
+        model.fit(scaler.fit_transform(X), y)
+        return self._install(model, scaler, fingerprint, extra, save)
+
+    def select_model(self, jobs=None, folds=None):
+        """
+        Cross-validate the candidates of search_space() in a process pool,
+        then save and swap in the winner refitted on all data. The report
+        of every candidate is kept in the metadata under 'selection'.
+        """
+        # Only the training command searches; web workers never import it
+        from models.model_selection import search
+
+        with self.training_lock, registry.exclusive(self.name):
+            fingerprint = registry.data_fingerprint(self.training_tables)
+            X, y = self.prepare_data()
+            scaler, model, report = search(self, X, y, jobs=jobs, folds=folds)
+            return self._install(model, scaler, fingerprint, {'training_rows': len(X), 'selection': report})
+
+    def _install(self, model, scaler, fingerprint, extra, save=True):
+        """Optionally save a fitted pair as a new version, then swap it in"""
+        metadata = None
+        if save:
+            metadata = registry.save(self.name, model, scaler, fingerprint, self.feature_version, extra)
+        self.swap(model, scaler, metadata, fingerprint)
+        publish('models', 'trained', name=self.name)
+        return metadata
@@ -0,0 +1,78 @@
+import os
+
+import numpy as np
+from sklearn.model_selection import GridSearchCV, KFold, StratifiedKFold
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+# Worker processes used by a search; -1 uses every core
+SEARCH_JOBS = int(os.environ.get('MODEL_SEARCH_JOBS', -1))
+
+# Folds of k-fold cross-validation per candidate
+CV_FOLDS = int(os.environ.get('MODEL_CV_FOLDS', 5))
+
+
+def _folds(y, folds, classification):
+    """Splitter for the data, with fewer folds when there is too little of it"""
+    if classification:
+        # Every fold needs each class at least once
+        folds = min(folds, np.unique(y, return_counts=True)[1].min())
+        splitter = StratifiedKFold
+    else:
+        folds = min(folds, len(y))
+        splitter = KFold
+    if folds < 2:
+        raise ValueError('Not enough training data to cross-validate')
+    return splitter(n_splits=folds, shuffle=True, random_state=42)
+
+
+def _candidate_report(results, index, scoring):
+    """Estimator, parameters, fit time and held-out scores of one candidate"""
+    params = results['params'][index]
+    report = {
+        'estimator': type(params['model']).__name__,
+        'params': {
+            key[len('model__'):]: value for key, value in params.items() if key.startswith('model__')
+        },
+        'mean_fit_seconds': round(float(results['mean_fit_time'][index]), 4),
+    }
+    for metric, scorer in scoring.items():
+        # Error metrics are maximised negated; report them as positive errors
+        sign = -1 if scorer.startswith('neg_') else 1
+        report[metric] = round(sign * float(results[f'mean_test_{metric}'][index]), 4)
+        report[f'{metric}_std'] = round(float(results[f'std_test_{metric}'][index]), 4)
+    return report
+
+
+def search(model, X, y, jobs=None, folds=None):
+    """
+    Cross-validate every candidate in model.search_space() across a pool of
+    worker processes, scaling inside each fold so held-out scores are not
+    leaked. Returns the scaler and estimator of the winner refitted on all
+    data, and a report of every candidate, best first.
+    """
+    jobs = SEARCH_JOBS if jobs is None else jobs
+    folds = CV_FOLDS if folds is None else folds
+    pipeline = Pipeline([('scaler', StandardScaler()), ('model', model.build_estimator())])
+    grid = GridSearchCV(
+        pipeline,
+        model.search_space(),
+        scoring=model.scoring,
+        refit=model.selection_metric,
+        cv=_folds(y, folds, model.classification),
+        n_jobs=jobs
+    )
+    grid.fit(X, y)
+
+    results = grid.cv_results_
+    order = np.argsort(results[f'rank_test_{model.selection_metric}'], kind='stable')
+    candidates = [_candidate_report(results, index, model.scoring) for index in order]
+    report = {
+        'metric': model.selection_metric,
+        'folds': grid.n_splits_,
+        'jobs': jobs,
+        'best': candidates[0],
+        'candidates': candidates
+    }
+    best = grid.best_estimator_
+    return best.named_steps['scaler'], best.named_steps['model'], report
@@ -0,0 +1,81 @@
+import base64
+import json
+from datetime import date, timedelta
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(values):
+    """Encode the sort key of the last row of a page as an opaque token"""
+    raw = json.dumps(list(values), separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Decode a token produced by encode_cursor, raising ValueError if invalid"""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or not values:
+        raise ValueError('Invalid cursor')
+    # Only scalars can be bound as query parameters
+    if not all(value is None or isinstance(value, (str, int, float)) for value in values):
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def parse_limit(value, default=DEFAULT_PAGE_SIZE):
+    """Validate a page size query parameter"""
+    if value in (None, ''):
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    return min(limit, MAX_PAGE_SIZE)
+
+
+
+def parse_id(value, name='chicken_id'):
+    """Validate an id query parameter; None when it is absent"""
+    if value in (None, ''):
+        return None
+    try:
+        parsed = int(value)
+    except ValueError:
+        raise ValueError(f'{name} must be an integer')
+    if parsed < 1:
+        raise ValueError(f'{name} must be positive')
+    return parsed
+
+def parse_ids(values, name='chicken_id'):
+    """Validate the values of a repeated id query parameter; the distinct ids, in order"""
+    ids = (parse_id(value, name) for value in values)
+    return list(dict.fromkeys(chicken_id for chicken_id in ids if chicken_id is not None))
+
+def date_range_filters(column, start_date=None, end_date=None):
+    """
+    SQL clauses for an inclusive YYYY-MM-DD range over an ISO date column.
+    end_date covers the whole day, so it is turned into an exclusive bound
+    on the following day and both sides stay index range scans.
+    """
+    clauses = []
+    params = []
+    if start_date:
+        clauses.append(f'{column} >= ?')
+        params.append(date.fromisoformat(start_date).isoformat())
+    if end_date:
+        clauses.append(f'{column} < ?')
+        params.append((date.fromisoformat(end_date) + timedelta(days=1)).isoformat())
+    return clauses, params
+
+
+def where(clauses):
+    return ' WHERE ' + ' AND '.join(clauses) if clauses else ''
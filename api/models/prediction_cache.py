@@ -0,0 +1,130 @@
+import os
+import threading
+from collections import OrderedDict
+
+from models.events import subscribe
+
+# PREDICTION_CACHE=off scores every chicken on every request
+PREDICTION_CACHE = os.environ.get('PREDICTION_CACHE', 'on')
+PREDICTION_CACHE_MAX_ENTRIES = int(os.environ.get('PREDICTION_CACHE_MAX_ENTRIES', 50000))
+
+# Tables whose writes change the features of the chicken they name
+FEATURE_TABLES = ('chickens', 'health_records')
+
+
+class PredictionCache:
+    """
+    Bounded LRU of model outputs per chicken. An entry keeps the output of
+    one model for one chicken with the model version and the hash of the
+    feature row it was computed from, and only answers lookups for that
+    same version and hash; anything else is a miss, replaced by the fresh
+    result. A result computed while its chicken changed or its model was
+    retrained is therefore never served for the new features or version.
+    Writes to a chicken or its health records and retraining drop the
+    entries they make stale right away, so they do not wait for eviction.
+    """
+    def __init__(self, max_entries=PREDICTION_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # (model name, chicken id) -> (version, feature hash, output)
+        self._lock = threading.Lock()
+        self.hits = {}
+        self.misses = {}
+        self.stale = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @classmethod
+    def from_env(cls, setting=PREDICTION_CACHE):
+        if setting == 'off':
+            return None
+        return cls()
+
+    def get_many(self, name, chicken_ids, version, digests):
+        """Cached output of model name per chicken, None where it has to be computed"""
+        outputs = []
+        hits = stale = 0
+        with self._lock:
+            for chicken_id, digest in zip(chicken_ids, digests):
+                key = (name, chicken_id)
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] == version and entry[1] == digest:
+                    self._entries.move_to_end(key)
+                    outputs.append(entry[2])
+                    hits += 1
+                else:
+                    outputs.append(None)
+                    stale += entry is not None
+            self.hits[name] = self.hits.get(name, 0) + hits
+            self.misses[name] = self.misses.get(name, 0) + len(outputs) - hits
+            self.stale += stale
+        return outputs
+
+    def set_many(self, name, chicken_ids, version, digests, outputs):
+        with self._lock:
+            for chicken_id, digest, output in zip(chicken_ids, digests, outputs):
+                key = (name, chicken_id)
+                self._entries[key] = (version, digest, output)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, chicken_ids):
+        """Drop every model's entries for the given chickens"""
+        with self._lock:
+            removed = 0
+            for name in self.misses:
+                for chicken_id in chicken_ids:
+                    removed += self._entries.pop((name, chicken_id), None) is not None
+            self.invalidations += removed
+
+    def drop_model(self, name):
+        """Drop the entries of a model, e.g. after it was retrained"""
+        with self._lock:
+            keys = [key for key in self._entries if key[0] == name]
+            for key in keys:
+                del self._entries[key]
+            self.invalidations += len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def on_change(self, table, action, details):
+        """Listener for models.events"""
+        if table == 'models' and action == 'trained':
+            self.drop_model(details['name'])
+        elif table in FEATURE_TABLES:
+            if action == 'bulk_created':
+                self.invalidate(set(details['chicken_ids']))
+            elif details.get('chicken_id') is not None:
+                self.invalidate([details['chicken_id']])
+            # Other writes name no chicken; their entries miss on the feature hash
+
+    def get_stats(self):
+        with self._lock:
+            hits, misses = sum(self.hits.values()), sum(self.misses.values())
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': round(hits / (hits + misses), 4) if hits + misses else 0.0,
+                'stale': self.stale,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'by_model': {
+                    name: {
+                        'hits': self.hits[name],
+                        'misses': self.misses[name],
+                        'hit_rate': round(self.hits[name] / (self.hits[name] + self.misses[name]), 4)
+                        if self.hits[name] + self.misses[name] else 0.0
+                    } for name in self.misses
+                }
+            }
+
+
+prediction_cache = PredictionCache.from_env()
+
+if prediction_cache is not None:
+    subscribe(prediction_cache.on_change)
@@ -0,0 +1,116 @@
+import logging
+import os
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# MODEL_SCHEDULER selects what the background thread does: "train" (default)
+# retrains when due, "reload" only picks up artifacts saved by another
+# process (e.g. `python api/train_models.py --watch`), "off" disables it
+SCHEDULER_MODE = os.environ.get('MODEL_SCHEDULER', 'train')
+
+# Retrain once this many rows were added, changed or deleted in a model's training tables...
+RETRAIN_RECORDS = int(os.environ.get('MODEL_RETRAIN_RECORDS', 200))
+
+# ...or once the model is this many seconds old and any rows were written (0 disables)
+RETRAIN_INTERVAL = float(os.environ.get('MODEL_RETRAIN_INTERVAL', 6 * 60 * 60))
+
+# Seconds between checks
+POLL_INTERVAL = float(os.environ.get('MODEL_SCHEDULER_POLL', 30))
+
+
+class TrainingScheduler:
+    """
+    Background thread that keeps RegisteredModel instances current. Training
+    builds a new estimator and scaler and swaps them in, so predictions are
+    never blocked by it and never see a partly fitted model.
+    """
+    def __init__(self, models, mode=SCHEDULER_MODE, record_threshold=RETRAIN_RECORDS,
+                 interval=RETRAIN_INTERVAL, poll_interval=POLL_INTERVAL):
+        self.models = models
+        self.mode = mode
+        self.record_threshold = record_threshold
+        self.interval = interval
+        self.poll_interval = poll_interval
+        self._thread = None
+        self._wake = threading.Event()
+        self._forced = False
+        self.runs = 0
+        self.last_check = None
+        self.last_error = None
+
+    def start(self):
+        """Start the thread unless it is disabled or already running"""
+        if self.mode == 'off' or self.is_running():
+            return
+        self._thread = threading.Thread(target=self._run, name='model-training-scheduler', daemon=True)
+        self._thread.start()
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def request_training(self):
+        """Retrain every model on the next pass, which starts immediately"""
+        self._forced = True
+        self._wake.set()
+
+    def _run(self):
+        # The first pass runs right away so untrained models are fitted
+        # here rather than by the first prediction request
+        while True:
+            force, self._forced = self._forced, False
+            self.check(force=force)
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def is_due(self, model):
+        """Whether the data changed enough, or the model is old enough, to retrain"""
+        if not model.is_trained:
+            return True
+        new_records = model.new_records()
+        if new_records >= self.record_threshold:
+            return True
+        if self.interval and new_records and model.metadata:
+            age = (datetime.now() - datetime.fromisoformat(model.metadata['trained_at'])).total_seconds()
+            return age >= self.interval
+        return False
+
+    def check(self, force=False):
+        """One pass: pick up newer artifacts, then retrain models that are due"""
+        self.last_check = datetime.now().isoformat()
+        for model in self.models:
+            try:
+                model.reload_if_newer()
+                if self.mode == 'train' and (force or self.is_due(model)):
+                    # Every worker runs a scheduler; re-checked under the
+                    # training lock so only one of them retrains
+                    if model.train_model(if_due=None if force else self.is_due) is not None:
+                        self.runs += 1
+            except Exception as e:
+                # Keep serving the current model; try again on the next pass
+                logger.exception('Scheduled training of %s model failed', model.name)
+                self.last_error = f'{model.name}: {e}'
+
+    def get_status(self):
+        return {
+            'mode': self.mode,
+            'running': self.is_running(),
+            'record_threshold': self.record_threshold,
+            'interval_seconds': self.interval,
+            'poll_seconds': self.poll_interval,
+            'runs': self.runs,
+            'last_check': self.last_check,
+            'last_error': self.last_error,
+            'models': {
+                model.name: {
+                    'version': (model.metadata or {}).get('version'),
+                    'trained_at': (model.metadata or {}).get('trained_at'),
+                    'new_records': model.new_records() if model.is_trained else None
+                } for model in self.models
+            }
+        }
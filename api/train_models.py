@@ -0,0 +1,59 @@
+# train_models.py - Retrain the AI models and refresh the saved artifacts
+import argparse
+import json
+import os
+import sys
+
+# This script trains in the foreground; don't also start the web app's
+# background scheduler on import
+os.environ.setdefault('MODEL_SCHEDULER', 'off')
+
+from models.ai_model import health_model, production_model, scheduler
+
+
+def print_selection(report):
+    """One line per candidate, best first"""
+    metric = report['metric']
+    print(f"{report['folds']}-fold cross-validation, ranked by {metric}:")
+    for candidate in report['candidates']:
+        params = ', '.join(f'{key}={value}' for key, value in candidate['params'].items())
+        print(f"  {candidate[metric]:>8.4f} ±{candidate[f'{metric}_std']:.4f}  "
+              f"{candidate['mean_fit_seconds']:>7.3f}s  {candidate['estimator']}({params})")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Retrain the AI models and save new artifacts')
+    parser.add_argument('--search', action='store_true',
+                        help='choose hyperparameters and estimators by cross-validation first')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='worker processes for --search (default MODEL_SEARCH_JOBS or all cores)')
+    parser.add_argument('--folds', type=int, default=None,
+                        help='cross-validation folds for --search (default MODEL_CV_FOLDS or 5)')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep retraining in the foreground as new data arrives')
+    args = parser.parse_args()
+
+    if args.watch:
+        # Keep retraining as data arrives; web workers running with
+        # MODEL_SCHEDULER=reload pick up each new artifact
+        scheduler.mode = 'train'
+        scheduler.start()
+        print("Watching for new data, press Ctrl+C to stop...")
+        try:
+            while scheduler.is_running():
+                scheduler.join(1)
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+
+    for model in (health_model, production_model):
+        if args.search:
+            print(f"Selecting {model.name} model...")
+            model.select_model(jobs=args.jobs, folds=args.folds)
+            print_selection(model.metadata['selection'])
+        else:
+            print(f"Training {model.name} model...")
+            model.train_model()
+        metadata = {key: value for key, value in model.metadata.items() if key != 'selection'}
+        print(json.dumps(metadata, indent=2))
+    print("Model artifacts saved successfully!")
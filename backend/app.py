@@ -1,34 +1,256 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, abort, Response, request, jsonify, render_template
 from flask_cors import CORS
 import json
 import os
-from datetime import datetime
+from functools import wraps
+import sqlite3
+from datetime import date, datetime
 from models.chicken_model import ChickenModel
 from models.farm_model import FarmModel
-from models.ai_model import health_model, production_model, feed_model
+from models.pagination import decode_cursor, encode_cursor, parse_id, parse_ids, parse_limit
+from models.migrations import VERSIONED_TABLES, get_table_versions
+from models.export import EXPORT_FORMATS
+from models.cache import response_cache
+from models.live_feed import live_feed
+from models.profiling import request_profiler
+from models.ingest_queue import QueueFull, ingest_queue
+from models.ai_model import PLANNED_FEED_NOTES, health_model, production_model, feed_model
+from models.flock_snapshot import flock_snapshot
 
 app = Flask(__name__, template_folder='../templates', static_folder='../static')
-CORS(app)  # Enable CORS for all routes
+CORS(app, expose_headers=['X-Next-Cursor', 'ETag', 'Server-Timing'])  # Enable CORS for all routes
+
+if request_profiler is not None:
+    request_profiler.install(app)
 
 # Initialize the models
 chicken_model = ChickenModel()
 farm_model = FarmModel()
 
+if ingest_queue is not None:
+    ingest_queue.start()
+
+def id_arg(name='chicken_id'):
+    """Id query parameter, None when absent; an invalid one ends the request with 400"""
+    try:
+        return parse_id(request.args.get(name), name)
+    except ValueError as e:
+        response = jsonify({"error": str(e)})
+        response.status_code = 400
+        abort(response)
+
+def paginated_response(fetch, cursor_keys, transform=None, **filters):
+    """Serve one page of fetch() results, adding X-Next-Cursor when more rows exist"""
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        cursor = decode_cursor(request.args.get('cursor'))
+        if cursor is not None:
+            if len(cursor) != len(cursor_keys):
+                raise ValueError('Invalid cursor')
+            if len(cursor_keys) == 1:
+                cursor = cursor[0]
+        rows = fetch(cursor=cursor, limit=limit + 1, **filters)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    page = rows[:limit]
+    if transform:
+        page = transform(page)
+
+    response = jsonify(page)
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        response.headers['X-Next-Cursor'] = encode_cursor([last[key] for key in cursor_keys])
+    return response
+
+def attach_predictions(chickens):
+    """Add health risk and production predictions to chickens using batch inference"""
+    flock = flock_snapshot.get().select([chicken['id'] for chicken in chickens])
+    if flock is None:
+        # A chicken on the page was added by another process since; score the dicts
+        risks = health_model.predict_health_risk_batch(chickens)
+        productions = production_model.predict_production_batch(chickens)
+    else:
+        risks = health_model.predict_flock_health_risk(flock)
+        productions = production_model.predict_flock_production(flock)
+    for chicken, risk, production in zip(chickens, risks, productions):
+        chicken['health_risk'] = risk
+        chicken['production_prediction'] = production
+    return chickens
+
+# Largest number of records accepted by one bulk upload
+BULK_MAX_ROWS = 50000
+
+def read_bulk_rows():
+    """Parse a bulk upload body sent as a JSON array or as NDJSON"""
+    if request.mimetype in ('application/x-ndjson', 'application/ndjson', 'application/jsonl'):
+        rows = []
+        for number, line in enumerate(request.get_data(as_text=True).splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                raise ValueError(f'Invalid JSON on line {number}')
+    else:
+        rows = request.get_json(silent=True)
+        if not isinstance(rows, list):
+            raise ValueError('Expected a JSON array or NDJSON body')
+
+    if len(rows) > BULK_MAX_ROWS:
+        raise ValueError(f'At most {BULK_MAX_ROWS} records per upload')
+    return rows
+
+def bulk_response(table, record_bulk):
+    """Insert (or queue) an uploaded batch and report the outcome of every row"""
+    try:
+        rows = read_bulk_rows()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if ingest_queue is None:
+        results = record_bulk(rows)
+    else:
+        try:
+            results = ingest_queue.submit(table, rows)
+        except QueueFull as e:
+            return jsonify({"error": str(e)}), 503, {'Retry-After': '1'}
+    recorded = sum(1 for r in results if r['status'] == 'recorded')
+    queued = sum(1 for r in results if r['status'] == 'queued')
+    body = {
+        "recorded": recorded,
+        "failed": len(results) - recorded - queued,
+        "results": results
+    }
+    if queued:
+        body["queued"] = queued
+        return jsonify(body), 202
+    return jsonify(body), 201 if recorded else 400
+
+def queued_write_response(table, data):
+    """
+    Queue one record for the ingestion queue's next group commit; answers
+    like a direct write, or 202 when the queue acknowledges before committing
+    """
+    try:
+        result = ingest_queue.submit(table, [data])[0]
+    except QueueFull as e:
+        return jsonify({"error": str(e)}), 503, {'Retry-After': '1'}
+    if result['status'] == 'error':
+        return jsonify({"error": result['error']}), 404 if result['error'] == 'Chicken not found' else 400
+    if result['status'] == 'queued':
+        return jsonify({"status": "queued"}), 202
+    return jsonify({"id": result['id'], "status": "recorded"}), 201
+
+# Tables whose writes invalidate cached dashboard and AI responses
+INSIGHT_TAGS = ('chickens', 'egg_production', 'health_records', 'models')
+
+def cache_key(tags):
+    """
+    Cache key of the request: its path with the change counters of the
+    tables among tags, read before the body is computed, today's date and,
+    for the 'models' tag, the loaded model versions. Writes and retrains by
+    any process therefore move requests to new keys, and a body is never
+    served under counters newer than the ones it was computed from.
+    """
+    tables = tuple(tag for tag in tags if tag in VERSIONED_TABLES)
+    parts = [str(version) for version in get_table_versions(tables)] if tables else []
+    parts.append(date.today().isoformat())
+    if 'models' in tags:
+        parts.append(loaded_model_versions())
+    return f'{request.full_path}#{"-".join(parts)}'
+
+def cached_response(*tags):
+    """Cache a GET view's JSON body until it expires or one of tags is written"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if response_cache is None:
+                return view(*args, **kwargs)
+
+            key = cache_key(tags)
+            body = response_cache.get(key)
+            if body is not None:
+                response = app.response_class(body, mimetype='application/json')
+                response.headers['X-Cache'] = 'HIT'
+                return response
+
+            # Snapshot before computing so a write that lands meanwhile
+            # keeps the possibly stale result out of the cache
+            generations = response_cache.generations(tags)
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                response_cache.set(key, response.get_data(), tags, generations)
+            response.headers['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
+
+def loaded_model_versions():
+    """Versions of the AI models loaded in this process, for ETags of predictions"""
+    return '.'.join(
+        str((getattr(model, 'metadata', None) or {}).get('version', 0))
+        for model in (health_model, production_model)
+    )
+
+def conditional_response(*tables, daily=False, predictions=False):
+    """
+    Give a GET view a weak ETag built from the change counters of tables and
+    answer a matching If-None-Match with 304 without running the view.
+    daily adds today's date for bodies relative to it; predictions adds the
+    loaded model versions.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET':
+                return view(*args, **kwargs)
+
+            # Read before the view runs so a concurrent write can only make
+            # the tag older than the body, never newer
+            versions = get_table_versions(tables)
+
+            def etag():
+                parts = [str(version) for version in versions]
+                if daily:
+                    parts.append(date.today().isoformat())
+                if predictions:
+                    parts.append(loaded_model_versions())
+                return '-'.join(parts)
+
+            if request.if_none_match.contains_weak(etag()):
+                response = app.response_class(status=304)
+            else:
+                response = app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag(), weak=True)
+            # Let browsers keep the body but revalidate on every poll
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
 @app.route('/api/chickens', methods=['GET', 'POST'])
+@conditional_response('chickens', 'health_records', daily=True, predictions=True)
 def chickens():
     if request.method == 'POST':
         data = request.json
         chicken_id = chicken_model.add_chicken(data)
         return jsonify({"id": chicken_id, "status": "created"}), 201
     else:
-        chickens = chicken_model.get_all_chickens()
-        return jsonify(chickens)
+        return paginated_response(
+            chicken_model.get_all_chickens, ('id',),
+            transform=attach_predictions if request.args.get('include') == 'predictions' else None,
+            health_status=request.args.get('health_status'),
+            breed=request.args.get('breed'))
 
 @app.route('/api/chickens/<int:chicken_id>', methods=['GET', 'PUT', 'DELETE'])
+@conditional_response('chickens', 'health_records', daily=True, predictions=True)
 def chicken(chicken_id):
     if request.method == 'GET':
         chicken = chicken_model.get_chicken(chicken_id)
@@ -48,24 +270,140 @@ def chicken(chicken_id):
         return jsonify({"status": "deleted"})
 
 @app.route('/api/eggs', methods=['GET', 'POST'])
+@conditional_response('egg_production')
 def eggs():
     if request.method == 'POST':
         data = request.json
-        egg_id = farm_model.record_egg_production(data)
+        if ingest_queue is not None:
+            return queued_write_response('egg_production', data)
+        try:
+            egg_id = farm_model.record_egg_production(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except sqlite3.IntegrityError:
+            return jsonify({"error": "Chicken not found"}), 404
         return jsonify({"id": egg_id, "status": "recorded"}), 201
     else:
-        eggs = farm_model.get_egg_production()
-        return jsonify(eggs)
+        return paginated_response(
+            farm_model.get_egg_production, ('date', 'id'),
+            chicken_id=id_arg(),
+            start_date=request.args.get('start_date'),
+            end_date=request.args.get('end_date'))
 
 @app.route('/api/feed', methods=['GET', 'POST'])
+@conditional_response('feed_schedule')
 def feed():
     if request.method == 'POST':
         data = request.json
-        feed_id = farm_model.record_feed_schedule(data)
+        if ingest_queue is not None:
+            return queued_write_response('feed_schedule', data)
+        try:
+            feed_id = farm_model.record_feed_schedule(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except sqlite3.IntegrityError:
+            return jsonify({"error": "Chicken not found"}), 404
         return jsonify({"id": feed_id, "status": "recorded"}), 201
     else:
-        feed = farm_model.get_feed_schedule()
-        return jsonify(feed)
+        return paginated_response(
+            farm_model.get_feed_schedule, ('id',),
+            chicken_id=id_arg())
+
+@app.route('/api/eggs/summary', methods=['GET'])
+@conditional_response('egg_production', daily=True)
+def egg_summary():
+    """Get daily or weekly egg totals as chart-ready series"""
+    try:
+        summary = farm_model.get_egg_summary(
+            period=request.args.get('period', 'day'),
+            chicken_id=id_arg(),
+            start_date=request.args.get('start_date'),
+            end_date=request.args.get('end_date'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(summary)
+
+@app.route('/api/eggs/bulk', methods=['POST'])
+def eggs_bulk():
+    return bulk_response('egg_production', farm_model.record_egg_production_bulk)
+
+@app.route('/api/feed/bulk', methods=['POST'])
+def feed_bulk():
+    return bulk_response('feed_schedule', farm_model.record_feed_schedule_bulk)
+
+@app.route('/api/health/bulk', methods=['POST'])
+def health_bulk():
+    return bulk_response('health_records', farm_model.record_health_check_bulk)
+
+# Datasets that can be exported and the tables behind them
+EXPORT_TABLES = {
+    'eggs': 'egg_production',
+    'feed': 'feed_schedule',
+    'health': 'health_records'
+}
+
+@app.route('/api/export/<dataset>', methods=['GET'])
+def export_records(dataset):
+    """Stream farm history as CSV or NDJSON straight from the database cursor"""
+    if dataset not in EXPORT_TABLES:
+        return jsonify({"error": "Unknown dataset"}), 404
+
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": "format must be csv or ndjson"}), 400
+    mimetype, encode = EXPORT_FORMATS[export_format]
+
+    try:
+        columns, rows = farm_model.iter_records(
+            EXPORT_TABLES[dataset],
+            chicken_id=parse_id(request.args.get('chicken_id')),
+            start_date=request.args.get('start_date'),
+            end_date=request.args.get('end_date'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return Response(encode(columns, rows), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={dataset}.{export_format}'
+    })
+
+@app.route('/api/events', methods=['GET'])
+def live_events():
+    """Stream chicken, egg, feed and health changes as Server-Sent Events"""
+    return Response(live_feed.stream(request.headers.get('Last-Event-ID')), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # Keep reverse proxies from buffering the stream
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/feed/optimize', methods=['GET', 'POST'])
+@conditional_response('chickens')
+def optimize_flock_feed():
+    """
+    Get the feed plan of the flock, or of the chickens selected by
+    chicken_id, breed and health_status, with the feed needed per feed type
+    and time slot over `days` days. POST also records one day of the plan
+    as feed_schedule rows, replacing those of an earlier recorded plan for
+    the same chickens.
+    """
+    try:
+        days = parse_id(request.args.get('days'), 'days') or 1
+        chicken_ids = parse_ids(request.args.getlist('chicken_id'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    flock = flock_snapshot.get()
+    if chicken_ids:
+        flock = flock.select(chicken_ids)
+        if flock is None:
+            return jsonify({"error": "Chicken not found"}), 404
+    flock = flock.matching(breed=request.args.get('breed'), health_status=request.args.get('health_status'))
+
+    plan = feed_model.optimize_flock_feed(flock, days, include_chickens=request.args.get('summary') != 'true')
+    if request.method == 'POST':
+        results = farm_model.replace_feed_schedule_bulk(feed_model.schedule_rows(flock), PLANNED_FEED_NOTES)
+        plan['scheduled'] = sum(1 for r in results if r['status'] == 'recorded')
+        return jsonify(plan), 201
+    return jsonify(plan)
 
 @app.route('/api/feed/optimize/<int:chicken_id>', methods=['GET'])
 def optimize_feed(chicken_id):
@@ -74,17 +412,37 @@ def optimize_feed(chicken_id):
     return jsonify(optimization)
 
 @app.route('/api/health', methods=['GET'])
+@conditional_response('health_records', daily=True)
 def health():
     health_data = farm_model.get_health_predictions()
     return jsonify(health_data)
 
+@app.route('/api/health/records', methods=['GET'])
+@conditional_response('health_records')
+def health_records():
+    return paginated_response(
+        farm_model.get_health_records, ('date', 'id'),
+        chicken_id=id_arg(),
+        start_date=request.args.get('start_date'),
+        end_date=request.args.get('end_date'),
+        health_status=request.args.get('health_status'))
+
 @app.route('/api/health', methods=['POST'])
 def record_health():
     data = request.json
-    health_id = farm_model.record_health_check(data)
+    if ingest_queue is not None:
+        return queued_write_response('health_records', data)
+    try:
+        health_id = farm_model.record_health_check(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except sqlite3.IntegrityError:
+        return jsonify({"error": "Chicken not found"}), 404
     return jsonify({"id": health_id, "status": "recorded"}), 201
 
 @app.route('/api/ai/health/predict/<int:chicken_id>', methods=['GET'])
+@conditional_response('chickens', 'health_records', daily=True, predictions=True)
+@cached_response(*INSIGHT_TAGS)
 def predict_health_risk(chicken_id):
     """Get AI-based health risk prediction for a specific chicken"""
     chicken = chicken_model.get_chicken(chicken_id)
@@ -95,6 +453,8 @@ def predict_health_risk(chicken_id):
     return jsonify(prediction)
 
 @app.route('/api/ai/production/predict/<int:chicken_id>', methods=['GET'])
+@conditional_response('chickens', daily=True, predictions=True)
+@cached_response(*INSIGHT_TAGS)
 def predict_production(chicken_id):
     """Get AI-based production prediction for a specific chicken"""
     chicken = chicken_model.get_chicken(chicken_id)
@@ -104,65 +464,78 @@ def predict_production(chicken_id):
     prediction = production_model.predict_production(chicken)
     return jsonify(prediction)
 
+@app.route('/api/system/cache', methods=['GET'])
+def cache_stats():
+    """Get hit/miss metrics of the response cache"""
+    if response_cache is None:
+        return jsonify({"enabled": False})
+    return jsonify(dict(response_cache.get_stats(), enabled=True))
+
+@app.route('/api/system/metrics', methods=['GET'])
+def metrics():
+    """Get per-route request timings and ingestion queue metrics in the Prometheus text format"""
+    if request_profiler is None and ingest_queue is None:
+        return Response('# Profiling is disabled, set PROFILING=on\n', mimetype='text/plain')
+    body = request_profiler.render_metrics() if request_profiler is not None else ''
+    if ingest_queue is not None:
+        body += ingest_queue.render_metrics()
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/system/ingest', methods=['GET'])
+def ingest_stats():
+    """Get depth, batch and commit latency metrics of the ingestion queue"""
+    if ingest_queue is None:
+        return jsonify({"enabled": False})
+    return jsonify(dict(ingest_queue.get_stats(), enabled=True))
+
+@app.route('/api/system/profiles', methods=['GET'])
+def slow_request_profiles():
+    """Get cProfile statistics of slow sampled requests"""
+    if request_profiler is None:
+        return jsonify({"enabled": False})
+    return jsonify(dict(request_profiler.get_profiles(), enabled=True))
+
 @app.route('/api/dashboard', methods=['GET'])
+@conditional_response('chickens', 'egg_production', 'health_records', daily=True, predictions=True)
+@cached_response(*INSIGHT_TAGS)
 def dashboard():
-    # Get comprehensive dashboard data
-    chickens = chicken_model.get_all_chickens()
-    eggs = farm_model.get_egg_production()
-    health_records = farm_model.get_health_records()
-
-    # Calculate stats
-    total_chickens = len(chickens)
-    healthy_count = sum(1 for c in chickens if c['health_status'] == 'healthy')
-    sick_count = sum(1 for c in chickens if c['health_status'] == 'sick')
-    daily_egg_count = sum(1 for e in eggs if e['date'].split('T')[0] == str(datetime.now().date()))
-
-    # Find recent health alerts
-    recent_health_issues = [hr for hr in health_records
-                           if hr['date'].split('T')[0] == str(datetime.now().date())
-                           and hr['health_status'] != 'healthy']
+    # Chicken counts and AI insights read the columnar flock snapshot; the
+    # other counters come from indexed aggregate queries
+    flock = flock_snapshot.get()
+    summary = farm_model.dashboard_summary(status_counts=flock.status_counts())
 
     # Generate AI insights
-    ai_insights = generate_ai_insights(chickens, eggs)
+    ai_insights = generate_ai_insights(flock, summary['average_daily_eggs'])
 
     dashboard_data = {
-        'total_chickens': total_chickens,
-        'healthy_chickens': healthy_count,
-        'sick_chickens': sick_count,
-        'daily_egg_count': daily_egg_count,
-        'health_alerts': len(recent_health_issues),
-        'recent_health_records': recent_health_issues[:5],  # Last 5 health records
+        'total_chickens': summary['total_chickens'],
+        'healthy_chickens': summary['healthy_chickens'],
+        'sick_chickens': summary['sick_chickens'],
+        'daily_egg_count': summary['daily_egg_count'],
+        'daily_egg_total': summary['daily_egg_total'],
+        'health_alerts': summary['health_alerts'],
+        'recent_health_records': summary['recent_health_records'],  # Last 5 health records
         'ai_insights': ai_insights
     }
 
     return jsonify(dashboard_data)
 
-def generate_ai_insights(chickens, eggs):
-    """Generate AI-based insights for the dashboard"""
-    if not chickens:
+def generate_ai_insights(flock, avg_production):
+    """Generate AI-based insights for the dashboard from FlockColumns"""
+    if not len(flock):
         return {"message": "Add chickens to get AI insights"}
 
-    # Calculate average production
-    avg_production = sum([e['quantity'] for e in eggs]) / len(eggs) if eggs else 0
-
-    # Count chickens by health risk
-    high_risk_count = 0
-    for chicken in chickens:
-        risk = health_model.predict_health_risk(chicken)
-        if risk['risk_level'] == 'high':
-            high_risk_count += 1
+    # Score the whole flock with one vectorized call per model
+    needs_attention, _ = health_model.score_flock(flock)
 
-    # Predicted production
-    total_predicted = 0
-    for chicken in chickens:
-        prediction = production_model.predict_production(chicken)
-        total_predicted += prediction['predicted_eggs_per_week']
+    high_risk_count = int(needs_attention.sum())
+    total_predicted = float(production_model.score_flock(flock).sum())
 
     return {
         "high_health_risk_count": high_risk_count,
         "total_predicted_weekly_eggs": round(total_predicted, 2),
         "average_daily_eggs": round(avg_production, 2),
-        "feed_optimization_available": len(chickens) > 0,
+        "feed_optimization_available": len(flock) > 0,
         "recommendations": [
             f"Monitor {high_risk_count} chickens with high health risk",
             f"Expected weekly production: ~{round(total_predicted)} eggs",
@@ -2,6 +2,14 @@ import numpy as np
 from datetime import datetime
 from models.chicken_model import ChickenModel
 from models.farm_model import FarmModel
+from models.flock_snapshot import FlockColumns
+from models.profiling import phase
+
+
+def breed_factor(breed):
+    """Production factor of a breed."""
+    breed = (breed or '').lower()
+    return 1.2 if 'rhode' in breed else (1.1 if 'sussex' in breed else 1.0)
 
 
 class HealthPredictionModel:
@@ -10,27 +18,41 @@ class HealthPredictionModel:
         self.chicken_model = ChickenModel()
         self.farm_model = FarmModel()
 
-    def _compute_score(self, chicken):
-        age = float(chicken.get('age', 0))
-        recent_issues = float(chicken.get('recent_health_issues', 0))
-        health_flag = 1.0 if chicken.get('health_status') != 'healthy' else 0.0
-
-        # Simple weighted score in [0, 1]
-        score = 0.4 * (recent_issues / (1 + recent_issues)) + 0.3 * health_flag + 0.3 * min(age / 100.0, 1.0)
-        return float(min(max(score, 0.0), 1.0))
-
     def predict_health_risk(self, chicken_data):
-        score = self._compute_score(chicken_data)
-        risk_level = 'high' if score >= 0.5 else 'low'
-        needs = score >= 0.5
-        recommendation = 'Monitor closely' if needs else 'Continue regular care'
-
-        return {
-            'risk_level': risk_level,
-            'probability': round(score, 3),
-            'needs_attention': bool(needs),
-            'recommendation': recommendation
-        }
+        return self.predict_health_risk_batch([chicken_data])[0]
+
+    def score_flock(self, flock):
+        """Needs-attention flags and weighted scores in [0, 1] for every row of FlockColumns."""
+        with phase('inference'):
+            age = flock.age
+            recent_issues = flock.recent_health_issues.astype(float)
+            health_flag = (~flock.status_is('healthy')).astype(float)
+
+            # Simple weighted score in [0, 1]
+            scores = 0.4 * (recent_issues / (1 + recent_issues)) + 0.3 * health_flag + 0.3 * np.minimum(age / 100.0, 1.0)
+            scores = np.clip(scores, 0.0, 1.0)
+        return scores >= 0.5, scores
+
+    def predict_flock_health_risk(self, flock):
+        """Health risk of every row of FlockColumns."""
+        needs_attention, scores = self.score_flock(flock)
+        return [
+            {
+                'risk_level': 'high' if needs else 'low',
+                'probability': round(float(score), 3),
+                'needs_attention': bool(needs),
+                'recommendation': 'Monitor closely' if needs else 'Continue regular care'
+            } for needs, score in zip(needs_attention, scores)
+        ]
+
+    def predict_health_risk_batch(self, chickens):
+        """Score many chickens at once; weighted score in [0, 1] per chicken."""
+        if not chickens:
+            return []
+
+        # Fill in features the caller did not supply from the feature store
+        chickens = self.farm_model.attach_features(chickens)
+        return self.predict_flock_health_risk(FlockColumns.from_chickens(chickens))
 
 
 class ProductionPredictionModel:
@@ -40,38 +62,61 @@ class ProductionPredictionModel:
         self.farm_model = FarmModel()
 
     def predict_production(self, chicken_data):
-        age = float(chicken_data.get('age', 0))
-        health_status = chicken_data.get('health_status', 'healthy')
-        days_since_added = float(chicken_data.get('days_since_added', 0))
-        breed = (chicken_data.get('breed') or '').lower()
-
-        # Base productivity by age: peak production around 20-60 weeks
-        if age < 18:
-            base = 1.0  # young
-        elif age <= 72:
-            base = 4.0  # adult, eggs per week baseline
-        else:
-            base = 2.5  # older
-
-        # Health multiplier
-        health_mul = 0.6 if health_status == 'sick' else (0.9 if health_status == 'recovery' else 1.0)
-
-        # Breed factor
-        breed_factor = 1.0
-        if 'rhode' in breed:
-            breed_factor = 1.2
-        elif 'sussex' in breed:
-            breed_factor = 1.1
-
-        # small adjustment for days since added (newer chickens adapt)
-        age_factor = 1.0 - min(days_since_added / 365.0, 0.25)
-
-        predicted = max(0.0, base * health_mul * breed_factor * age_factor)
+        return self.predict_production_batch([chicken_data])[0]
 
-        return {
-            'predicted_eggs_per_week': round(float(predicted), 2),
-            'confidence': 0.6
-        }
+    def score_flock(self, flock):
+        """Predicted eggs per week for every row of FlockColumns."""
+        with phase('inference'):
+            age = flock.age
+
+            # Base productivity by age: peak production around 20-60 weeks
+            base = np.select([age < 18, age <= 72], [1.0, 4.0], default=2.5)
+
+            # Health multiplier
+            health_mul = np.select([flock.status_is('sick'), flock.status_is('recovery')], [0.6, 0.9], 1.0)
+
+            # small adjustment for days since added (newer chickens adapt)
+            age_factor = 1.0 - np.minimum(flock.days_since_added / 365.0, 0.25)
+
+            return np.maximum(0.0, base * health_mul * flock.map_breeds(breed_factor) * age_factor)
+
+    def predict_flock_production(self, flock):
+        """Egg production of every row of FlockColumns."""
+        return [
+            {
+                'predicted_eggs_per_week': round(float(p), 2),
+                'confidence': 0.6
+            } for p in self.score_flock(flock)
+        ]
+
+    def predict_production_batch(self, chickens):
+        """Vectorized version of the production heuristics for many chickens."""
+        if not chickens:
+            return []
+
+        # Fill in features the caller did not supply from the feature store
+        chickens = self.farm_model.attach_features(chickens)
+        return self.predict_flock_production(FlockColumns.from_chickens(chickens))
+
+
+# Feed times of the recommended schedule and each one's share of the daily feed
+FEED_TIMES = ('07:00', '13:00', '18:00')
+PORTION_SHARES = (0.4, 0.35, 0.25)
+
+# Feed types by whether a chicken is old enough for layer feed
+FEED_TYPES = ('Grower feed', 'Layer feed')
+
+# Notes of the feed_schedule rows a recorded plan writes, which the next
+# recorded plan for the same chickens replaces
+PLANNED_FEED_NOTES = 'Planned by feed optimization'
+
+FEED_NOTES = 'Adjust portions based on actual consumption and health.'
+
+
+def feed_breed_factor(breed):
+    """Feed factor of a breed."""
+    breed = (breed or '').lower()
+    return 1.05 if 'rhode' in breed or 'penn' in breed else 1.0
 
 
 class FeedOptimizationModel:
@@ -80,38 +125,98 @@ class FeedOptimizationModel:
         self.chicken_model = ChickenModel()
         self.farm_model = FarmModel()
 
+    def score_flock(self, flock):
+        """
+        Recommended daily feed in grams, and whether layer feed is due, for
+        every row of FlockColumns.
+        """
+        age = flock.age
+        # Base feed amount based on age: chicks, growers, adults, older hens
+        daily = np.select([age < 6, age < 18, age > 72], [30.0, 80.0, 110.0], 120.0)
+        # Rhode Island Red and Plymouth Rock (Penn) eat a little more
+        daily = daily * flock.map_breeds(feed_breed_factor)
+        # Reduce slightly if not healthy
+        daily = np.where(flock.status_is('healthy'), daily, daily * 0.9)
+        return daily, age > 18
+
     def optimize_feed_schedule(self, chicken_id):
+        """
+        Provide feed optimization recommendations for a specific chicken.
+        """
         chicken = self.chicken_model.get_chicken(chicken_id)
         if not chicken:
             return {'error': 'Chicken not found'}
 
-        age = chicken.get('age', 0)
-        breed = (chicken.get('breed') or '').lower()
-        health_status = chicken.get('health_status', 'healthy')
-
-        base_feed = 120
-        if age < 6:
-            base_feed = 30
-        elif age < 18:
-            base_feed = 80
-        elif age > 72:
-            base_feed = 110
-
-        if 'rhode' in breed or 'penn' in breed:
-            base_feed *= 1.05
-        if health_status != 'healthy':
-            base_feed *= 0.9
-
-        feed_times = ['07:00', '13:00', '18:00']
-        portions = [base_feed * 0.4, base_feed * 0.35, base_feed * 0.25]
-
+        daily, layer = self.score_flock(FlockColumns.from_chickens([chicken]))
+        daily = float(daily[0])
         return {
-            'recommended_daily_feed': round(base_feed, 2),
-            'feed_times': feed_times,
-            'portion_sizes': [round(p, 2) for p in portions],
-            'feed_type': 'Layer feed' if age > 18 else 'Grower feed',
-            'notes': 'Adjust portions based on actual consumption and health.'
+            'recommended_daily_feed': round(daily, 2),
+            'feed_times': list(FEED_TIMES),
+            'portion_sizes': [round(daily * share, 2) for share in PORTION_SHARES],
+            'feed_type': FEED_TYPES[int(layer[0])],
+            'notes': FEED_NOTES
+        }
+
+    def optimize_flock_feed(self, flock, days=1, include_chickens=True):
+        """
+        Feed plan of every row of FlockColumns in one pass, with the feed
+        needed per feed type and time slot over `days` days for procurement.
+        """
+        with phase('inference'):
+            daily, layer = self.score_flock(flock)
+            feed_type = layer.astype(np.int64)
+            portions = np.outer(daily, PORTION_SHARES)
+            chickens = np.bincount(feed_type, minlength=len(FEED_TYPES))
+            grams = np.column_stack([
+                np.bincount(feed_type, weights=portions[:, slot], minlength=len(FEED_TYPES))
+                for slot in range(len(FEED_TIMES))
+            ]).reshape(len(FEED_TYPES), len(FEED_TIMES)) * days
+
+        plan = {
+            'chickens_planned': len(flock),
+            'days': days,
+            'feed_times': list(FEED_TIMES),
+            'total_grams': round(float(grams.sum()), 2),
+            'by_feed_type': {
+                name: {
+                    'chickens': int(chickens[code]),
+                    'grams': round(float(grams[code].sum()), 2),
+                    'by_time_slot': {time: round(float(grams[code, slot]), 2) for slot, time in enumerate(FEED_TIMES)}
+                } for code, name in enumerate(FEED_TYPES) if chickens[code]
+            },
+            'by_time_slot': {
+                time: {name: round(float(grams[code, slot]), 2) for code, name in enumerate(FEED_TYPES) if chickens[code]}
+                for slot, time in enumerate(FEED_TIMES)
+            },
+            'notes': FEED_NOTES
         }
+        if include_chickens:
+            plan['chickens'] = [
+                {
+                    'chicken_id': chicken_id,
+                    'recommended_daily_feed': round(grams_per_day, 2),
+                    'feed_type': FEED_TYPES[code],
+                    'portion_sizes': [round(portion, 2) for portion in chicken_portions]
+                } for chicken_id, grams_per_day, code, chicken_portions
+                in zip(flock.ids.tolist(), daily.tolist(), feed_type.tolist(), portions.tolist())
+            ]
+        return plan
+
+    def schedule_rows(self, flock):
+        """feed_schedule rows, one per chicken and feed time, carrying out the plan of FlockColumns."""
+        daily, layer = self.score_flock(flock)
+        portions = np.outer(daily, PORTION_SHARES).tolist()
+        return [
+            {
+                'chicken_id': chicken_id,
+                'feed_type': FEED_TYPES[int(is_layer)],
+                'scheduled_time': time,
+                'amount': round(portion, 2),
+                'notes': PLANNED_FEED_NOTES
+            }
+            for chicken_id, is_layer, chicken_portions in zip(flock.ids.tolist(), layer.tolist(), portions)
+            for time, portion in zip(FEED_TIMES, chicken_portions)
+        ]
 
 
 # Singleton instances preserved for compatibility
@@ -0,0 +1,267 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from models.events import subscribe
+
+# RESPONSE_CACHE selects the backend: "memory" (default), "sqlite:<path>"
+# to share entries between worker processes through a file, or "off"
+RESPONSE_CACHE = os.environ.get('RESPONSE_CACHE', 'memory')
+CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', 30))
+CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 256))
+
+
+class MemoryBackend:
+    """LRU dictionary private to this process"""
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # key -> (expires, value, tags)
+        self._tagged = {}               # tag -> set of keys
+        self._generations = {}          # tag -> number of invalidations
+        self._lock = threading.Lock()
+
+    def get(self, key, now):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None, False
+            if entry[0] <= now:
+                self._remove(key)
+                return None, True
+            self._entries.move_to_end(key)
+            return entry[1], False
+
+    def generations(self, tags):
+        with self._lock:
+            return tuple(self._generations.get(tag, 0) for tag in tags)
+
+    def set(self, key, value, tags, expires, generations):
+        """Store unless one of the tags was invalidated while the value was computed; returns evictions"""
+        with self._lock:
+            if generations != tuple(self._generations.get(tag, 0) for tag in tags):
+                return 0
+            self._remove(key)
+            self._entries[key] = (expires, value, tags)
+            for tag in tags:
+                self._tagged.setdefault(tag, set()).add(key)
+
+            evicted = 0
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                evicted += 1
+            return evicted
+
+    def invalidate(self, tags):
+        with self._lock:
+            removed = 0
+            for tag in tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+                for key in list(self._tagged.pop(tag, ())):
+                    if key in self._entries:
+                        self._remove(key)
+                        removed += 1
+            return removed
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tagged.clear()
+
+    def size(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry:
+            for tag in entry[2]:
+                keys = self._tagged.get(tag)
+                if keys:
+                    keys.discard(key)
+
+
+class SQLiteBackend:
+    """
+    LRU cache kept in a separate SQLite file, so every worker process sees
+    the same entries and invalidations
+    """
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        conn = self._conn()
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    key TEXT PRIMARY KEY,
+                    value BLOB,
+                    expires REAL,
+                    last_access REAL
+                )
+            ''')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache_tags (tag TEXT, key TEXT, PRIMARY KEY (tag, key))')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_cache_tags_key ON cache_tags (key)')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache_generations (tag TEXT PRIMARY KEY, generation INTEGER)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_cache_entries_last_access ON cache_entries (last_access)')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key, now):
+        conn = self._conn()
+        row = conn.execute('SELECT value, expires, last_access FROM cache_entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None, False
+        if row[1] <= now:
+            with conn:
+                self._delete(conn, [key])
+            return None, True
+        if now - row[2] > 1:
+            # Coarse LRU clock: at most one write per entry per second
+            with conn:
+                conn.execute('UPDATE cache_entries SET last_access = ? WHERE key = ?', (now, key))
+        return row[0], False
+
+    def generations(self, tags):
+        conn = self._conn()
+        placeholders = ', '.join('?' * len(tags))
+        found = dict(conn.execute(
+            f'SELECT tag, generation FROM cache_generations WHERE tag IN ({placeholders})', tags
+        ).fetchall())
+        return tuple(found.get(tag, 0) for tag in tags)
+
+    def set(self, key, value, tags, expires, generations):
+        conn = self._conn()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            if generations != self.generations(tags):
+                return 0
+            self._delete(conn, [key])
+            conn.execute('INSERT INTO cache_entries (key, value, expires, last_access) VALUES (?, ?, ?, ?)',
+                         (key, value, expires, time.time()))
+            conn.executemany('INSERT OR IGNORE INTO cache_tags (tag, key) VALUES (?, ?)', [(tag, key) for tag in tags])
+
+            overflow = conn.execute('SELECT COUNT(*) FROM cache_entries').fetchone()[0] - self.max_entries
+            if overflow > 0:
+                keys = [row[0] for row in conn.execute(
+                    'SELECT key FROM cache_entries ORDER BY last_access LIMIT ?', (overflow,)
+                )]
+                self._delete(conn, keys)
+                return len(keys)
+        return 0
+
+    def invalidate(self, tags):
+        conn = self._conn()
+        removed = 0
+        with conn:
+            for tag in tags:
+                conn.execute('''
+                    INSERT INTO cache_generations (tag, generation) VALUES (?, 1)
+                    ON CONFLICT (tag) DO UPDATE SET generation = generation + 1
+                ''', (tag,))
+                keys = [row[0] for row in conn.execute('SELECT key FROM cache_tags WHERE tag = ?', (tag,))]
+                self._delete(conn, keys)
+                removed += len(keys)
+        return removed
+
+    def clear(self):
+        conn = self._conn()
+        with conn:
+            conn.execute('DELETE FROM cache_entries')
+            conn.execute('DELETE FROM cache_tags')
+
+    def size(self):
+        return self._conn().execute('SELECT COUNT(*) FROM cache_entries').fetchone()[0]
+
+    def _delete(self, conn, keys):
+        for key in keys:
+            conn.execute('DELETE FROM cache_entries WHERE key = ?', (key,))
+            conn.execute('DELETE FROM cache_tags WHERE key = ?', (key,))
+
+
+class ResponseCache:
+    """
+    TTL cache for rendered responses. Entries are tagged with the tables
+    they were computed from and dropped as soon as one of those tables is
+    written through ChickenModel or FarmModel.
+    """
+    def __init__(self, backend, ttl=CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @classmethod
+    def from_env(cls, setting=RESPONSE_CACHE):
+        if setting == 'off':
+            return None
+        if setting.startswith('sqlite:'):
+            return cls(SQLiteBackend(setting[len('sqlite:'):], CACHE_MAX_ENTRIES))
+        return cls(MemoryBackend(CACHE_MAX_ENTRIES))
+
+    def get(self, key):
+        value, expired = self.backend.get(key, time.time())
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                self.expirations += expired
+            else:
+                self.hits += 1
+        return value
+
+    def generations(self, tags):
+        """Snapshot to pass to set(), taken before computing the value"""
+        return self.backend.generations(tuple(tags))
+
+    def set(self, key, value, tags, generations, ttl=None):
+        evicted = self.backend.set(key, value, tuple(tags), time.time() + (ttl or self.ttl), generations)
+        if evicted:
+            with self._lock:
+                self.evictions += evicted
+
+    def invalidate(self, *tags):
+        removed = self.backend.invalidate(tags)
+        with self._lock:
+            self.invalidations += removed
+
+    def clear(self):
+        self.backend.clear()
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'backend': type(self.backend).__name__,
+                'entries': self.backend.size(),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'expirations': self.expirations,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'ttl_seconds': self.ttl
+            }
+
+
+response_cache = ResponseCache.from_env()
+
+
+def _invalidate_on_write(table, action, details):
+    # Deleting a chicken also rewrites the records it detaches
+    response_cache.invalidate(table, *details.get('detached', ()))
+
+
+if response_cache is not None:
+    subscribe(_invalidate_on_write)
@@ -0,0 +1,125 @@
+import sqlite3
+import os
+import threading
+import weakref
+
+DATABASE = 'chicken_farm.db'
+
+# SQLite tuning applied to every new connection
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('foreign_keys', 'ON'),
+    ('temp_store', 'MEMORY'),
+    ('cache_size', int(os.environ.get('SQLITE_CACHE_SIZE', -16000))),  # negative = KiB, ~16MB
+    ('mmap_size', int(os.environ.get('SQLITE_MMAP_SIZE', 64 * 1024 * 1024))),
+    ('busy_timeout', int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))),
+)
+
+# Size of sqlite3's per-connection prepared statement cache
+CACHED_STATEMENTS = int(os.environ.get('SQLITE_CACHED_STATEMENTS', 256))
+
+
+class ConnectionManager:
+    """
+    Keeps one SQLite connection per thread (and per process, so gunicorn
+    workers forked after import never share a handle) instead of opening
+    and closing a connection for every model call. Connections of threads
+    that have exited, e.g. the per-request threads of Flask's development
+    server, are closed when the next connection is opened.
+    """
+    def __init__(self, database=DATABASE, pragmas=PRAGMAS, cached_statements=CACHED_STATEMENTS):
+        self.database = database
+        self.pragmas = pragmas
+        self.cached_statements = cached_statements
+        # Class of new connections; models.profiling swaps in an instrumented one
+        self.connection_factory = sqlite3.Connection
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []  # (weak reference to the owning thread, connection)
+        self.opened = 0
+        self.reused = 0
+        self.reaped = 0
+
+    def _connect(self):
+        # Only the owning thread uses a connection, but whichever thread
+        # reaps it after the owner exited has to be allowed to close it
+        conn = sqlite3.connect(self.database, cached_statements=self.cached_statements,
+                               factory=self.connection_factory, check_same_thread=False)
+        for name, value in self.pragmas:
+            conn.execute(f'PRAGMA {name}={value}')
+        with self._lock:
+            self.opened += 1
+            self._reap()
+            self._connections.append((weakref.ref(threading.current_thread()), conn))
+        return conn
+
+    def _reap(self):
+        """Close the connections of threads that have exited; called with the lock held"""
+        live = []
+        for owner, conn in self._connections:
+            thread = owner()
+            if thread is not None and thread.is_alive():
+                live.append((owner, conn))
+            else:
+                conn.close()
+                self.reaped += 1
+        self._connections = live
+
+    def get_connection(self):
+        """Get the connection for the calling thread, opening it on first use"""
+        if self._pid != os.getpid():
+            # Forked worker: never reuse the parent's handles
+            self._reset()
+
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            with self._lock:
+                self.reused += 1
+            return conn
+
+        conn = self._connect()
+        self._local.conn = conn
+        return conn
+
+    def close_all(self):
+        """Close every connection opened by this process"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        current = threading.current_thread()
+        for owner, conn in connections:
+            thread = owner()
+            # Connections of other threads that are still alive stay open
+            # for them; they are closed once their thread-local is dropped
+            if thread is None or thread is current or not thread.is_alive():
+                conn.close()
+        self._local = threading.local()
+
+    def get_stats(self):
+        """Connection counters for monitoring"""
+        with self._lock:
+            self._reap()
+            return {
+                'database': self.database,
+                'connections_opened': self.opened,
+                'connections_reused': self.reused,
+                'connections_reaped': self.reaped,
+                'open_connections': len(self._connections),
+                'cached_statements': self.cached_statements
+            }
+
+
+# Shared manager used by ChickenModel and FarmModel
+db = ConnectionManager()
+
+
+def get_connection():
+    return db.get_connection()
+
+
+def get_db_stats():
+    return db.get_stats()
@@ -1,9 +1,237 @@
-import sqlite3
-import os
-from datetime import datetime
-import json
+from datetime import datetime, date, timedelta
+from models import feature_store
+from models.database import get_connection
+from models.dates import between, epoch_seconds, last_days, today
+from models.migrations import EGG_ROLLUP_BACKFILL_SQL, get_table_version, migrate
+from models.pagination import date_range_filters, where
+from models.events import publish
+
+# Columns streamed by iter_records; dated tables are exported oldest first
+RECORD_COLUMNS = {
+    'egg_production': ('id', 'chicken_id', 'date', 'quantity', 'notes'),
+    'feed_schedule': ('id', 'chicken_id', 'feed_type', 'scheduled_time', 'amount', 'notes'),
+    'health_records': ('id', 'chicken_id', 'date', 'health_status', 'symptoms', 'treatment', 'notes'),
+}
+
+# Largest number of chicken ids bound into a single IN (...) query
+SQL_VARIABLE_CHUNK = 500
+
+
+def _chicken_id(data, required=True):
+    chicken_id = data.get('chicken_id')
+    if chicken_id is None:
+        if required:
+            raise ValueError('chicken_id is required')
+        return None
+    if not isinstance(chicken_id, int) or isinstance(chicken_id, bool):
+        raise ValueError('chicken_id must be an integer')
+    return chicken_id
+
+
+def _record_date(value):
+    """Validate an ISO date/timestamp, defaulting to now"""
+    if value is None:
+        return datetime.now().isoformat()
+    if not isinstance(value, str):
+        raise ValueError('date must be an ISO 8601 string')
+    datetime.fromisoformat(value)
+    return value
+
+
+def _text(data, key, required=False):
+    value = data.get(key)
+    if value is None or value == '':
+        if required:
+            raise ValueError(f'{key} is required')
+        return '' if value is None else value
+    if not isinstance(value, str):
+        raise ValueError(f'{key} must be a string')
+    return value
+
+
+def _number(data, key, integer=False):
+    value = data.get(key, 0)
+    valid_type = int if integer else (int, float)
+    if not isinstance(value, valid_type) or isinstance(value, bool) or value < 0:
+        raise ValueError(f'{key} must be a non-negative {"integer" if integer else "number"}')
+    return value
+
+
+def _egg_values(data):
+    return (
+        _chicken_id(data),
+        _record_date(data.get('date')),
+        _number(data, 'quantity', integer=True),
+        _text(data, 'notes')
+    )
+
+
+def _feed_values(data):
+    scheduled_time = data.get('scheduled_time')
+    if scheduled_time is not None and not isinstance(scheduled_time, str):
+        raise ValueError('scheduled_time must be a string')
+    return (
+        _chicken_id(data, required=False),
+        _text(data, 'feed_type'),
+        scheduled_time,
+        _number(data, 'amount'),
+        _text(data, 'notes')
+    )
+
+
+def _health_values(data):
+    return (
+        _chicken_id(data),
+        _record_date(data.get('date')),
+        _text(data, 'health_status', required=True),
+        _text(data, 'symptoms'),
+        _text(data, 'treatment'),
+        _text(data, 'notes')
+    )
+
+
+# Summary periods served from egg_daily_totals: SQL expression mapping a day
+# to the first day of its period, period length in days, and the number of
+# periods returned by default
+SUMMARY_PERIODS = {
+    'day': ('day', 1, 30),
+    'week': ("date(day, '-6 days', 'weekday 1')", 7, 12),
+}
+
+
+def _roll_up_eggs(conn, records):
+    """
+    Add (chicken_id, date, quantity) records to the daily rollup inside the
+    caller's transaction, with one upsert per chicken and day
+    """
+    totals = {}
+    for chicken_id, record_date, quantity in records:
+        key = (str(record_date)[:10], chicken_id)
+        count, total = totals.get(key, (0, 0))
+        totals[key] = (count + 1, total + (quantity or 0))
+
+    conn.executemany('''
+        INSERT INTO egg_daily_totals (day, chicken_id, quantity, records) VALUES (?, ?, ?, ?)
+        ON CONFLICT (day, IFNULL(chicken_id, 0)) DO UPDATE SET
+            quantity = quantity + excluded.quantity,
+            records = records + excluded.records
+    ''', [(day, chicken_id, total, count) for (day, chicken_id), (count, total) in totals.items()])
+
+
+def _record_eggs(conn, inserted):
+    """after_insert of bulk egg records: update the rollup and chicken features"""
+    records = [values[:3] for values in inserted]
+    _roll_up_eggs(conn, records)
+    feature_store.add_egg_records(conn, records)
+
+
+def _record_health_checks(conn, inserted):
+    """after_insert of bulk health records: update the chicken features"""
+    feature_store.add_health_records(conn, [values[:3] for values in inserted])
+
+
+# Record tables written in bulk: inserted columns (chicken_id first), the
+# validation turning a JSON object into their values, and an optional
+# after_insert(conn, inserted values) run in the insert's transaction
+BULK_TABLES = {
+    'egg_production': (('chicken_id', 'date', 'quantity', 'notes'), _egg_values, _record_eggs),
+    'feed_schedule': (('chicken_id', 'feed_type', 'scheduled_time', 'amount', 'notes'), _feed_values, None),
+    'health_records': (
+        ('chicken_id', 'date', 'health_status', 'symptoms', 'treatment', 'notes'), _health_values, _record_health_checks
+    ),
+}
+
+
+def validate_record(table, data):
+    """Inserted values of a JSON object for a BULK_TABLES table; raises ValueError if invalid"""
+    if not isinstance(data, dict):
+        raise ValueError('record must be a JSON object')
+    return BULK_TABLES[table][1](data)
+
+
+def validate_records(table, rows):
+    """
+    Validate JSON objects for a BULK_TABLES table. Returns a result per row,
+    an error for invalid rows and None for the others, and the (index,
+    values) of the valid ones.
+    """
+    results = [None] * len(rows)
+    valid = []
+    for index, data in enumerate(rows):
+        try:
+            valid.append((index, validate_record(table, data)))
+        except ValueError as e:
+            results[index] = {'index': index, 'status': 'error', 'error': str(e)}
+    return results, valid
+
+
+def insert_records(conn, table, records):
+    """
+    Insert validated value tuples into a BULK_TABLES table with a single
+    executemany, inside the caller's write transaction (BEGIN IMMEDIATE).
+    Returns the new id of each record, or None where its chicken does not exist.
+    """
+    columns, _, after_insert = BULK_TABLES[table]
+    chicken_ids = sorted({values[0] for values in records if values[0] is not None})
+    known = set()
+    for start in range(0, len(chicken_ids), SQL_VARIABLE_CHUNK):
+        chunk = chicken_ids[start:start + SQL_VARIABLE_CHUNK]
+        placeholders = ', '.join('?' * len(chunk))
+        known.update(row[0] for row in conn.execute(
+            f'SELECT id FROM chickens WHERE id IN ({placeholders})', chunk
+        ))
+    
+    inserts = [values for values in records if values[0] is None or values[0] in known]
+    if not inserts:
+        return [None] * len(records)
+    
+    row = conn.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()
+    next_id = (row[0] if row else 0) + 1
+    placeholders = ', '.join('?' * len(columns))
+    conn.executemany(f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({placeholders})', inserts)
+    if after_insert:
+        after_insert(conn, inserts)
+    
+    # AUTOINCREMENT hands out consecutive ids within one write transaction
+    ids = []
+    for values in records:
+        if values[0] is None or values[0] in known:
+            ids.append(next_id)
+            next_id += 1
+        else:
+            ids.append(None)
+    return ids
+
+
+def record_result(index, record_id):
+    """Result of a validated row given the id insert_records returned for it"""
+    if record_id is None:
+        return {'index': index, 'status': 'error', 'error': 'Chicken not found'}
+    return {'index': index, 'status': 'recorded', 'id': record_id}
+
+
+def publish_inserted(table, inserted, version):
+    """
+    Announce committed (id, values) records of a BULK_TABLES table; version
+    is the table's change counter read in the inserting transaction
+    """
+    if inserted:
+        publish(table, 'bulk_created', ids=[record_id for record_id, _ in inserted],
+                chicken_ids=sorted({values[0] for _, values in inserted if values[0] is not None}),
+                version=version)
+
+
+def _since_seconds(since):
+    seconds = epoch_seconds(since)
+    if seconds is None:
+        raise ValueError('since must be an ISO 8601 date or timestamp')
+    return seconds
+
+
+def _period_start(day, length):
+    """First day of the day (length 1) or Monday-based week containing day"""
+    return day - timedelta(days=day.weekday()) if length == 7 else day
 
-DATABASE = 'chicken_farm.db'
 
 class FarmModel:
     def __init__(self):
@@ -11,73 +239,46 @@ class FarmModel:
     
     def init_db(self):
         """Initialize the database with farm-related tables"""
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
-        # Egg production table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS egg_production (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chicken_id INTEGER,
-                date TEXT,
-                quantity INTEGER,
-                notes TEXT
-            )
-        ''')
-        
-        # Feed schedule table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS feed_schedule (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chicken_id INTEGER,
-                feed_type TEXT,
-                scheduled_time TEXT,
-                amount REAL,
-                notes TEXT
-            )
-        ''')
-        
-        # Health records table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS health_records (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chicken_id INTEGER,
-                date TEXT,
-                health_status TEXT,
-                symptoms TEXT,
-                treatment TEXT,
-                notes TEXT
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        migrate()
     
     def record_egg_production(self, data):
-        """Record egg production"""
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO egg_production (chicken_id, date, quantity, notes)
-            VALUES (?, ?, ?, ?)
-        ''', (
-            data.get('chicken_id'),
-            data.get('date', datetime.now().isoformat()),
-            data.get('quantity', 0),
-            data.get('notes', '')
-        ))
-        egg_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        return egg_id
-    
-    def get_egg_production(self):
-        """Get all egg production records"""
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM egg_production ORDER BY date DESC')
-        records = cursor.fetchall()
-        conn.close()
+        """Record egg production; raises ValueError for invalid data"""
+        # Validated like bulk records: the rollup and features add up quantities
+        values = validate_record('egg_production', data)
+        conn = get_connection()
+        with conn:
+            cursor = conn.execute('''
+                INSERT INTO egg_production (chicken_id, date, quantity, notes)
+                VALUES (?, ?, ?, ?)
+            ''', values)
+            _roll_up_eggs(conn, [values[:3]])
+            feature_store.add_egg_records(conn, [values[:3]])
+            version = get_table_version('egg_production', conn)
+        record_id = cursor.lastrowid
+        publish('egg_production', 'created', id=record_id, chicken_id=values[0], version=version)
+        return record_id
+    
+    def get_egg_production(self, chicken_id=None, start_date=None, end_date=None, cursor=None, limit=None):
+        """
+        Get egg production records, newest first. Dates are inclusive
+        YYYY-MM-DD bounds; cursor is the (date, id) of the last record of the
+        previous page.
+        """
+        clauses, params = date_range_filters('date', start_date, end_date)
+        if chicken_id is not None:
+            clauses.append('chicken_id = ?')
+            params.append(chicken_id)
+        if cursor is not None:
+            clauses.append('date <= ? AND (date < ? OR id < ?)')
+            params.extend([cursor[0], cursor[0], cursor[1]])
+        
+        query = f'SELECT id, chicken_id, date, quantity, notes FROM egg_production{where(clauses)} ORDER BY date DESC, id DESC'
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+        
+        conn = get_connection()
+        records = conn.execute(query, params).fetchall()
         
         return [
             {
@@ -90,31 +291,40 @@ class FarmModel:
         ]
     
     def record_feed_schedule(self, data):
-        """Record feed schedule"""
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO feed_schedule (chicken_id, feed_type, scheduled_time, amount, notes)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (
-            data.get('chicken_id'),
-            data.get('feed_type', ''),
-            data.get('scheduled_time'),
-            data.get('amount', 0),
-            data.get('notes', '')
-        ))
-        feed_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        return feed_id
-    
-    def get_feed_schedule(self):
-        """Get all feed schedule records"""
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM feed_schedule')
-        records = cursor.fetchall()
-        conn.close()
+        """Record feed schedule; raises ValueError for invalid data"""
+        values = validate_record('feed_schedule', data)
+        conn = get_connection()
+        with conn:
+            cursor = conn.execute('''
+                INSERT INTO feed_schedule (chicken_id, feed_type, scheduled_time, amount, notes)
+                VALUES (?, ?, ?, ?, ?)
+            ''', values)
+            version = get_table_version('feed_schedule', conn)
+        record_id = cursor.lastrowid
+        publish('feed_schedule', 'created', id=record_id, chicken_id=values[0], version=version)
+        return record_id
+    
+    def get_feed_schedule(self, chicken_id=None, cursor=None, limit=None):
+        """
+        Get feed schedule records ordered by id, optionally for one chicken.
+        cursor is the id of the last record of the previous page.
+        """
+        clauses = []
+        params = []
+        if chicken_id is not None:
+            clauses.append('chicken_id = ?')
+            params.append(chicken_id)
+        if cursor is not None:
+            clauses.append('id > ?')
+            params.append(cursor)
+        
+        query = f'SELECT id, chicken_id, feed_type, scheduled_time, amount, notes FROM feed_schedule{where(clauses)} ORDER BY id'
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+        
+        conn = get_connection()
+        records = conn.execute(query, params).fetchall()
         
         return [
             {
@@ -128,37 +338,45 @@ class FarmModel:
         ]
     
     def record_health_check(self, data):
-        """Record health check"""
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO health_records (chicken_id, date, health_status, symptoms, treatment, notes)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (
-            data.get('chicken_id'),
-            data.get('date', datetime.now().isoformat()),
-            data.get('health_status'),
-            data.get('symptoms', ''),
-            data.get('treatment', ''),
-            data.get('notes', '')
-        ))
-        health_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        return health_id
+        """Record health check; raises ValueError for invalid data"""
+        # Validated like bulk records: the features count issues by status
+        values = validate_record('health_records', data)
+        conn = get_connection()
+        with conn:
+            cursor = conn.execute('''
+                INSERT INTO health_records (chicken_id, date, health_status, symptoms, treatment, notes)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', values)
+            feature_store.add_health_records(conn, [values[:3]])
+            version = get_table_version('health_records', conn)
+        record_id = cursor.lastrowid
+        publish('health_records', 'created', id=record_id, chicken_id=values[0], version=version)
+        return record_id
     
-    def get_health_records(self, chicken_id=None):
-        """Get health records, optionally for a specific chicken"""
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
+    def get_health_records(self, chicken_id=None, start_date=None, end_date=None, health_status=None, cursor=None, limit=None):
+        """
+        Get health records, newest first, optionally for a specific chicken,
+        date range or status. cursor is the (date, id) of the last record of
+        the previous page.
+        """
+        clauses, params = date_range_filters('date', start_date, end_date)
         if chicken_id:
-            cursor.execute('SELECT * FROM health_records WHERE chicken_id = ? ORDER BY date DESC', (chicken_id,))
-        else:
-            cursor.execute('SELECT * FROM health_records ORDER BY date DESC')
-            
-        records = cursor.fetchall()
-        conn.close()
+            clauses.append('chicken_id = ?')
+            params.append(chicken_id)
+        if health_status:
+            clauses.append('health_status = ?')
+            params.append(health_status)
+        if cursor is not None:
+            clauses.append('date <= ? AND (date < ? OR id < ?)')
+            params.extend([cursor[0], cursor[0], cursor[1]])
+        
+        query = f'SELECT id, chicken_id, date, health_status, symptoms, treatment, notes FROM health_records{where(clauses)} ORDER BY date DESC, id DESC'
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+        
+        conn = get_connection()
+        records = conn.execute(query, params).fetchall()
         
         return [
             {
@@ -172,21 +390,317 @@ class FarmModel:
             } for row in records
         ]
     
-    def get_health_predictions(self):
-        """AI prediction for health issues - basic implementation"""
-        # This would be more sophisticated in a real app with ML models
-        # For now, we'll return some basic predictions based on health records
-        health_records = self.get_health_records()
+    def _insert_bulk(self, table, rows, before_insert=None):
+        """
+        Validate rows and insert the valid ones with a single executemany in
+        one transaction, after before_insert(conn, records) if given.
+        Returns one result per input row, in order.
+        """
+        results, valid = validate_records(table, rows)
+        
+        conn = get_connection()
+        with conn:
+            # Take the write lock first so the chicken check, the inserts and
+            # the id range all see the same state
+            conn.execute('BEGIN IMMEDIATE')
+            if before_insert:
+                before_insert(conn, [values for _, values in valid])
+            ids = insert_records(conn, table, [values for _, values in valid])
+            version = get_table_version(table, conn)
+        
+        for (index, _), record_id in zip(valid, ids):
+            results[index] = record_result(index, record_id)
+        publish_inserted(table, [(record_id, values) for (_, values), record_id in zip(valid, ids) if record_id is not None], version)
+        return results
+    
+    def record_egg_production_bulk(self, rows):
+        """Record many egg production records in one transaction"""
+        return self._insert_bulk('egg_production', rows)
+    
+    def record_feed_schedule_bulk(self, rows):
+        """Record many feed schedule entries in one transaction"""
+        return self._insert_bulk('feed_schedule', rows)
+    
+    def replace_feed_schedule_bulk(self, rows, notes):
+        """
+        Record many feed schedule entries in place of the entries with the
+        same notes their chickens already have, in one transaction, so
+        recording the same plan again leaves the same schedule
+        """
+        def delete_previous(conn, records):
+            chicken_ids = sorted({values[0] for values in records if values[0] is not None})
+            for start in range(0, len(chicken_ids), SQL_VARIABLE_CHUNK):
+                chunk = chicken_ids[start:start + SQL_VARIABLE_CHUNK]
+                placeholders = ', '.join('?' * len(chunk))
+                conn.execute(f'DELETE FROM feed_schedule WHERE notes = ? AND chicken_id IN ({placeholders})',
+                             [notes] + chunk)
+        return self._insert_bulk('feed_schedule', rows, before_insert=delete_previous)
+    
+    def record_health_check_bulk(self, rows):
+        """Record many health checks in one transaction"""
+        return self._insert_bulk('health_records', rows)
+    
+    def iter_records(self, table, chicken_id=None, start_date=None, end_date=None, batch_size=1000):
+        """
+        Stream rows of a record table as tuples without building a list.
+        The query runs (and filters are validated) before this returns;
+        rows are then fetched batch_size at a time as the iterator is consumed.
+        """
+        columns = RECORD_COLUMNS[table]
+        if 'date' in columns:
+            clauses, params = date_range_filters('date', start_date, end_date)
+            order = 'date, id'
+        elif start_date or end_date:
+            raise ValueError(f'{table} cannot be filtered by date')
+        else:
+            clauses, params = [], []
+            order = 'id'
+        if chicken_id is not None:
+            clauses.append('chicken_id = ?')
+            params.append(chicken_id)
+        
+        # A dedicated cursor, so other queries on this thread's connection
+        # do not disturb the stream
+        cursor = get_connection().cursor()
+        cursor.execute(f'SELECT {", ".join(columns)} FROM {table}{where(clauses)} ORDER BY {order}', params)
+        
+        def rows():
+            try:
+                while True:
+                    batch = cursor.fetchmany(batch_size)
+                    if not batch:
+                        break
+                    yield from batch
+            finally:
+                cursor.close()
+        
+        return columns, rows()
+    
+    def get_health_record_counts(self, since=None):
+        """Number of health records per chicken, optionally only those dated after since"""
+        conn = get_connection()
+        if since:
+            rows = conn.execute(
+                'SELECT chicken_id, COUNT(*) FROM health_records WHERE date_ts > ? GROUP BY chicken_id',
+                (_since_seconds(since),)
+            ).fetchall()
+        else:
+            rows = conn.execute('SELECT chicken_id, COUNT(*) FROM health_records GROUP BY chicken_id').fetchall()
+        return dict(rows)
+    
+    def get_egg_record_counts(self, since=None):
+        """Number of egg production records per chicken, optionally only those dated after since"""
+        conn = get_connection()
+        if since:
+            rows = conn.execute(
+                'SELECT chicken_id, COUNT(*) FROM egg_production WHERE date_ts > ? GROUP BY chicken_id',
+                (_since_seconds(since),)
+            ).fetchall()
+        else:
+            # All-time counts come from the daily rollup instead of the raw records
+            rows = conn.execute(
+                'SELECT chicken_id, SUM(records) FROM egg_daily_totals WHERE chicken_id IS NOT NULL GROUP BY chicken_id'
+            ).fetchall()
+        return dict(rows)
+    
+    def get_egg_summary(self, period='day', chicken_id=None, start_date=None, end_date=None):
+        """
+        Egg totals per day or week from the rollup table, as chart-ready
+        series with a zero for every period without records. Dates are
+        inclusive YYYY-MM-DD bounds; by default the last 30 days or 12 weeks.
+        """
+        if period not in SUMMARY_PERIODS:
+            raise ValueError('period must be day or week')
+        period_start, length, default_periods = SUMMARY_PERIODS[period]
+        
+        try:
+            end = date.fromisoformat(end_date) if end_date else date.today()
+            if start_date:
+                start = date.fromisoformat(start_date)
+            else:
+                start = _period_start(end, length) - timedelta(days=length * (default_periods - 1))
+        except ValueError:
+            raise ValueError('start_date and end_date must be YYYY-MM-DD dates')
+        if start > end:
+            raise ValueError('start_date must not be after end_date')
         
-        # Count chickens with health issues recently
-        recent_issues = [record for record in health_records if record['date'] >= str(datetime.now().date()) and record['health_status'] != 'healthy']
+        clauses = ['day >= ?', 'day <= ?']
+        params = [start.isoformat(), end.isoformat()]
+        if chicken_id is not None:
+            clauses.append('chicken_id = ?')
+            params.append(chicken_id)
+        
+        conn = get_connection()
+        rows = conn.execute(
+            f'SELECT {period_start} AS period, SUM(quantity), SUM(records) FROM egg_daily_totals{where(clauses)} '
+            'GROUP BY period',
+            params
+        ).fetchall()
+        found = {row[0]: (row[1], row[2]) for row in rows}
+        
+        labels, totals, records = [], [], []
+        current = _period_start(start, length)
+        while current <= end:
+            label = current.isoformat()
+            total, count = found.get(label, (0, 0))
+            labels.append(label)
+            totals.append(total)
+            records.append(count)
+            current += timedelta(days=length)
+        
+        return {
+            'period': period,
+            'chicken_id': chicken_id,
+            'start_date': start.isoformat(),
+            'end_date': end.isoformat(),
+            'labels': labels,
+            'totals': totals,
+            'records': records
+        }
+    
+    def rebuild_egg_rollups(self):
+        """Recompute the egg rollup table from the raw records; returns the number of rollup rows"""
+        conn = get_connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM egg_daily_totals')
+            conn.execute(EGG_ROLLUP_BACKFILL_SQL)
+            # Summaries served from the rollup may change, so treat it as an
+            # egg_production change for ETags
+            conn.execute("UPDATE table_versions SET version = version + 1 WHERE name = 'egg_production'")
+            # Egg windows of the feature store are recomputed on their next read
+            conn.execute("UPDATE chicken_features SET as_of = ''")
+            rows = conn.execute('SELECT COUNT(*) FROM egg_daily_totals').fetchone()[0]
+        publish('egg_production', 'rebuilt')
+        return rows
+    
+    def get_chicken_features(self, chicken_ids=None):
+        """
+        Precomputed features per chicken id: rolling health issue and egg
+        counts, egg rates and tenure. Rows whose windows are from an earlier
+        day are brought up to date first, once per day for the whole flock.
+        """
+        conn = get_connection()
+        today = date.today()
+        feature_store.ensure_current(conn, today)
         
-        # Return some basic insights
-        predictions = {
-            "total_chickens_monitored": len(set([record['chicken_id'] for record in health_records])),
-            "chickens_with_recent_issues": len(set([record['chicken_id'] for record in recent_issues])),
-            "recent_health_records": recent_issues[:5],  # Last 5 records
+        columns = ', '.join(('chicken_id', 'added_day') + feature_store.FEATURE_COLUMNS)
+        if chicken_ids is None:
+            rows = conn.execute(f'SELECT {columns} FROM chicken_features').fetchall()
+        else:
+            chicken_ids = list(chicken_ids)
+            rows = []
+            for start in range(0, len(chicken_ids), SQL_VARIABLE_CHUNK):
+                chunk = chicken_ids[start:start + SQL_VARIABLE_CHUNK]
+                placeholders = ', '.join('?' * len(chunk))
+                rows.extend(conn.execute(
+                    f'SELECT {columns} FROM chicken_features WHERE chicken_id IN ({placeholders})', chunk
+                ).fetchall())
+        return {row[0]: feature_store.to_features(row, today) for row in rows}
+    
+    def attach_features(self, chickens):
+        """
+        Copies of the chicken dicts with their stored features filled in;
+        values the caller already supplied are kept
+        """
+        features = self.get_chicken_features(chicken['id'] for chicken in chickens if chicken.get('id') is not None)
+        return [{**features.get(chicken.get('id'), {}), **chicken} for chicken in chickens]
+    
+    def rebuild_chicken_features(self):
+        """Recompute the feature store from the raw records; returns the number of rows"""
+        conn = get_connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            feature_store.rebuild(conn)
+            rows = conn.execute('SELECT COUNT(*) FROM chicken_features').fetchone()[0]
+        return rows
+    
+    def get_health_predictions(self, recent_limit=5):
+        """
+        Basic health insights: how many chickens have health records, and
+        which have issues recorded from today on
+        """
+        conn = get_connection()
+        clauses, params = between('date_day', date.today())
+        clauses.append("health_status != 'healthy'")
+        
+        monitored = conn.execute(
+            'SELECT COUNT(DISTINCT chicken_id) FROM health_records'
+        ).fetchone()[0]
+        with_issues = conn.execute(
+            f'SELECT COUNT(DISTINCT chicken_id) FROM health_records{where(clauses)}', params
+        ).fetchone()[0]
+        recent = conn.execute(
+            f'SELECT id, chicken_id, date, health_status, symptoms, treatment, notes FROM health_records{where(clauses)} '
+            'ORDER BY date DESC, id DESC LIMIT ?',
+            params + [recent_limit]
+        ).fetchall()
+        
+        return {
+            "total_chickens_monitored": monitored,
+            "chickens_with_recent_issues": with_issues,
+            "recent_health_records": [
+                dict(zip(RECORD_COLUMNS['health_records'], row)) for row in recent
+            ],
             "recommendation": "Monitor chickens with recent health issues more closely"
         }
+    
+    def dashboard_summary(self, alert_limit=5, status_counts=None):
+        """
+        Dashboard counters computed with indexed aggregate queries, so the
+        cost does not grow with the amount of egg and health history.
+        status_counts (chickens per health status) is queried unless given.
+        """
+        conn = get_connection()
+        today_clauses, today_params = between('date_day', *today())
+        day = date.today().isoformat()
+        
+        if status_counts is None:
+            status_counts = dict(conn.execute(
+                'SELECT health_status, COUNT(*) FROM chickens GROUP BY health_status'
+            ).fetchall())
+        
+        # Egg figures come from the daily rollup rather than the raw records
+        daily_egg_count, daily_egg_total = conn.execute(
+            'SELECT COALESCE(SUM(records), 0), COALESCE(SUM(quantity), 0) FROM egg_daily_totals WHERE day = ?',
+            (day,)
+        ).fetchone()
+        
+        # Average eggs per record over a trailing window rather than all history
+        window_start = last_days(30)[0].isoformat()
+        average_eggs = conn.execute(
+            'SELECT CAST(SUM(quantity) AS REAL) / SUM(records) FROM egg_daily_totals WHERE day >= ? AND day <= ?',
+            (window_start, day)
+        ).fetchone()[0]
+        
+        alert_clauses = today_clauses + ["health_status != 'healthy'"]
+        health_alerts = conn.execute(
+            f'SELECT COUNT(*) FROM health_records{where(alert_clauses)}',
+            today_params
+        ).fetchone()[0]
+        alert_rows = conn.execute(
+            f'SELECT id, chicken_id, date, health_status, symptoms, treatment, notes FROM health_records{where(alert_clauses)} '
+            'ORDER BY date DESC, id DESC LIMIT ?',
+            today_params + [alert_limit]
+        ).fetchall()
         
-        return predictions
\ No newline at end of file
+        return {
+            'total_chickens': sum(status_counts.values()),
+            'healthy_chickens': status_counts.get('healthy', 0),
+            'sick_chickens': status_counts.get('sick', 0),
+            'daily_egg_count': daily_egg_count,
+            'daily_egg_total': daily_egg_total,
+            'health_alerts': health_alerts,
+            'recent_health_records': [
+                {
+                    'id': row[0],
+                    'chicken_id': row[1],
+                    'date': row[2],
+                    'health_status': row[3],
+                    'symptoms': row[4],
+                    'treatment': row[5],
+                    'notes': row[6]
+                } for row in alert_rows
+            ],
+            'average_daily_eggs': average_eggs or 0
+        }
\ No newline at end of file
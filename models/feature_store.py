@@ -0,0 +1,125 @@
+from datetime import date
+
+from models.dates import epoch_day, last_days
+
+# Rolling windows, in days, kept for health issues and egg totals
+FEATURE_WINDOWS = (7, 14, 30)
+
+# Window that predictors use as recent_health_issues
+RECENT_ISSUES_WINDOW = 14
+
+FEATURE_COLUMNS = tuple(
+    f'{kind}_{window}d' for kind in ('health_issues', 'eggs') for window in FEATURE_WINDOWS
+)
+
+
+def _window_increments(kind, amount):
+    """SET clauses adding :amount to every window of kind that contains :day"""
+    return ', '.join(
+        f"{kind}_{window}d = {kind}_{window}d + "
+        f"CASE WHEN :day > date(as_of, '-{window} days') AND :day <= as_of THEN {amount} ELSE 0 END"
+        for window in FEATURE_WINDOWS
+    )
+
+
+def add_chicken(conn, chicken_id, date_added):
+    """Start an empty feature row for a new chicken, inside the caller's transaction"""
+    conn.execute(
+        'INSERT OR IGNORE INTO chicken_features (chicken_id, added_day, as_of) VALUES (?, ?, ?)',
+        (chicken_id, str(date_added)[:10], date.today().isoformat())
+    )
+
+
+def add_health_records(conn, records):
+    """Count (chicken_id, date, health_status) records that are issues into the windows"""
+    issues = {}
+    for chicken_id, record_date, health_status in records:
+        if chicken_id is not None and health_status != 'healthy':
+            key = (chicken_id, str(record_date)[:10])
+            issues[key] = issues.get(key, 0) + 1
+    conn.executemany(
+        f'UPDATE chicken_features SET {_window_increments("health_issues", ":amount")} WHERE chicken_id = :chicken_id',
+        [{'chicken_id': chicken_id, 'day': day, 'amount': count} for (chicken_id, day), count in issues.items()]
+    )
+
+
+def add_egg_records(conn, records):
+    """Add (chicken_id, date, quantity) records to the egg windows"""
+    eggs = {}
+    for chicken_id, record_date, quantity in records:
+        if chicken_id is not None:
+            key = (chicken_id, str(record_date)[:10])
+            eggs[key] = eggs.get(key, 0) + (quantity or 0)
+    conn.executemany(
+        f'UPDATE chicken_features SET {_window_increments("eggs", ":amount")} WHERE chicken_id = :chicken_id',
+        [{'chicken_id': chicken_id, 'day': day, 'amount': total} for (chicken_id, day), total in eggs.items()]
+    )
+
+
+def refresh_stale(conn, today=None):
+    """
+    Recompute the windows of rows computed for an earlier day, since days
+    have dropped out of them; one statement for every stale row
+    """
+    today = today or date.today()
+    params = {'today': today.isoformat(), 'today_day': epoch_day(today)}
+    sets = []
+    for window in FEATURE_WINDOWS:
+        start = last_days(window, today)[0]
+        params[f'start_{window}'] = start.isoformat()
+        params[f'start_day_{window}'] = epoch_day(start)
+        sets.append(f'''health_issues_{window}d = (
+            SELECT COUNT(*) FROM health_records h
+            WHERE h.chicken_id = chicken_features.chicken_id AND h.health_status != 'healthy'
+              AND h.date_day BETWEEN :start_day_{window} AND :today_day
+        )''')
+        sets.append(f'''eggs_{window}d = (
+            SELECT COALESCE(SUM(e.quantity), 0) FROM egg_daily_totals e
+            WHERE e.chicken_id = chicken_features.chicken_id
+              AND e.day >= :start_{window} AND e.day <= :today
+        )''')
+    cursor = conn.execute(
+        f'UPDATE chicken_features SET as_of = :today, {", ".join(sets)} WHERE as_of < :today', params
+    )
+    return cursor.rowcount
+
+
+def ensure_current(conn, today=None):
+    """Refresh stale rows first if any are left from an earlier day"""
+    today = today or date.today()
+    if conn.execute('SELECT 1 FROM chicken_features WHERE as_of < ? LIMIT 1', (today.isoformat(),)).fetchone():
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            refresh_stale(conn, today)
+
+
+def seed(conn):
+    """Add a feature row marked stale for every chicken without one"""
+    conn.execute('''
+        INSERT OR IGNORE INTO chicken_features (chicken_id, added_day, as_of)
+        SELECT id, substr(date_added, 1, 10), '' FROM chickens
+    ''')
+
+
+def rebuild(conn):
+    """Recreate a feature row for every chicken from the raw records"""
+    conn.execute('DELETE FROM chicken_features')
+    seed(conn)
+    return refresh_stale(conn)
+
+
+def to_features(row, today):
+    """Feature dict of a (chicken_id, added_day, *FEATURE_COLUMNS) row"""
+    values = dict(zip(FEATURE_COLUMNS, row[2:]))
+    try:
+        tenure = (today - date.fromisoformat(row[1])).days
+    except (TypeError, ValueError):
+        tenure = 0
+    features = {
+        'recent_health_issues': values[f'health_issues_{RECENT_ISSUES_WINDOW}d'],
+        'days_since_added': tenure
+    }
+    features.update(values)
+    for window in FEATURE_WINDOWS:
+        features[f'egg_rate_{window}d'] = round(values[f'eggs_{window}d'] / window, 4)
+    return features
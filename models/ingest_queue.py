@@ -0,0 +1,476 @@
+import atexit
+import glob
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+
+try:
+    import fcntl
+except ImportError:  # Windows: journals cannot be locked
+    fcntl = None
+
+from models.database import db, get_connection
+from models.farm_model import insert_records, publish_inserted, record_result, validate_records
+from models.migrations import get_table_version
+
+logger = logging.getLogger(__name__)
+
+# INGEST_QUEUE=on sends egg, feed and health record uploads through a queue
+# that one writer thread commits in groups; off (default) commits each
+# request in its own transaction
+INGEST_QUEUE = os.environ.get('INGEST_QUEUE', 'off')
+
+# When a queued write is acknowledged: "commit" once the batch holding it
+# is committed (default), "journal" once it is appended to a write-ahead
+# journal file that is replayed after a crash, "memory" as soon as it is queued
+INGEST_DURABILITY = os.environ.get('INGEST_DURABILITY', 'commit')
+DURABILITY_LEVELS = ('commit', 'journal', 'memory')
+
+# Base path of the journal files (default: next to the database), and
+# whether every append is fsynced rather than only flushed to the OS. Each
+# process appends to its own file, named after the base, its pid and a
+# random tag
+INGEST_JOURNAL = os.environ.get('INGEST_JOURNAL')
+JOURNAL_SUFFIX = re.compile(r'\.\d+\.[0-9a-f]{8}$')
+INGEST_JOURNAL_FSYNC = os.environ.get('INGEST_JOURNAL_FSYNC', 'off') == 'on'
+
+# A batch is committed once it holds INGEST_BATCH_ROWS rows or its oldest
+# write has waited INGEST_BATCH_MS milliseconds
+INGEST_BATCH_ROWS = int(os.environ.get('INGEST_BATCH_ROWS', 500))
+INGEST_BATCH_MS = float(os.environ.get('INGEST_BATCH_MS', 5))
+
+# Rows queued before writers have to wait, and seconds they wait for room
+# before being refused
+INGEST_MAX_ROWS = int(os.environ.get('INGEST_MAX_ROWS', 10000))
+INGEST_ENQUEUE_TIMEOUT = float(os.environ.get('INGEST_ENQUEUE_TIMEOUT', 1.0))
+
+# Recent commits kept for the latency statistics
+LATENCY_SAMPLES = 1000
+
+# Longest pause, in seconds, between retries of a batch that failed to commit
+MAX_RETRY_DELAY = 5.0
+
+
+class QueueFull(Exception):
+    """The ingestion queue stayed full for the whole enqueue timeout"""
+
+
+class QueuedWrite:
+    """Validated records of one request, waiting for the writer thread"""
+    __slots__ = ('table', 'records', 'seq', 'journal', 'queued_at', 'done', 'ids', 'error')
+
+    def __init__(self, table, records, seq=None, journal=None):
+        self.table = table
+        self.records = records
+        self.seq = seq
+        self.journal = journal
+        self.queued_at = time.perf_counter()
+        self.done = threading.Event()
+        self.ids = None
+        self.error = None
+
+
+def _try_lock(journal):
+    """Take the lock on an open journal file; False while another process holds it"""
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+def _latency(samples):
+    """Milliseconds statistics of recent durations"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    ms = lambda seconds: round(seconds * 1000, 3)
+    return {
+        'mean_ms': ms(sum(ordered) / len(ordered)),
+        'p50_ms': ms(ordered[len(ordered) // 2]),
+        'p95_ms': ms(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]),
+        'max_ms': ms(ordered[-1])
+    }
+
+
+class IngestQueue:
+    """
+    Bounded in-process queue of record inserts with a single writer thread.
+    The writer commits everything queued at once, every batch_ms or
+    batch_rows rows, so concurrent uploads share one transaction and fsync
+    instead of each waiting for SQLite's write lock.
+
+    With durability "journal" every process appends to a journal file of
+    its own, with its own ingest_journal row, and holds a lock on it while
+    it runs. A starting process takes over the journals whose lock it can
+    take, as their process is gone: it replays their uncommitted entries,
+    then deletes the journal and its row.
+    """
+    def __init__(self, durability=INGEST_DURABILITY, journal_path=INGEST_JOURNAL, fsync=INGEST_JOURNAL_FSYNC,
+                 batch_rows=INGEST_BATCH_ROWS, batch_ms=INGEST_BATCH_MS, max_rows=INGEST_MAX_ROWS,
+                 enqueue_timeout=INGEST_ENQUEUE_TIMEOUT):
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f'INGEST_DURABILITY must be one of {", ".join(DURABILITY_LEVELS)}')
+        self.durability = durability
+        self.journal_base = os.path.abspath(journal_path or f'{db.database}-ingest.journal')
+        self.journal_path = None
+        self.fsync = fsync
+        self.batch_rows = batch_rows
+        self.batch_seconds = batch_ms / 1000
+        self.max_rows = max_rows
+        self.enqueue_timeout = enqueue_timeout
+
+        self._cond = threading.Condition()
+        self._pending = deque()
+        self._depth = 0
+        self._closing = False
+        self._thread = None
+        self._journal = None
+        self._seq = 0
+        # Journals of dead processes being replayed: path -> (locked file, last seq)
+        self._adopted = {}
+
+        self.max_depth = 0
+        self.batches = 0
+        self.rows_committed = 0
+        self.rows_rejected = 0
+        self.refused = 0
+        self.failed_batches = 0
+        self.commit_seconds_total = 0.0
+        self.replayed = 0
+        self.last_error = None
+        self.commit_seconds = deque(maxlen=LATENCY_SAMPLES)
+        self.wait_seconds = deque(maxlen=LATENCY_SAMPLES)
+
+    @classmethod
+    def from_env(cls, setting=INGEST_QUEUE):
+        """Queue selected by the INGEST_QUEUE setting, or None when disabled"""
+        if setting != 'on':
+            return None
+        return cls()
+
+    def start(self):
+        """Replay the journal, if any, and start the writer thread"""
+        with self._cond:
+            if self._thread is not None:
+                return
+            if self.durability == 'journal':
+                self._open_journal()
+            self._thread = threading.Thread(target=self._run, name='ingest-writer', daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+    def close(self):
+        """Commit everything still queued and stop the writer thread"""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        if self._journal is not None:
+            # The journal is emptied once everything in it is committed;
+            # otherwise the next process to start replays it
+            if os.fstat(self._journal.fileno()).st_size == 0:
+                self._retire(self.journal_path, self._journal)
+            else:
+                self._journal.close()
+            self._journal = None
+        # Journals taken over but not fully replayed go to the next process
+        for journal, _ in self._adopted.values():
+            journal.close()
+        self._adopted = {}
+
+    def _open_journal(self):
+        """
+        Queue the uncommitted entries of the journals of processes that are
+        gone, then start this process's journal
+        """
+        # The base path itself is the journal of versions that shared one
+        for path in [self.journal_base] + sorted(glob.glob(glob.escape(self.journal_base) + '.*')):
+            if path == self.journal_base or JOURNAL_SUFFIX.search(path[len(self.journal_base):]):
+                self._adopt(path)
+
+        # Locked under a temporary name first, so no process starting
+        # meanwhile takes the new journal for the one of a dead process
+        path = f'{self.journal_base}.{os.getpid()}.{os.urandom(4).hex()}'
+        journal = os.fdopen(os.open(path + '.tmp', os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND), 'a')
+        _try_lock(journal)
+        os.rename(path + '.tmp', path)
+        conn = get_connection()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO ingest_journal (path, committed_seq) VALUES (?, 0)', (path,))
+        self._journal = journal
+        self.journal_path = path
+        if self.replayed:
+            logger.warning('Replaying %d uncommitted ingestion journal entries', self.replayed)
+
+    def _adopt(self, path):
+        """Queue the uncommitted entries of a journal if its process is gone"""
+        try:
+            journal = open(path)
+        except FileNotFoundError:
+            return
+        if not _try_lock(journal):
+            # Its process is still running
+            journal.close()
+            return
+        try:
+            retired = os.fstat(journal.fileno()).st_ino != os.stat(path).st_ino
+        except FileNotFoundError:
+            retired = True
+        if retired:
+            # Replayed and deleted by another process while this one opened it
+            journal.close()
+            return
+
+        row = get_connection().execute('SELECT committed_seq FROM ingest_journal WHERE path = ?', (path,)).fetchone()
+        committed = row[0] if row else 0
+        entries = []
+        for line in journal:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A write torn by a crash; nothing after it was acknowledged
+                break
+            if entry['seq'] > committed:
+                entries.append(entry)
+        if not entries:
+            self._retire(path, journal)
+            return
+
+        # Kept locked until its last entry is committed
+        self._adopted[path] = (journal, entries[-1]['seq'])
+        for entry in entries:
+            write = QueuedWrite(entry['table'], [tuple(values) for values in entry['records']], entry['seq'], path)
+            self._pending.append(write)
+            self._depth += len(write.records)
+        self.replayed += len(entries)
+
+    def _retire(self, path, journal):
+        """Delete a journal whose entries are all committed, then its row"""
+        # In this order: a row without its file is harmless, a file without
+        # its row would be replayed from the start
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        conn = get_connection()
+        with conn:
+            conn.execute('DELETE FROM ingest_journal WHERE path = ?', (path,))
+        journal.close()
+
+    def submit(self, table, rows):
+        """
+        Validate JSON objects for a record table and queue the valid ones.
+        Returns a result per row: an error for invalid ones, and for the
+        rest "recorded" with their id once committed (durability "commit")
+        or "queued". Raises QueueFull when there is no room in time.
+        """
+        results, valid = validate_records(table, rows)
+        if not valid:
+            return results
+
+        write = self._enqueue(table, [values for _, values in valid])
+        if self.durability == 'commit':
+            write.done.wait()
+            if write.error is not None:
+                raise write.error
+            for (index, _), record_id in zip(valid, write.ids):
+                results[index] = record_result(index, record_id)
+        else:
+            for index, _ in valid:
+                results[index] = {'index': index, 'status': 'queued'}
+        return results
+
+    def _enqueue(self, table, records):
+        with self._cond:
+            deadline = time.monotonic() + self.enqueue_timeout
+            # A write larger than the whole queue still goes in once it is empty
+            while self._depth and self._depth + len(records) > self.max_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.refused += 1
+                    raise QueueFull('Ingestion queue is full, retry later')
+                self._cond.wait(remaining)
+
+            write = QueuedWrite(table, records)
+            if self._journal is not None:
+                self._seq += 1
+                write.seq = self._seq
+                write.journal = self.journal_path
+                self._journal.write(json.dumps({'seq': write.seq, 'table': table, 'records': records}) + '\n')
+                self._journal.flush()
+                if self.fsync:
+                    os.fsync(self._journal.fileno())
+            self._pending.append(write)
+            self._depth += len(records)
+            self.max_depth = max(self.max_depth, self._depth)
+            self._cond.notify_all()
+        return write
+
+    def _next_batch(self):
+        """Wait for a batch to fill up or time out; None once closed and drained"""
+        with self._cond:
+            while not self._pending:
+                if self._closing:
+                    return None
+                self._cond.wait()
+            deadline = self._pending[0].queued_at + self.batch_seconds
+            while self._depth < self.batch_rows and not self._closing:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = []
+            rows = 0
+            while self._pending and (not batch or rows + len(self._pending[0].records) <= self.batch_rows):
+                write = self._pending.popleft()
+                batch.append(write)
+                rows += len(write.records)
+            self._depth -= rows
+            # Writers waiting for room
+            self._cond.notify_all()
+        return batch
+
+    def _run(self):
+        retry_delay = 0.1
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            while not self._commit(batch):
+                if self.durability == 'commit':
+                    break
+                if self._closing:
+                    # Stop without committing later writes past this one;
+                    # journaled writes are replayed on the next start
+                    logger.error('Stopping with %d queued rows not committed', self._depth + sum(
+                        len(write.records) for write in batch))
+                    return
+                # Acknowledged writes must not be dropped; keep trying
+                time.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, MAX_RETRY_DELAY)
+            retry_delay = 0.1
+
+    def _commit(self, batch):
+        """Insert a batch in one transaction; returns False if it failed"""
+        by_table = {}
+        last_seqs = {}
+        for write in batch:
+            by_table.setdefault(write.table, []).append(write)
+            if write.seq is not None:
+                last_seqs[write.journal] = max(last_seqs.get(write.journal, 0), write.seq)
+
+        start = time.perf_counter()
+        conn = get_connection()
+        versions = {}
+        try:
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                for table, writes in by_table.items():
+                    ids = insert_records(conn, table, [values for write in writes for values in write.records])
+                    versions[table] = get_table_version(table, conn)
+                    offset = 0
+                    for write in writes:
+                        write.ids = ids[offset:offset + len(write.records)]
+                        offset += len(write.records)
+                for path, seq in last_seqs.items():
+                    conn.execute('UPDATE ingest_journal SET committed_seq = ? WHERE path = ?', (seq, path))
+        except Exception as e:
+            logger.exception('Group commit of %d queued writes failed', len(batch))
+            self.failed_batches += 1
+            self.last_error = str(e)
+            if self.durability == 'commit':
+                for write in batch:
+                    write.error = e
+                    write.done.set()
+            return False
+        committed = time.perf_counter()
+
+        for table, writes in by_table.items():
+            publish_inserted(table, [
+                (record_id, values)
+                for write in writes for record_id, values in zip(write.ids, write.records) if record_id is not None
+            ], versions[table])
+        rows = sum(len(write.records) for write in batch)
+        rejected = sum(write.ids.count(None) for write in batch)
+        with self._cond:
+            self.batches += 1
+            self.rows_committed += rows - rejected
+            self.rows_rejected += rejected
+            self.commit_seconds.append(committed - start)
+            self.commit_seconds_total += committed - start
+            self.wait_seconds.extend(committed - write.queued_at for write in batch)
+            # Everything journaled is committed: start the journal over
+            if self._journal is not None and last_seqs.get(self.journal_path) == self._seq:
+                self._journal.truncate(0)
+        for path, seq in last_seqs.items():
+            if path in self._adopted and seq == self._adopted[path][1]:
+                self._retire(path, self._adopted.pop(path)[0])
+        for write in batch:
+            write.done.set()
+        return True
+
+    def get_stats(self):
+        with self._cond:
+            return {
+                'durability': self.durability,
+                'journal': self.journal_path if self.durability == 'journal' else None,
+                'batch_rows': self.batch_rows,
+                'batch_ms': self.batch_seconds * 1000,
+                'max_rows': self.max_rows,
+                'depth': self._depth,
+                'queued_writes': len(self._pending),
+                'max_depth': self.max_depth,
+                'batches': self.batches,
+                'rows_committed': self.rows_committed,
+                'rows_per_batch': round(self.rows_committed / self.batches, 2) if self.batches else 0.0,
+                'rows_rejected': self.rows_rejected,
+                'refused': self.refused,
+                'failed_batches': self.failed_batches,
+                'replayed': self.replayed,
+                'last_error': self.last_error,
+                'commit_latency': _latency(self.commit_seconds),
+                'queue_latency': _latency(self.wait_seconds)
+            }
+
+    def render_metrics(self):
+        """Queue metrics in the Prometheus text exposition format"""
+        stats = self.get_stats()
+        with self._cond:
+            commits = sorted(self.commit_seconds)
+            total = self.commit_seconds_total
+        lines = [
+            '# HELP farm_ingest_queue_depth Rows waiting in the ingestion queue.',
+            '# TYPE farm_ingest_queue_depth gauge',
+            f'farm_ingest_queue_depth {stats["depth"]}',
+            '# HELP farm_ingest_rows_total Rows committed by the ingestion queue.',
+            '# TYPE farm_ingest_rows_total counter',
+            f'farm_ingest_rows_total {stats["rows_committed"]}',
+            '# HELP farm_ingest_batches_total Group commits made by the ingestion queue.',
+            '# TYPE farm_ingest_batches_total counter',
+            f'farm_ingest_batches_total {stats["batches"]}',
+            '# HELP farm_ingest_refused_total Writes refused because the queue was full.',
+            '# TYPE farm_ingest_refused_total counter',
+            f'farm_ingest_refused_total {stats["refused"]}',
+            '# HELP farm_ingest_commit_seconds Duration of recent group commits.',
+            '# TYPE farm_ingest_commit_seconds summary',
+        ]
+        # Quantiles over the recent commits, totals over all of them
+        for quantile in (0.5, 0.95, 0.99):
+            value = commits[min(len(commits) - 1, int(len(commits) * quantile))] if commits else 0.0
+            lines.append(f'farm_ingest_commit_seconds{{quantile="{quantile}"}} {value:.6f}')
+        lines.append(f'farm_ingest_commit_seconds_sum {total:.6f}')
+        lines.append(f'farm_ingest_commit_seconds_count {stats["batches"]}')
+        return '\n'.join(lines) + '\n'
+
+
+# Shared queue of the web app, None when disabled
+ingest_queue = IngestQueue.from_env()
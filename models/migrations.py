@@ -0,0 +1,399 @@
+import re
+
+from models.database import db, get_connection
+
+# Record tables that point at chickens(id), with the columns they had before
+# the foreign key rebuild
+RECORD_TABLES = {
+    'egg_production': '''
+        CREATE TABLE {name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chicken_id INTEGER REFERENCES chickens(id) ON DELETE CASCADE,
+            date TEXT,
+            quantity INTEGER,
+            notes TEXT
+        )
+    ''',
+    'feed_schedule': '''
+        CREATE TABLE {name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chicken_id INTEGER REFERENCES chickens(id) ON DELETE CASCADE,
+            feed_type TEXT,
+            scheduled_time TEXT,
+            amount REAL,
+            notes TEXT
+        )
+    ''',
+    'health_records': '''
+        CREATE TABLE {name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chicken_id INTEGER REFERENCES chickens(id) ON DELETE CASCADE,
+            date TEXT,
+            health_status TEXT,
+            symptoms TEXT,
+            treatment TEXT,
+            notes TEXT
+        )
+    ''',
+}
+
+
+def _create_base_tables(conn):
+    """Tables as originally created by ChickenModel and FarmModel"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS chickens (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            breed TEXT,
+            age INTEGER,
+            health_status TEXT DEFAULT 'healthy',
+            date_added TEXT,
+            feeding_schedule TEXT,
+            notes TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS egg_production (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chicken_id INTEGER,
+            date TEXT,
+            quantity INTEGER,
+            notes TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS feed_schedule (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chicken_id INTEGER,
+            feed_type TEXT,
+            scheduled_time TEXT,
+            amount REAL,
+            notes TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS health_records (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chicken_id INTEGER,
+            date TEXT,
+            health_status TEXT,
+            symptoms TEXT,
+            treatment TEXT,
+            notes TEXT
+        )
+    ''')
+
+
+def _add_chicken_foreign_keys(conn):
+    """Rebuild the record tables so chicken_id references chickens(id)"""
+    for table, create_sql in RECORD_TABLES.items():
+        columns = ', '.join(row[1] for row in conn.execute(f'PRAGMA table_info({table})'))
+        row = conn.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()
+        sequence = row[0] if row else 0
+
+        # Rows already pointing at deleted chickens are copied as-is; foreign
+        # keys are off while migrating so history is never dropped here
+        conn.execute(create_sql.format(name=f'{table}_new'))
+        conn.execute(f'INSERT INTO {table}_new ({columns}) SELECT {columns} FROM {table}')
+        conn.execute(f'DROP TABLE {table}')
+        conn.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+
+        # Keep AUTOINCREMENT from handing out ids of rows deleted before the rebuild
+        conn.execute('UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?', (sequence, table))
+
+
+def _add_record_indexes(conn):
+    """Index record tables for per-chicken lookups and date ordering"""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_egg_production_chicken_date ON egg_production (chicken_id, date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_egg_production_date ON egg_production (date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_health_records_chicken_date ON health_records (chicken_id, date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_health_records_date ON health_records (date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_feed_schedule_chicken ON feed_schedule (chicken_id, scheduled_time)')
+
+
+def _add_chicken_status_index(conn):
+    """Let dashboard status counts read an index instead of the table"""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_chickens_health_status ON chickens (health_status)')
+
+
+# Tables whose change counters back the ETags of the read endpoints
+VERSIONED_TABLES = ('chickens', 'egg_production', 'feed_schedule', 'health_records')
+
+
+def _add_table_versions(conn):
+    """Keep a change counter per table, bumped by triggers on every write"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    tables = ('chickens', 'egg_production', 'feed_schedule', 'health_records')
+    conn.executemany('INSERT OR IGNORE INTO table_versions (name) VALUES (?)', [(t,) for t in tables])
+
+    # Triggers rather than the model methods, so cascaded deletes and writes
+    # from other tools bump the counters too
+    for table in tables:
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()}
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE table_versions SET version = version + 1 WHERE name = '{table}';
+                END
+            ''')
+
+
+# Recomputes egg_daily_totals from the raw records for
+# FarmModel.rebuild_egg_rollups; migrations keep their own copy of the query
+# they ran. Records of chickens that no longer exist (e.g. imported with
+# foreign keys off) roll up under the NULL chicken, as ON DELETE SET NULL
+# would have left them, since the rollup's chicken_id references chickens(id)
+EGG_ROLLUP_BACKFILL_SQL = '''
+    INSERT INTO egg_daily_totals (day, chicken_id, quantity, records)
+    SELECT substr(e.date, 1, 10), c.id, SUM(COALESCE(e.quantity, 0)), COUNT(*)
+    FROM egg_production e LEFT JOIN chickens c ON c.id = e.chicken_id
+    GROUP BY substr(e.date, 1, 10), c.id
+'''
+
+
+# Moves the rollup rows of a chicken about to be deleted to the NULL
+# chicken, where its egg records go under ON DELETE SET NULL
+EGG_ROLLUP_DETACH_SQL = '''
+    INSERT INTO egg_daily_totals (day, chicken_id, quantity, records)
+    SELECT day, NULL, quantity, records FROM egg_daily_totals WHERE chicken_id = ?
+    ON CONFLICT (day, IFNULL(chicken_id, 0)) DO UPDATE SET
+        quantity = quantity + excluded.quantity,
+        records = records + excluded.records
+'''
+
+
+def _add_egg_rollups(conn):
+    """Per-chicken daily egg totals, kept up to date by FarmModel writes"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS egg_daily_totals (
+            day TEXT NOT NULL,
+            chicken_id INTEGER REFERENCES chickens(id) ON DELETE CASCADE,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            records INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    # Records without a chicken roll up under a NULL chicken_id, so the
+    # uniqueness (and upsert target) treats NULL as a value
+    conn.execute(
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_egg_daily_totals_day_chicken '
+        'ON egg_daily_totals (day, IFNULL(chicken_id, 0))'
+    )
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_egg_daily_totals_chicken ON egg_daily_totals (chicken_id, day)')
+    conn.execute('DELETE FROM egg_daily_totals')
+    conn.execute('''
+        INSERT INTO egg_daily_totals (day, chicken_id, quantity, records)
+        SELECT substr(date, 1, 10), chicken_id, SUM(COALESCE(quantity, 0)), COUNT(*)
+        FROM egg_production
+        GROUP BY substr(date, 1, 10), chicken_id
+    ''')
+
+
+def _add_chicken_features(conn):
+    """Rolling per-chicken features, kept up to date by ChickenModel and FarmModel writes"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS chicken_features (
+            chicken_id INTEGER PRIMARY KEY REFERENCES chickens(id) ON DELETE CASCADE,
+            added_day TEXT,
+            as_of TEXT NOT NULL,
+            health_issues_7d INTEGER NOT NULL DEFAULT 0,
+            health_issues_14d INTEGER NOT NULL DEFAULT 0,
+            health_issues_30d INTEGER NOT NULL DEFAULT 0,
+            eggs_7d INTEGER NOT NULL DEFAULT 0,
+            eggs_14d INTEGER NOT NULL DEFAULT 0,
+            eggs_30d INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    # Finds rows whose windows are from an earlier day
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_chicken_features_as_of ON chicken_features (as_of)')
+    # Rows start out stale and are computed by the first read, with the
+    # queries (and schema) of the code running then
+    conn.execute('''
+        INSERT OR IGNORE INTO chicken_features (chicken_id, added_day, as_of)
+        SELECT id, substr(date_added, 1, 10), '' FROM chickens
+    ''')
+
+
+# Text date columns and the prefix of the integer columns derived from them
+EPOCH_DATE_COLUMNS = {
+    'chickens': ('date_added', 'added'),
+    'egg_production': ('date', 'date'),
+    'health_records': ('date', 'date'),
+}
+
+
+def _add_epoch_date_columns(conn):
+    """
+    Generated epoch-day and epoch-second columns next to each text date, so
+    every writer keeps them right and day ranges are integer index scans
+    """
+    for table, (column, prefix) in EPOCH_DATE_COLUMNS.items():
+        # VIRTUAL: computed on read and stored only in the indexes below.
+        # The expressions are models.dates.EPOCH_DAY_SQL and EPOCH_SECONDS_SQL
+        # as of this migration
+        conn.execute(
+            f'ALTER TABLE {table} ADD COLUMN {prefix}_day INTEGER '
+            f'GENERATED ALWAYS AS (CAST(julianday(substr({column}, 1, 10)) - 2440587.5 AS INTEGER)) VIRTUAL'
+        )
+        conn.execute(
+            f'ALTER TABLE {table} ADD COLUMN {prefix}_ts INTEGER '
+            f"GENERATED ALWAYS AS (CAST(strftime('%s', substr({column}, 1, 19)) AS INTEGER)) VIRTUAL"
+        )
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_chickens_added_day ON chickens (added_day)')
+    for table in ('egg_production', 'health_records'):
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_date_day ON {table} (date_day)')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_chicken_date_day ON {table} (chicken_id, date_day)')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_date_ts ON {table} (date_ts)')
+
+
+def _add_ingest_journal(conn):
+    """
+    Last write-ahead journal entry committed by the ingestion queue, per
+    journal file, updated in the same transaction as the rows it covers
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS ingest_journal (
+            path TEXT PRIMARY KEY,
+            committed_seq INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+
+def _rebuild_table(conn, table, edit_sql):
+    """
+    Recreate table from its current CREATE statement as changed by
+    edit_sql, keeping its rows, AUTOINCREMENT sequence, indexes and triggers
+    """
+    create_sql = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone()[0]
+    dependents = [row[0] for row in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL",
+        (table,)
+    )]
+    # Generated columns (hidden 2 and 3) are computed, not copied
+    columns = ', '.join(row[1] for row in conn.execute(f'PRAGMA table_xinfo({table})') if row[6] == 0)
+    row = conn.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()
+    sequence = row[0] if row else 0
+
+    # Renames store the name quoted, e.g. CREATE TABLE "egg_production"
+    new_sql = re.sub(r'^CREATE TABLE\s+("?)\w+\1', f'CREATE TABLE {table}_new', edit_sql(create_sql), count=1)
+    conn.execute(new_sql)
+    conn.execute(f'INSERT INTO {table}_new ({columns}) SELECT {columns} FROM {table}')
+    conn.execute(f'DROP TABLE {table}')
+    conn.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+    conn.execute('UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?', (sequence, table))
+    for sql in dependents:
+        conn.execute(sql)
+
+
+def _keep_records_of_deleted_chickens(conn):
+    """
+    Rebuild the record tables with ON DELETE SET NULL, so deleting a
+    chicken keeps its egg, feed and health history as it did before the
+    foreign keys, and detach records already pointing at deleted chickens
+    """
+    for table in RECORD_TABLES:
+        _rebuild_table(conn, table, lambda sql: sql.replace('ON DELETE CASCADE', 'ON DELETE SET NULL'))
+        conn.execute(f'UPDATE {table} SET chicken_id = NULL WHERE chicken_id NOT IN (SELECT id FROM chickens)')
+    # Detached egg records roll up under the NULL chicken
+    conn.execute('DELETE FROM egg_daily_totals')
+    conn.execute('''
+        INSERT INTO egg_daily_totals (day, chicken_id, quantity, records)
+        SELECT substr(e.date, 1, 10), c.id, SUM(COALESCE(e.quantity, 0)), COUNT(*)
+        FROM egg_production e LEFT JOIN chickens c ON c.id = e.chicken_id
+        GROUP BY substr(e.date, 1, 10), c.id
+    ''')
+
+
+# Ordered (version, description, apply) entries; never edit an applied one,
+# append a new version instead. Each one spells out the SQL it runs rather
+# than calling code that may change later, so every database gets the same
+# result from it whenever it migrates
+MIGRATIONS = [
+    (1, 'Create chickens, egg_production, feed_schedule and health_records', _create_base_tables),
+    (2, 'Reference chickens(id) from record tables', _add_chicken_foreign_keys),
+    (3, 'Index record tables by chicken and date', _add_record_indexes),
+    (4, 'Index chickens by health status', _add_chicken_status_index),
+    (5, 'Track a change counter per table', _add_table_versions),
+    (6, 'Roll up egg production per chicken and day', _add_egg_rollups),
+    (7, 'Keep rolling health and egg features per chicken', _add_chicken_features),
+    (8, 'Add epoch-day and epoch-second date columns', _add_epoch_date_columns),
+    (9, 'Track the ingestion queue journal', _add_ingest_journal),
+    (10, 'Keep the records of deleted chickens', _keep_records_of_deleted_chickens),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# Databases already brought up to date by this process
+_migrated = set()
+
+
+def get_schema_version(conn=None):
+    """Schema version recorded in the database file"""
+    conn = conn or get_connection()
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def get_table_versions(tables, conn=None):
+    """Change counters of the given tables, in the same order"""
+    conn = conn or get_connection()
+    placeholders = ', '.join('?' * len(tables))
+    found = dict(conn.execute(
+        f'SELECT name, version FROM table_versions WHERE name IN ({placeholders})', tuple(tables)
+    ).fetchall())
+    return tuple(found.get(table, 0) for table in tables)
+
+
+def get_table_version(table, conn=None):
+    """
+    Change counter of one table. Read inside a write's transaction it is
+    the counter that write left, which its change event carries.
+    """
+    return get_table_versions((table,), conn)[0]
+
+
+def migrate(conn=None):
+    """Apply pending migrations and return the resulting schema version"""
+    shared = conn is None
+    if shared and db.database in _migrated:
+        # Every model instance calls this; only the first one per process
+        # needs to touch the database
+        return LATEST_VERSION
+
+    conn = conn or get_connection()
+    if get_schema_version(conn) >= LATEST_VERSION:
+        if shared:
+            _migrated.add(db.database)
+        return LATEST_VERSION
+
+    # foreign_keys can only be toggled outside a transaction; table rebuilds
+    # need it off so DROP TABLE does not cascade
+    conn.execute('PRAGMA foreign_keys=OFF')
+    try:
+        # IMMEDIATE takes the write lock up front, so workers starting at the
+        # same time apply each migration exactly once
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            version = get_schema_version(conn)
+            for number, description, apply in MIGRATIONS:
+                if number <= version:
+                    continue
+                apply(conn)
+                conn.execute(f'PRAGMA user_version={number}')
+                version = number
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    finally:
+        conn.execute('PRAGMA foreign_keys=ON')
+
+    if shared:
+        _migrated.add(db.database)
+    return version
@@ -0,0 +1,283 @@
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+from models.database import db
+
+# PROFILING=on times every request by phase (database, model inference,
+# JSON serialization), adds a Server-Timing header and serves Prometheus
+# metrics; off (default) installs nothing
+PROFILING = os.environ.get('PROFILING', 'off')
+
+# Share of requests run under cProfile, and how slow (ms) one of them must
+# be for its profile to be kept
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_SLOW_MS = float(os.environ.get('PROFILE_SLOW_MS', 500))
+
+# Slow request profiles kept for /api/system/profiles
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 20))
+
+# Functions listed per kept profile, by cumulative time
+PROFILE_TOP = 30
+
+# Upper bounds, in seconds, of the request duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Phases timed separately; the rest of a request is reported as "app"
+PHASES = ('db', 'inference', 'serialize')
+
+# Timings of the request being served by this thread
+_local = threading.local()
+
+
+@contextmanager
+def phase(name, count=1):
+    """
+    Add the time spent in the block (and count operations) to a phase of
+    the current request; does nothing outside a profiled request
+    """
+    timings = getattr(_local, 'timings', None)
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        totals = timings.phases.setdefault(name, [0.0, 0])
+        totals[0] += time.perf_counter() - start
+        totals[1] += count
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    """Cursor that counts statements and times them and their fetches as the db phase"""
+    def execute(self, sql, parameters=()):
+        with phase('db'):
+            return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        with phase('db'):
+            return super().executemany(sql, seq_of_parameters)
+
+    def fetchone(self):
+        with phase('db', count=0):
+            return super().fetchone()
+
+    def fetchmany(self, size=None):
+        with phase('db', count=0):
+            return super().fetchmany(self.arraysize if size is None else size)
+
+    def fetchall(self):
+        with phase('db', count=0):
+            return super().fetchall()
+
+
+class ProfiledConnection(sqlite3.Connection):
+    """Connection whose shortcut methods go through ProfiledCursor"""
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.profile = None
+
+
+class RequestProfiler:
+    """
+    Per-request timings by phase, aggregated per route for Prometheus, and
+    cProfile runs of a sample of requests whose slow ones are kept
+    """
+    def __init__(self, sample_rate=PROFILE_SAMPLE_RATE, slow_ms=PROFILE_SLOW_MS, keep=PROFILE_KEEP):
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self._lock = threading.Lock()
+        # (method, route) -> [count, seconds, bucket counts, {phase: [seconds, count]}]
+        self._routes = {}
+        # (method, route, status) -> count
+        self._responses = {}
+        self._profiles = deque(maxlen=keep)
+        # cProfile can profile only one request at a time
+        self._profiler_lock = threading.Lock()
+        self.sampled = 0
+
+    @classmethod
+    def from_env(cls, setting=PROFILING):
+        """Profiler selected by the PROFILING setting, or None when disabled"""
+        if setting != 'on':
+            return None
+        # Connections opened from here on are instrumented
+        db.connection_factory = ProfiledConnection
+        return cls()
+
+    def begin(self):
+        """Start timing the current request, under cProfile if it is sampled"""
+        timings = _local.timings = RequestTimings()
+        if self.sample_rate and random.random() < self.sample_rate and self._profiler_lock.acquire(blocking=False):
+            import cProfile
+            timings.profile = cProfile.Profile()
+            timings.profile.enable()
+        return timings
+
+    def end(self):
+        """Stop timing the current request; returns its timings, if any"""
+        timings = getattr(_local, 'timings', None)
+        _local.timings = None
+        if timings is not None and timings.profile is not None:
+            timings.profile.disable()
+            self._profiler_lock.release()
+        return timings
+
+    def record(self, timings, method, route, status, path):
+        """Add a finished request to the route metrics; returns its phase durations in seconds"""
+        total = time.perf_counter() - timings.start
+        durations = {name: seconds for name, (seconds, _) in timings.phases.items()}
+        durations['app'] = max(total - sum(durations.values()), 0.0)
+        durations['total'] = total
+
+        with self._lock:
+            stats = self._routes.get((method, route))
+            if stats is None:
+                stats = self._routes[(method, route)] = [0, 0.0, [0] * len(DURATION_BUCKETS), {}]
+            stats[0] += 1
+            stats[1] += total
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if total <= bound:
+                    stats[2][index] += 1
+            for name, (seconds, count) in timings.phases.items():
+                totals = stats[3].setdefault(name, [0.0, 0])
+                totals[0] += seconds
+                totals[1] += count
+            key = (method, route, status)
+            self._responses[key] = self._responses.get(key, 0) + 1
+            if timings.profile is not None:
+                self.sampled += 1
+
+        if timings.profile is not None and total * 1000 >= self.slow_ms:
+            self._keep_profile(timings, method, path, durations)
+        return durations
+
+    def _keep_profile(self, timings, method, path, durations):
+        import io
+        import pstats
+
+        out = io.StringIO()
+        pstats.Stats(timings.profile, stream=out).sort_stats('cumulative').print_stats(PROFILE_TOP)
+        self._profiles.append({
+            'at': datetime.now().isoformat(),
+            'method': method,
+            'path': path,
+            'duration_ms': round(durations['total'] * 1000, 3),
+            'phases_ms': {name: round(seconds * 1000, 3) for name, seconds in durations.items()},
+            'stats': out.getvalue()
+        })
+
+    def server_timing(self, durations, timings):
+        """Server-Timing header value of one request"""
+        entries = []
+        for name in PHASES + ('app', 'total'):
+            if name not in durations:
+                continue
+            entry = f'{name};dur={durations[name] * 1000:.2f}'
+            if name == 'db':
+                entry += f';desc="{timings.phases["db"][1]} queries"'
+            entries.append(entry)
+        return ', '.join(entries)
+
+    def get_profiles(self):
+        """Kept profiles of slow sampled requests, newest first"""
+        return {
+            'sample_rate': self.sample_rate,
+            'slow_ms': self.slow_ms,
+            'sampled': self.sampled,
+            'profiles': list(reversed(self._profiles))
+        }
+
+    def render_metrics(self):
+        """Route metrics in the Prometheus text exposition format"""
+        with self._lock:
+            routes = {key: (count, seconds, list(buckets), {name: list(totals) for name, totals in phases.items()})
+                      for key, (count, seconds, buckets, phases) in self._routes.items()}
+            responses = dict(self._responses)
+
+        lines = [
+            '# HELP farm_request_duration_seconds Time to handle a request.',
+            '# TYPE farm_request_duration_seconds histogram',
+        ]
+        for (method, route), (count, seconds, buckets, _) in sorted(routes.items()):
+            labels = f'method="{method}",route="{route}"'
+            for bound, observed in zip(DURATION_BUCKETS, buckets):
+                lines.append(f'farm_request_duration_seconds_bucket{{{labels},le="{bound}"}} {observed}')
+            lines.append(f'farm_request_duration_seconds_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f'farm_request_duration_seconds_sum{{{labels}}} {seconds:.6f}')
+            lines.append(f'farm_request_duration_seconds_count{{{labels}}} {count}')
+
+        lines += [
+            '# HELP farm_request_phase_seconds_total Time spent in each phase of handling requests.',
+            '# TYPE farm_request_phase_seconds_total counter',
+        ]
+        for (method, route), (_, _, _, phases) in sorted(routes.items()):
+            for name, (seconds, _) in sorted(phases.items()):
+                lines.append(f'farm_request_phase_seconds_total{{method="{method}",route="{route}",phase="{name}"}} {seconds:.6f}')
+
+        lines += [
+            '# HELP farm_db_queries_total SQL statements executed while handling requests.',
+            '# TYPE farm_db_queries_total counter',
+        ]
+        for (method, route), (_, _, _, phases) in sorted(routes.items()):
+            lines.append(f'farm_db_queries_total{{method="{method}",route="{route}"}} {phases.get("db", [0, 0])[1]}')
+
+        lines += [
+            '# HELP farm_responses_total Responses sent, by status code.',
+            '# TYPE farm_responses_total counter',
+        ]
+        for (method, route, status), count in sorted(responses.items()):
+            lines.append(f'farm_responses_total{{method="{method}",route="{route}",status="{status}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def install(self, app):
+        """Time every request of a Flask app and add its Server-Timing header"""
+        from flask import request
+        from flask.json.provider import DefaultJSONProvider
+
+        class TimedJSONProvider(DefaultJSONProvider):
+            def dumps(self, obj, **kwargs):
+                with phase('serialize'):
+                    return super().dumps(obj, **kwargs)
+
+        app.json = TimedJSONProvider(app)
+
+        @app.before_request
+        def start_timing():
+            self.begin()
+
+        @app.after_request
+        def finish_timing(response):
+            timings = self.end()
+            if timings is not None:
+                route = request.url_rule.rule if request.url_rule else 'unmatched'
+                durations = self.record(timings, request.method, route, response.status_code, request.path)
+                response.headers['Server-Timing'] = self.server_timing(durations, timings)
+            return response
+
+        @app.teardown_request
+        def discard_timing(exc):
+            # Requests that raised never reach after_request
+            self.end()
+
+
+# Shared profiler of the web app, None when disabled
+request_profiler = RequestProfiler.from_env()
@@ -0,0 +1,42 @@
+import sys
+import time
+from contextlib import contextmanager
+
+# Stages recorded while the process starts up and on first use of lazy modules
+timings = []
+_depth = 0
+
+
+@contextmanager
+def timed(stage):
+    """Record how long a startup stage took and which packages it imported"""
+    global _depth
+    before = set(sys.modules)
+    start = time.perf_counter()
+    _depth += 1
+    try:
+        yield
+    finally:
+        _depth -= 1
+        elapsed = time.perf_counter() - start
+        # Third-party and project packages only; the stdlib is noise here
+        new_packages = sorted({
+            name.split('.')[0] for name in set(sys.modules) - before
+            if not name.startswith('_') and name.split('.')[0] not in sys.stdlib_module_names
+        })
+        timings.append({
+            'stage': stage,
+            'ms': round(elapsed * 1000, 2),
+            'nested': _depth > 0,
+            'imported_packages': new_packages
+        })
+
+
+def startup_report():
+    """Startup cost broken down by stage, slowest first"""
+    stages = sorted(timings, key=lambda t: t['ms'], reverse=True)
+    return {
+        # Nested stages are already included in their enclosing stage
+        'total_ms': round(sum(t['ms'] for t in timings if not t['nested']), 2),
+        'stages': stages
+    }
@@ -0,0 +1,11 @@
+# rebuild_rollups.py - Recompute the egg production rollups and chicken features from the raw records
+from models.farm_model import FarmModel
+
+if __name__ == '__main__':
+    farm_model = FarmModel()
+    print("Rebuilding egg production rollups...")
+    rows = farm_model.rebuild_egg_rollups()
+    print(f"Rebuilt {rows} daily rollup rows successfully!")
+    print("Rebuilding chicken features...")
+    rows = farm_model.rebuild_chicken_features()
+    print(f"Rebuilt features of {rows} chickens successfully!")
@@ -0,0 +1,31 @@
+import pytest
+
+from models.chicken_model import ChickenModel
+from models.database import db
+from models.farm_model import FarmModel
+
+
+@pytest.fixture
+def farm_db(tmp_path):
+    """A migrated database of its own, with one chicken; yields the chicken's id"""
+    database = db.database
+    db.close_all()
+    db.database = str(tmp_path / 'farm.db')
+    FarmModel()
+    yield ChickenModel().add_chicken({'name': 'Hen', 'breed': 'Leghorn', 'age': 30})
+    db.close_all()
+    db.database = database
+
+
+@pytest.fixture
+def client(farm_db):
+    """Test client of the web app, on the farm_db database"""
+    from backend.app import app
+    from models.cache import response_cache
+    from models.flock_snapshot import flock_snapshot
+
+    # Process-wide state built from the previous test's database
+    if response_cache is not None:
+        response_cache.clear()
+    flock_snapshot._columns = None
+    return app.test_client()
@@ -0,0 +1,113 @@
+import asyncio
+import importlib
+import os
+import sys
+
+import pytest
+
+API_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api')
+
+
+@pytest.fixture(scope='module')
+def asgi_server():
+    """api/models/asgi_server, imported from the api tree's own models package"""
+    saved = {name: module for name, module in sys.modules.items() if name.split('.')[0] == 'models'}
+    for name in saved:
+        del sys.modules[name]
+    sys.path.insert(0, API_DIR)
+    try:
+        return importlib.import_module('models.asgi_server')
+    finally:
+        sys.path.remove(API_DIR)
+        for name in [name for name in sys.modules if name.split('.')[0] == 'models']:
+            del sys.modules[name]
+        sys.modules.update(saved)
+
+
+def serve(server, body_messages, headers=(), sent=None):
+    """Drive server through one request; returns the messages it sent, also appended to sent"""
+    scope = {
+        'type': 'http', 'method': 'POST', 'path': '/api/eggs', 'query_string': b'',
+        'headers': list(headers), 'http_version': '1.1'
+    }
+    incoming = list(body_messages)
+    sent = [] if sent is None else sent
+
+    async def receive():
+        if incoming:
+            return incoming.pop(0)
+        # Past the body, the client stays connected until the response is done
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(server(scope, receive, send))
+    return sent
+
+
+def make_server(asgi_server, wsgi_app, **options):
+    return asgi_server.AsgiServer(wsgi_app, threads=1, analytics_threads=1, stream_threads=1,
+                                  inference_workers=0, **options)
+
+
+def test_streams_the_response_and_ends_it(asgi_server):
+    def app(environ, start_response):
+        start_response('201 CREATED', [('Content-Type', 'application/json')])
+        return [b'{"id": ', environ['wsgi.input'].read(), b'}']
+
+    sent = serve(make_server(asgi_server, app), [
+        {'type': 'http.request', 'body': b'4', 'more_body': True},
+        {'type': 'http.request', 'body': b'2'},
+    ])
+
+    assert sent[0]['status'] == 201
+    assert b''.join(message.get('body', b'') for message in sent[1:]) == b'{"id": 42}'
+    assert not sent[-1].get('more_body')
+
+
+def test_error_after_the_response_started_closes_the_connection(asgi_server):
+    def app(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/csv')])
+        yield b'id,date\n'
+        raise RuntimeError('database went away')
+
+    sent = []
+    with pytest.raises(RuntimeError):
+        serve(make_server(asgi_server, app), [{'type': 'http.request', 'body': b''}], sent=sent)
+
+    # The server closes the connection; nothing marks the body as complete
+    assert sent[0]['status'] == 200
+    assert sent[1]['body'] == b'id,date\n'
+    assert all(message.get('more_body', False) for message in sent if message['type'] == 'http.response.body')
+
+
+def test_error_before_the_response_started_is_a_500(asgi_server):
+    def app(environ, start_response):
+        raise RuntimeError('database went away')
+
+    sent = serve(make_server(asgi_server, app), [{'type': 'http.request', 'body': b''}])
+
+    assert sent[0]['status'] == 500
+    assert not sent[-1].get('more_body')
+
+
+@pytest.mark.parametrize('headers, body_messages', [
+    # Declared up front: refused before any of it is read
+    ([(b'content-length', b'11')], [{'type': 'http.request', 'body': b'x' * 11}]),
+    # Streamed without a length: refused once it grows past the limit
+    ([], [{'type': 'http.request', 'body': b'x' * 6, 'more_body': True}] * 2),
+])
+def test_refuses_bodies_over_the_limit(asgi_server, headers, body_messages):
+    calls = []
+
+    def app(environ, start_response):
+        calls.append(environ)
+        start_response('200 OK', [])
+        return [b'']
+
+    sent = serve(make_server(asgi_server, app, max_body_bytes=10), body_messages, headers)
+
+    assert sent[0]['status'] == 413
+    assert not sent[-1].get('more_body')
+    assert calls == []
@@ -0,0 +1,126 @@
+import glob
+import threading
+
+import pytest
+
+from models.database import get_connection
+from models.ingest_queue import IngestQueue, QueueFull
+
+
+def egg_rows():
+    return get_connection().execute('SELECT COUNT(*), COALESCE(SUM(quantity), 0) FROM egg_production').fetchone()
+
+
+def journals(tmp_path):
+    return sorted(glob.glob(str(tmp_path / 'ingest.journal*')))
+
+
+def test_concurrent_writes_share_commits(farm_db):
+    queue = IngestQueue(durability='commit', batch_ms=50)
+    queue.start()
+    results = []
+
+    def upload():
+        results.extend(queue.submit('egg_production', [{'chicken_id': farm_db, 'quantity': 1}]))
+
+    threads = [threading.Thread(target=upload) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    queue.close()
+
+    assert [result['status'] for result in results] == ['recorded'] * 20
+    assert len({result['id'] for result in results}) == 20
+    assert egg_rows() == (20, 20)
+    assert queue.rows_committed == 20
+    assert queue.batches < 20
+
+
+def test_unknown_chickens_are_rejected_in_a_batch(farm_db):
+    queue = IngestQueue(durability='commit')
+    queue.start()
+    results = queue.submit('egg_production', [
+        {'chicken_id': farm_db, 'quantity': 2}, {'chicken_id': farm_db + 1, 'quantity': 3}, {'quantity': 'x'}
+    ])
+    queue.close()
+
+    assert [result['status'] for result in results] == ['recorded', 'error', 'error']
+    assert egg_rows() == (1, 2)
+    assert queue.rows_rejected == 1
+
+
+def test_journal_is_replayed_once_after_a_crash(farm_db, tmp_path):
+    crashed = IngestQueue(durability='journal', journal_path=str(tmp_path / 'ingest.journal'))
+    # Journaled and acknowledged, but the writer thread never ran
+    crashed._open_journal()
+    for quantity in (1, 2, 3):
+        assert crashed.submit('egg_production', [{'chicken_id': farm_db, 'quantity': quantity}])[0]['status'] == 'queued'
+    assert egg_rows() == (0, 0)
+
+    # While its process is alive, another one leaves the journal alone
+    live = IngestQueue(durability='journal', journal_path=str(tmp_path / 'ingest.journal'))
+    live.start()
+    live.close()
+    assert live.replayed == 0
+    assert journals(tmp_path) == [crashed.journal_path]
+
+    # The process dies, releasing its lock
+    crashed._journal.close()
+    restarted = IngestQueue(durability='journal', journal_path=str(tmp_path / 'ingest.journal'))
+    restarted.start()
+    restarted.close()
+    assert restarted.replayed == 3
+    assert egg_rows() == (3, 6)
+    assert journals(tmp_path) == []
+    assert get_connection().execute('SELECT COUNT(*) FROM ingest_journal').fetchone()[0] == 0
+
+    again = IngestQueue(durability='journal', journal_path=str(tmp_path / 'ingest.journal'))
+    again.start()
+    again.close()
+    assert again.replayed == 0
+    assert egg_rows() == (3, 6)
+
+
+def test_journal_replay_skips_committed_entries(farm_db, tmp_path):
+    crashed = IngestQueue(durability='journal', journal_path=str(tmp_path / 'ingest.journal'))
+    crashed._open_journal()
+    for quantity in (1, 2, 3):
+        crashed.submit('egg_production', [{'chicken_id': farm_db, 'quantity': quantity}])
+    # Only the first entry made it into a commit before the crash
+    assert crashed._commit([crashed._pending.popleft()])
+    crashed._journal.write('{"seq": 4, "tab')
+    crashed._journal.close()
+
+    restarted = IngestQueue(durability='journal', journal_path=str(tmp_path / 'ingest.journal'))
+    restarted.start()
+    restarted.close()
+    assert restarted.replayed == 2
+    assert egg_rows() == (3, 6)
+    assert journals(tmp_path) == []
+
+
+def test_full_queue_refuses_writes(farm_db):
+    queue = IngestQueue(durability='memory', max_rows=2, enqueue_timeout=0.05)
+    # No writer thread: nothing drains the queue
+    queue.submit('egg_production', [{'chicken_id': farm_db, 'quantity': 1}] * 2)
+    with pytest.raises(QueueFull):
+        queue.submit('egg_production', [{'chicken_id': farm_db, 'quantity': 1}])
+    assert queue.refused == 1
+    assert queue.get_stats()['depth'] == 2
+
+    queue.start()
+    queue.close()
+    assert egg_rows() == (2, 2)
+
+
+def test_writer_waiting_for_room_gets_in(farm_db):
+    queue = IngestQueue(durability='memory', max_rows=2, enqueue_timeout=5, batch_ms=1)
+    queue.submit('egg_production', [{'chicken_id': farm_db, 'quantity': 1}] * 2)
+    waiting = threading.Thread(target=queue.submit, args=('egg_production', [{'chicken_id': farm_db, 'quantity': 1}]))
+    waiting.start()
+    queue.start()
+    waiting.join()
+    queue.close()
+    assert queue.refused == 0
+    assert egg_rows() == (3, 3)
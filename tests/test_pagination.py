@@ -0,0 +1,32 @@
+import base64
+import json
+
+import pytest
+
+
+def cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+@pytest.mark.parametrize('path, values', [
+    ('/api/chickens', [{'x': 1}]),
+    ('/api/chickens', [[1]]),
+    ('/api/eggs', [[1], 2]),
+    ('/api/eggs', ['2026-01-01', {'id': 2}]),
+    ('/api/chickens', []),
+    ('/api/eggs', [1]),
+])
+def test_malformed_cursor_is_refused(client, path, values):
+    response = client.get(f'{path}?cursor={cursor(values)}')
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Invalid cursor'}
+
+
+def test_cursor_pages_through_chickens(client, farm_db):
+    for name in ('B', 'C'):
+        client.post('/api/chickens', json={'name': name, 'breed': 'Leghorn', 'age': 20})
+    first = client.get('/api/chickens?limit=2')
+    assert [chicken['id'] for chicken in first.get_json()] == [farm_db, farm_db + 1]
+    rest = client.get(f'/api/chickens?limit=2&cursor={first.headers["X-Next-Cursor"]}')
+    assert [chicken['id'] for chicken in rest.get_json()] == [farm_db + 2]
+    assert 'X-Next-Cursor' not in rest.headers
@@ -0,0 +1,56 @@
+from models.database import get_connection
+
+
+def table_count(table):
+    return get_connection().execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+
+def test_egg_record_with_string_quantity_is_refused(client, farm_db):
+    response = client.post('/api/eggs', json={'chicken_id': farm_db, 'quantity': '3'})
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'quantity must be a non-negative integer'}
+    assert table_count('egg_production') == 0
+    assert table_count('egg_daily_totals') == 0
+
+
+def test_egg_record_with_invalid_fields_is_refused(client, farm_db):
+    for data in ({'quantity': 2}, {'chicken_id': str(farm_db), 'quantity': 2},
+                 {'chicken_id': farm_db, 'quantity': 2, 'date': 'yesterday'}, [farm_db, 2]):
+        assert client.post('/api/eggs', json=data).status_code == 400
+    assert table_count('egg_production') == 0
+
+
+def test_egg_record_defaults_missing_quantity(client, farm_db):
+    response = client.post('/api/eggs', json={'chicken_id': farm_db})
+    assert response.status_code == 201
+    assert get_connection().execute('SELECT quantity, records FROM egg_daily_totals').fetchone() == (0, 1)
+
+
+def chicken_features(chicken_id):
+    return get_connection().execute(
+        'SELECT health_issues_14d, eggs_7d FROM chicken_features WHERE chicken_id = ?', (chicken_id,)
+    ).fetchone()
+
+
+def test_health_record_with_string_and_missing_fields_is_refused(client, farm_db):
+    for data in ({'chicken_id': farm_db}, {'chicken_id': farm_db, 'health_status': 3},
+                 {'chicken_id': farm_db, 'health_status': 'sick', 'symptoms': ['cough']},
+                 {'chicken_id': str(farm_db), 'health_status': 'sick'}, {'health_status': 'sick'}):
+        response = client.post('/api/health', json=data)
+        assert response.status_code == 400, data
+    assert table_count('health_records') == 0
+    assert chicken_features(farm_db) == (0, 0)
+
+
+def test_valid_single_records_update_the_features(client, farm_db):
+    assert client.post('/api/health', json={'chicken_id': farm_db, 'health_status': 'sick'}).status_code == 201
+    assert client.post('/api/health', json={'chicken_id': farm_db, 'health_status': 'healthy'}).status_code == 201
+    assert client.post('/api/eggs', json={'chicken_id': farm_db, 'quantity': 4}).status_code == 201
+    assert chicken_features(farm_db) == (1, 4)
+
+
+def test_feed_record_with_string_amount_is_refused(client, farm_db):
+    response = client.post('/api/feed', json={'chicken_id': farm_db, 'feed_type': 'Layer', 'amount': '50'})
+    assert response.status_code == 400
+    assert table_count('feed_schedule') == 0
+    assert client.post('/api/feed', json={'feed_type': 'Layer', 'amount': 50}).status_code == 201
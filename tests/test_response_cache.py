@@ -0,0 +1,48 @@
+import sqlite3
+
+from models.database import db
+
+
+def insert_chicken_elsewhere(name):
+    """Add a chicken the way another worker process would, without events"""
+    conn = sqlite3.connect(db.database)
+    with conn:
+        conn.execute("INSERT INTO chickens (name, breed, age, date_added) VALUES (?, 'Leghorn', 20, datetime('now'))",
+                     (name,))
+    conn.close()
+
+
+def test_cached_dashboard_follows_writes_of_this_process(client):
+    first = client.get('/api/dashboard')
+    assert first.headers['X-Cache'] == 'MISS'
+    assert client.get('/api/dashboard').headers['X-Cache'] == 'HIT'
+
+    client.post('/api/chickens', json={'name': 'Second', 'breed': 'Leghorn', 'age': 20})
+    response = client.get('/api/dashboard')
+    assert response.headers['X-Cache'] == 'MISS'
+    assert response.get_json()['total_chickens'] == 2
+    assert response.headers['ETag'] != first.headers['ETag']
+
+
+def test_cached_dashboard_follows_writes_of_other_processes(client):
+    first = client.get('/api/dashboard')
+    assert first.get_json()['total_chickens'] == 1
+
+    insert_chicken_elsewhere('Second')
+    response = client.get('/api/dashboard')
+    assert response.headers['X-Cache'] == 'MISS'
+    assert response.get_json()['total_chickens'] == 2
+    assert response.headers['ETag'] != first.headers['ETag']
+
+
+def test_etag_answers_304_until_the_data_changes(client):
+    etag = client.get('/api/dashboard').headers['ETag']
+    assert client.get('/api/dashboard', headers={'If-None-Match': etag}).status_code == 304
+
+    insert_chicken_elsewhere('Second')
+    response = client.get('/api/dashboard', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json()['total_chickens'] == 2
+    # The new tag labels the new body, and now revalidates
+    assert client.get('/api/dashboard', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
@@ -0,0 +1,98 @@
+from datetime import date, timedelta
+
+import pytest
+
+from models.chicken_model import ChickenModel
+from models.database import get_connection
+from models.farm_model import FarmModel
+
+
+def days_ago(days):
+    return (date.today() - timedelta(days=days)).isoformat()
+
+
+def derived_rows():
+    """egg_daily_totals and chicken_features as stored, features brought up to date"""
+    conn = get_connection()
+    FarmModel().get_chicken_features()
+    return (
+        sorted(conn.execute('SELECT day, IFNULL(chicken_id, 0), quantity, records FROM egg_daily_totals')),
+        sorted(conn.execute('SELECT * FROM chicken_features'))
+    )
+
+
+def assert_matches_rebuild():
+    """The incrementally kept rollup and feature store equal ones recomputed from the raw records"""
+    kept = derived_rows()
+    farm = FarmModel()
+    farm.rebuild_egg_rollups()
+    farm.rebuild_chicken_features()
+    assert kept == derived_rows()
+
+
+@pytest.fixture
+def second_hen(farm_db):
+    return ChickenModel().add_chicken({'name': 'Second', 'breed': 'Sussex', 'age': 40})
+
+
+def test_single_records_keep_rollup_and_features_consistent(client, farm_db, second_hen):
+    for chicken_id, days, quantity in ((farm_db, 0, 3), (farm_db, 0, 2), (farm_db, 10, 4),
+                                       (farm_db, 40, 5), (second_hen, 1, 1)):
+        data = {'chicken_id': chicken_id, 'date': days_ago(days), 'quantity': quantity}
+        assert client.post('/api/eggs', json=data).status_code == 201
+    for chicken_id, days, status in ((farm_db, 2, 'sick'), (farm_db, 20, 'injured'), (second_hen, 0, 'healthy')):
+        data = {'chicken_id': chicken_id, 'date': days_ago(days), 'health_status': status}
+        assert client.post('/api/health', json=data).status_code == 201
+
+    assert_matches_rebuild()
+
+
+def test_bulk_records_keep_rollup_and_features_consistent(farm_db, second_hen):
+    farm = FarmModel()
+    farm.record_egg_production_bulk([
+        {'chicken_id': farm_db, 'date': days_ago(0), 'quantity': 2},
+        {'chicken_id': farm_db, 'date': days_ago(0), 'quantity': 1},
+        {'chicken_id': second_hen, 'date': days_ago(8), 'quantity': 6},
+        # Refused rows leave no trace
+        {'chicken_id': second_hen, 'quantity': 'six'},
+    ])
+    farm.record_health_check_bulk([
+        {'chicken_id': farm_db, 'date': days_ago(3), 'health_status': 'sick'},
+        {'chicken_id': second_hen, 'date': days_ago(25), 'health_status': 'recovery'},
+    ])
+
+    assert_matches_rebuild()
+
+
+def test_chicken_update_and_delete_keep_rollup_and_features_consistent(farm_db, second_hen):
+    farm = FarmModel()
+    chickens = ChickenModel()
+    for chicken_id in (farm_db, second_hen):
+        farm.record_egg_production({'chicken_id': chicken_id, 'date': days_ago(1), 'quantity': 3})
+        farm.record_health_check({'chicken_id': chicken_id, 'date': days_ago(1), 'health_status': 'sick'})
+
+    chickens.update_chicken(second_hen, {'name': 'Second', 'breed': 'Sussex', 'age': 41, 'health_status': 'sick'})
+    assert_matches_rebuild()
+
+    chickens.delete_chicken(farm_db)
+    # The records are kept, detached, and roll up under no chicken
+    assert get_connection().execute('SELECT COUNT(*) FROM egg_production WHERE chicken_id IS NULL').fetchone()[0] == 1
+    assert farm.get_chicken_features().keys() == {second_hen}
+    assert_matches_rebuild()
+
+    # A later record of the remaining hen lands beside the detached rollup row
+    farm.record_egg_production_bulk([{'chicken_id': second_hen, 'date': days_ago(1), 'quantity': 2}])
+    assert_matches_rebuild()
+
+
+def test_deleting_a_chicken_changes_the_etag_of_its_egg_summary(client, farm_db):
+    client.post('/api/eggs', json={'chicken_id': farm_db, 'quantity': 3})
+    path = f'/api/eggs/summary?chicken_id={farm_db}'
+    first = client.get(path)
+    assert sum(first.get_json()['totals']) == 3
+    assert client.get(path, headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+    assert client.delete(f'/api/chickens/{farm_db}').status_code == 200
+    response = client.get(path, headers={'If-None-Match': first.headers['ETag']})
+    assert response.status_code == 200
+    assert sum(response.get_json()['totals']) == 0